@@ -7,8 +7,10 @@ Basedataset class for all kinds of fusion.
 """
 
 import os
+import json
 import math
 from collections import OrderedDict
+from itertools import islice
 
 import torch
 import numpy as np
@@ -16,6 +18,9 @@ from torch.utils.data import Dataset
 
 import opencood.utils.pcd_utils as pcd_utils
 from opencood.data_utils.augmentor.data_augmentor import DataAugmentor
+from opencood.data_utils.datasets.metadata_cache import MetadataCache
+from opencood.data_utils.datasets.scenario_index import ScenarioIndex, \
+    cache_file_prefix
 from opencood.hypes_yaml.yaml_utils import load_yaml
 from opencood.utils.pcd_utils import downsample_lidar_minimum
 from opencood.utils.transformation_utils import x1_to_x2
@@ -38,10 +43,12 @@ class BaseDataset(Dataset):
 
     Attributes
     ----------
-    scenario_database : OrderedDict
-        A structured dictionary contains all file information.
+    scenario_database : ScenarioIndex
+        A structured mapping contains all file information. It is backed
+        by a memory-mapped index file that is rebuilt when the dataset
+        folders change.
 
-    len_record : list
+    len_record : np.ndarray
         The list to record each scenario's data length. This is used to
         retrieve the correct index during training.
 
@@ -104,6 +111,13 @@ class BaseDataset(Dataset):
             self.transmission_speed = 27  # Mbps
             self.backbone_delay = 0  # ms
 
+        # 'pcd' reads every frame file, 'packed' reads the memory-mapped
+        # files written by opencood/tools/pack_dataset.py
+        self.data_format = params['data_format'] \
+            if 'data_format' in params else 'pcd'
+        assert self.data_format in ['pcd', 'packed'], \
+            'Unknown data_format %s' % self.data_format
+
         if self.train:
             root_dir = params['root_dir']
         else:
@@ -115,93 +129,23 @@ class BaseDataset(Dataset):
         else:
             self.max_cav = params['train_params']['max_cav']
 
-        # first load all paths of different scenarios
-        scenario_folders = sorted([os.path.join(root_dir, x)
-                                   for x in os.listdir(root_dir) if
-                                   os.path.isdir(os.path.join(root_dir, x))])
+        # load all paths of different scenarios from the prebuilt index.
         # Structure: {scenario_id : {cav_1 : {timestamp1 : {yaml: path,
         # lidar: path, cameras:list of path}}}}
-        self.scenario_database = OrderedDict()
-        self.len_record = []
-
-        valid_index = 0
-        # loop over all scenarios
-        for (_, scenario_folder) in enumerate(scenario_folders):
-            if not os.path.isdir(os.path.join(scenario_folder, 'cooperative')):
-                continue
-            self.scenario_database.update({valid_index: OrderedDict()})
-            
-            # at least 1 cav should show up
-            cav_list = sorted([x for x in os.listdir(scenario_folder)
-                               if os.path.isdir(
-                    os.path.join(scenario_folder, x)) and x != '3' and x != 'cooperative'])
-            assert len(cav_list) > 0
-
-            # print(cav_list)
-
-            # roadside unit data's id is always negative, so here we want to
-            # make sure they will be in the end of the list as they shouldn't
-            # be ego vehicle.
-            if int(cav_list[0]) < 0:
-                cav_list = cav_list[1:] + [cav_list[0]]
-
-            # loop over all CAV data
-            for (j, cav_id) in enumerate(cav_list):
-                if j > self.max_cav - 1:
-                    print('too many cavs')
-                    break
-                self.scenario_database[valid_index][cav_id] = OrderedDict()
-
-                # save all yaml files to the dictionary
-                json_path = os.path.join(scenario_folder, 'cooperative')
-                cav_path = os.path.join(scenario_folder, cav_id)
-
-                # use the frame number as key, the full path as the values
-                yaml_files = \
-                    sorted([os.path.join(json_path, x)
-                            for x in os.listdir(json_path) if
-                            x.endswith('.json') and 'additional' not in x])
-                timestamps = self.extract_timestamps(yaml_files)
-
-                for timestamp in timestamps:
-                    self.scenario_database[valid_index][cav_id][timestamp] = \
-                        OrderedDict()
-                    
-                    json_file = os.path.join(json_path,
-                                             timestamp + '.json')
-                    yaml_file = os.path.join(cav_path,
-                                             timestamp + '.yaml')
-                    lidar_file = os.path.join(cav_path,
-                                              timestamp + '.pcd')
-                    camera_files = self.load_camera_files(cav_path, timestamp)
-
-                    self.scenario_database[valid_index][cav_id][timestamp]['json'] = \
-                        json_file
-                    self.scenario_database[valid_index][cav_id][timestamp]['yaml'] = \
-                        yaml_file
-                    self.scenario_database[valid_index][cav_id][timestamp]['lidar'] = \
-                        lidar_file
-                    self.scenario_database[valid_index][cav_id][timestamp]['camera0'] = \
-                        camera_files
-                # Assume all cavs will have the same timestamps length. Thus
-                # we only need to calculate for the first vehicle in the
-                # scene.
-                if j == 0:#front is the ego
-                    # we regard the agent with the minimum id as the ego
-                    self.scenario_database[valid_index][cav_id]['ego'] = True
-                    if not self.len_record:
-                        self.len_record.append(len(timestamps))
-                    else:
-                        prev_last = self.len_record[-1]
-                        self.len_record.append(prev_last + len(timestamps))
-                else:
-                    self.scenario_database[valid_index][cav_id]['ego'] = False
-
-                    # print(self.scenario_database)
-            valid_index += 1
+        cache_prefix = cache_file_prefix(params['index_dir'], root_dir) \
+            if 'index_dir' in params else None
+        self.scenario_database = ScenarioIndex(
+            root_dir,
+            self.max_cav,
+            cache_prefix + '.index' if cache_prefix else None)
+        self.len_record = self.scenario_database.len_record
+
+        # parsed yaml/json records, persisted only when index_dir is given
+        self.metadata_cache = MetadataCache(
+            cache_prefix + '.metadata.sqlite' if cache_prefix else None)
 
     def __len__(self):
-        return self.len_record[-1]
+        return int(self.len_record[-1])
 
     def __getitem__(self, idx):
         """
@@ -230,23 +174,15 @@ class BaseDataset(Dataset):
             The dictionary contains loaded yaml params and lidar data for
             each cav.
         """
-        # we loop the accumulated length list to see get the scenario index
-        scenario_index = 0
-        for i, ele in enumerate(self.len_record):
-            # print(idx)
-            if idx < ele:
-                scenario_index = i
-                break
-        # print(len(self.scenario_database), scenario_index)
-        # print(type(self.scenario_database))
+        # the flat index maps the sample to its scenario in constant time
+        scenario_index, timestamp_index = \
+            self.scenario_database.locate(idx)
         scenario_database = self.scenario_database[scenario_index]
 
-        # check the timestamp index
-        timestamp_index = idx if scenario_index == 0 else \
-            idx - self.len_record[scenario_index - 1]
         # retrieve the corresponding timestamp key
-        timestamp_key = self.return_timestamp_key(scenario_database,
-                                                  timestamp_index)
+        timestamp_key = \
+            self.scenario_database.timestamp_key(scenario_index,
+                                                 timestamp_index)
         # calculate distance to ego for each cav
         ego_cav_content = \
             self.calc_dist_to_ego(scenario_database, timestamp_key)
@@ -264,8 +200,9 @@ class BaseDataset(Dataset):
             if timestamp_index - timestamp_delay <= 0:
                 timestamp_delay = timestamp_index
             timestamp_index_delay = max(0, timestamp_index - timestamp_delay)
-            timestamp_key_delay = self.return_timestamp_key(scenario_database,
-                                                            timestamp_index_delay)
+            timestamp_key_delay = \
+                self.scenario_database.timestamp_key(scenario_index,
+                                                     timestamp_index_delay)
             # add time delay to vehicle parameters
             data[cav_id]['time_delay'] = timestamp_delay
             # load the corresponding data into the dictionary
@@ -274,10 +211,31 @@ class BaseDataset(Dataset):
                                                        timestamp_key,
                                                        timestamp_key_delay,
                                                        cur_ego_pose_flag)
+            data[cav_id]['lidar_file'] = \
+                cav_content[timestamp_key_delay]['lidar']
             data[cav_id]['lidar_np'] = \
-                pcd_utils.pcd_to_np(cav_content[timestamp_key_delay]['lidar'])
+                self.load_lidar(data[cav_id]['lidar_file'])
         return data
 
+    def load_lidar(self, lidar_file):
+        """
+        Load the point cloud of a frame in the configured data format.
+
+        Parameters
+        ----------
+        lidar_file : str
+            The pcd file path of the frame.
+
+        Returns
+        -------
+        lidar_np : np.ndarray
+            The lidar data, shape: (n, 4).
+        """
+        if self.data_format == 'packed':
+            return pcd_utils.packed_pcd_to_np(
+                *pcd_utils.packed_frame(lidar_file))
+        return pcd_utils.pcd_to_np(lidar_file)
+
     @staticmethod
     def extract_timestamps(yaml_files):
         """
@@ -323,9 +281,9 @@ class BaseDataset(Dataset):
             The timestamp key saved in the cav dictionary.
         """
         # get all timestamp keys
-        timestamp_keys = list(scenario_database.items())[0][1]
+        timestamp_keys = next(iter(scenario_database.values()))
         # retrieve the correct index
-        timestamp_key = list(timestamp_keys.items())[timestamp_index][0]
+        timestamp_key = next(islice(timestamp_keys, timestamp_index, None))
 
         return timestamp_key
 
@@ -339,16 +297,16 @@ class BaseDataset(Dataset):
         for cav_id, cav_content in scenario_database.items():
             if cav_content['ego']:
                 ego_cav_content = cav_content
-                ego_lidar_pose = \
-                    load_yaml(cav_content[timestamp_key]['yaml'])['lidar_pose']
+                ego_lidar_pose = self.load_frame_yaml(
+                    cav_content[timestamp_key]['yaml'])['lidar_pose']
                 break
 
         assert ego_lidar_pose is not None
 
         # calculate the distance
         for cav_id, cav_content in scenario_database.items():
-            cur_lidar_pose = \
-                load_yaml(cav_content[timestamp_key]['yaml'])['lidar_pose']
+            cur_lidar_pose = self.load_frame_yaml(
+                cav_content[timestamp_key]['yaml'])['lidar_pose']
             # print(ego_lidar_pose)
             distance = \
                 math.sqrt((cur_lidar_pose[0] -
@@ -445,15 +403,20 @@ class BaseDataset(Dataset):
         ------
         The merged parameters.
         """
-        cur_params = load_yaml(cav_content[timestamp_cur]['yaml'])
-        delay_params = load_yaml(cav_content[timestamp_delay]['yaml'])
+        cur_params = self.load_frame_yaml(cav_content[timestamp_cur]['yaml'])
+        # the cached record is shared, copy it before adding new keys
+        delay_params = \
+            dict(self.load_frame_yaml(cav_content[timestamp_delay]['yaml']))
 
-        cur_json = load_yaml(cav_content[timestamp_cur]['json'])
-        delay_json = load_yaml(cav_content[timestamp_delay]['json'])
-        # print(cur_params)
+        cur_json = \
+            self.load_cooperative_json(cav_content[timestamp_cur]['json'])
+        delay_json = \
+            self.load_cooperative_json(cav_content[timestamp_delay]['json'])
 
-        cur_ego_params = load_yaml(ego_content[timestamp_cur]['yaml'])
-        delay_ego_params = load_yaml(ego_content[timestamp_delay]['yaml'])
+        cur_ego_params = \
+            self.load_frame_yaml(ego_content[timestamp_cur]['yaml'])
+        delay_ego_params = \
+            self.load_frame_yaml(ego_content[timestamp_delay]['yaml'])
 
         # we need to calculate the transformation matrix from cav to ego
         # at the delayed timestamp
@@ -488,15 +451,7 @@ class BaseDataset(Dataset):
 
         
         # we always use current timestamp's gt bbx to gain a fair evaluation
-        vehicles = {}
-        for item in cur_json:
-            if not isinstance(item, dict):
-                continue
-            if 'objects' in item and item['objects'] is not None:
-                parsed_vehicles = self.parse_objects_to_vehicles(item['objects'])
-                vehicles.update(parsed_vehicles)
-        # delay_params['vehicles'] = vehicles
-        # delay_params['vehicles'] = self.parse_objects_to_vehicles(cur_json[-1]['objects'])
+        vehicles = cur_json['vehicles']
         if cav_content['ego']:
             delay_params['vehicles'] = vehicles
             delay_params['transformation_matrix'] = transformation_matrix
@@ -504,13 +459,85 @@ class BaseDataset(Dataset):
                 gt_transformation_matrix
         else:
             delay_params['vehicles'] = vehicles
-            delay_params['transformation_matrix'] = np.array(delay_json[0]["pairwise_t_matrix1"])
+            delay_params['transformation_matrix'] = \
+                np.array(delay_json['pairwise_t_matrix1'])
             delay_params['gt_transformation_matrix'] = \
-                np.array(cur_json[0]["pairwise_t_matrix1"])
+                np.array(cur_json['pairwise_t_matrix1'])
         delay_params['spatial_correction_matrix'] = spatial_correction_matrix
 
         return delay_params
 
+    def load_frame_yaml(self, yaml_file):
+        """
+        Load the yaml of a single cav frame through the metadata cache. The
+        returned dictionary is shared and must not be modified.
+        """
+        return self.metadata_cache.load(yaml_file, 'frame',
+                                        self.parse_frame_yaml)
+
+    def load_cooperative_json(self, json_file):
+        """
+        Load the parsed cooperative json of a frame through the metadata
+        cache. The returned record is shared and must not be modified.
+        """
+        return self.metadata_cache.load(json_file, 'cooperative',
+                                        self.parse_cooperative_json)
+
+    @staticmethod
+    def parse_frame_yaml(yaml_file):
+        """
+        Parse the yaml of a single cav frame into a compact record.
+
+        Parameters
+        ----------
+        yaml_file : str
+            The yaml of a cav frame.
+
+        Returns
+        -------
+        record : dict
+            lidar_pose : list, the lidar pose of the cav.
+            ego_speed : float, the speed of the cav, if annotated.
+        """
+        yaml_content = load_yaml(yaml_file)
+        return {key: yaml_content[key] for key in ['lidar_pose', 'ego_speed']
+                if key in yaml_content}
+
+    @classmethod
+    def parse_cooperative_json(cls, json_file):
+        """
+        Parse the cooperative json into a compact record.
+
+        Parameters
+        ----------
+        json_file : str
+            The cooperative json of a frame.
+
+        Returns
+        -------
+        record : dict
+            vehicles : dict of all annotated objects, key: object id.
+            pairwise_t_matrix1 : np.ndarray or None, the transformation
+            matrix from the other cav to ego.
+        """
+        with open(json_file, 'r') as f:
+            json_content = json.load(f)
+
+        vehicles = {}
+        for item in json_content:
+            if not isinstance(item, dict):
+                continue
+            if 'objects' in item and item['objects'] is not None:
+                vehicles.update(cls.parse_objects_to_vehicles(item['objects']))
+
+        pairwise_t_matrix = None
+        if len(json_content) > 0 and isinstance(json_content[0], dict) and \
+                'pairwise_t_matrix1' in json_content[0]:
+            pairwise_t_matrix = np.array(json_content[0]['pairwise_t_matrix1'])
+
+        return {'vehicles': vehicles,
+                'pairwise_t_matrix1': pairwise_t_matrix}
+
     @staticmethod
     def parse_objects_to_vehicles(objects):
         # print(objects)
@@ -80,10 +80,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
             object_id_stack += selected_cav_processed['object_ids']
 
         # exclude all repetitive objects
-        unique_indices = \
-            [object_id_stack.index(x) for x in set(object_id_stack)]
-        object_stack = np.vstack(object_stack)
-        object_stack = object_stack[unique_indices]
+        object_stack, unique_indices = \
+            box_utils.merge_object_stacks(object_stack, object_id_stack)
 
         # make sure bounding boxes across all frames have the same number
         object_bbx_center = \
@@ -205,8 +203,9 @@ class EarlyFusionDataset(basedataset.BaseDataset):
         batch : dict
             Reformatted batch.
         """
-        # currently, we only support batch size of 1 during testing
-        assert len(batch) <= 1, "Batch size 1 is required during testing!"
+        if len(batch) > 1:
+            return self.collate_batch_test_multi_frames(batch)
+
         batch = batch[0]
 
         output_dict = {}
@@ -258,6 +257,38 @@ class EarlyFusionDataset(basedataset.BaseDataset):
 
         return output_dict
 
+    def collate_batch_test_multi_frames(self, batch):
+        """
+        Collate several frames for batched testing. Every frame only has
+        the ego content in early fusion.
+
+        Parameters
+        ----------
+        batch : list
+            List of the frames.
+
+        Returns
+        -------
+        batch : dict
+            Reformatted batch, where 'object_ids' is the list of the object
+            ids of every frame.
+        """
+        output_dict = self.collate_batch_train(batch)
+
+        # the anchor box is the same for all frames
+        if batch[0]['ego']['anchor_box'] is not None:
+            output_dict['ego'].update({'anchor_box':
+                torch.from_numpy(np.array(batch[0]['ego']['anchor_box']))})
+
+        # save the transformation matrix (4, 4) to ego vehicle
+        transformation_matrix_torch = \
+            torch.from_numpy(np.identity(4)).float()
+        output_dict['ego'].update({
+            'object_ids': [x['ego']['object_ids'] for x in batch],
+            'transformation_matrix': transformation_matrix_torch})
+
+        return output_dict
+
     def post_process(self, data_dict, output_dict):
         """
         Process the outputs of the model to 2D/3D bounding box.
@@ -273,10 +304,19 @@ class EarlyFusionDataset(basedataset.BaseDataset):
         Returns
         -------
         pred_box_tensor : torch.Tensor
-            The tensor of prediction bounding box after NMS.
+            The tensor of prediction bounding box after NMS. A list of the
+            tensors of every frame if the batch size is larger than 1.
         gt_box_tensor : torch.Tensor
             The tensor of gt bounding box.
         """
+        if data_dict['ego']['object_bbx_center'].shape[0] > 1:
+            pred_box_tensor, pred_score = \
+                self.post_processor.post_process_batch(data_dict,
+                                                       output_dict)
+            gt_box_tensor = self.post_processor.generate_gt_bbx_batch(
+                data_dict)
+            return pred_box_tensor, pred_score, gt_box_tensor
+
         pred_box_tensor, pred_score = \
             self.post_processor.post_process(data_dict, output_dict)
         gt_box_tensor = self.post_processor.generate_gt_bbx(data_dict)
@@ -66,10 +66,8 @@ class EarlyFusionVisDataset(basedataset.BaseDataset):
             object_id_stack += selected_cav_processed['object_ids']
 
         # exclude all repetitive objects
-        unique_indices = \
-            [object_id_stack.index(x) for x in set(object_id_stack)]
-        object_stack = np.vstack(object_stack)
-        object_stack = object_stack[unique_indices]
+        object_stack, unique_indices = \
+            box_utils.merge_object_stacks(object_stack, object_id_stack)
 
         # make sure bounding boxes across all frames have the same number
         object_bbx_center = \
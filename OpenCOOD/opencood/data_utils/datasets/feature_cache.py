@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+On-disk cache of the preprocessed lidar features (voxels/pillars/bev).
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from opencood.utils import pcd_utils
+
+
+class FeatureCache(object):
+    """
+    Save the output of pre_processor.preprocess for a single cav frame, so
+    the same frame is only voxelized once across epochs and runs. Every
+    entry is a npz file named by the hash of the frame, the projection and
+    the preprocess config, thus changing any of them never hits a stale
+    entry. The frame is identified by its path, modification time and
+    size, so a re-generated file at the same path is preprocessed again.
+    Packed frames are identified by the packed file of their scenario and
+    their name in it, the pcd files may not exist anymore.
+
+    The features must not depend on a random point order, e.g. the
+    shuffle before voxelization, otherwise the cache freezes the order of
+    the run that wrote it.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The folder to save the features.
+
+    config : dict
+        Everything that changes the features besides the frame itself,
+        e.g. the preprocess section of the hypes yaml.
+
+    data_format : str
+        'pcd' or 'packed', where the frames are read from.
+    """
+
+    def __init__(self, cache_dir, config, data_format='pcd'):
+        self.cache_dir = cache_dir
+        self.data_format = data_format
+        # numpy values (e.g. grid size) are dumped through str
+        config = json.dumps(config, sort_keys=True, default=str)
+        self.config_hash = hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+    def key(self, lidar_file, transformation_matrix=None):
+        """
+        Compute the cache key of a cav frame.
+
+        Parameters
+        ----------
+        lidar_file : str
+            The lidar file of the frame, which identifies the scenario,
+            the cav and the timestamp. Its modification time and size are
+            part of the key, or those of the packed file of the scenario
+            for packed frames.
+
+        transformation_matrix : np.ndarray
+            The (4, 4) matrix the lidar is projected with before
+            preprocessing, None if it is not projected.
+
+        Returns
+        -------
+        key : str
+        """
+        sha1 = hashlib.sha1(self.config_hash.encode('utf-8'))
+        if self.data_format == 'packed':
+            pack_file, frame_name = pcd_utils.packed_frame(lidar_file)
+            sha1.update(os.path.abspath(pack_file).encode('utf-8'))
+            sha1.update(frame_name.encode('utf-8'))
+            # stat once when the file is mapped instead of every frame
+            file_stat = pcd_utils.load_packed_pcd(pack_file)[1]['file_stat']
+        else:
+            sha1.update(os.path.abspath(lidar_file).encode('utf-8'))
+            stat = os.stat(lidar_file)
+            file_stat = [stat.st_mtime_ns, stat.st_size]
+        sha1.update(np.array(file_stat, dtype=np.int64).tobytes())
+        if transformation_matrix is not None:
+            sha1.update(np.ascontiguousarray(transformation_matrix,
+                                             dtype=np.float64).tobytes())
+        return sha1.hexdigest()
+
+    def cache_file(self, key):
+        # two-level folders keep the directory listing small
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def load(self, key):
+        """
+        Return the cached feature dictionary, or None on a miss.
+        """
+        cache_file = self.cache_file(key)
+        if not os.path.isfile(cache_file):
+            return None
+        try:
+            with np.load(cache_file) as features:
+                return {name: features[name] for name in features.files}
+        except (OSError, ValueError) as e:
+            print('Can not load feature cache %s: %s' % (cache_file, e))
+            return None
+
+    def save(self, key, features):
+        """
+        Save the feature dictionary of a cav frame.
+        """
+        cache_file = self.cache_file(key)
+        tmp_file = '%s.%d.tmp.npz' % (cache_file[:-4], os.getpid())
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            np.savez(tmp_file, **features)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print('Can not save feature cache %s: %s' % (cache_file, e))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
@@ -17,6 +17,7 @@ import opencood.data_utils.datasets
 import opencood.data_utils.post_processor as post_processor
 from opencood.utils import box_utils
 from opencood.data_utils.datasets import basedataset
+from opencood.data_utils.datasets.feature_cache import FeatureCache
 from opencood.data_utils.pre_processor import build_preprocessor
 from opencood.utils.pcd_utils import \
     mask_points_by_range, mask_ego_points, shuffle_points, \
@@ -53,6 +54,16 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             params['postprocess'],
             train)
 
+        # the points are shuffled randomly during training, so the
+        # preprocessed features are only cached out of train mode.
+        self.feature_cache = None
+        if 'feature_cache_dir' in params and not train:
+            self.feature_cache = FeatureCache(
+                params['feature_cache_dir'],
+                {'preprocess': params['preprocess'],
+                 'data_format': self.data_format},
+                self.data_format)
+
     def __getitem__(self, idx):
         base_data_dict = self.retrieve_base_data(idx,
                                                  cur_ego_pose_flag=self.cur_ego_pose_flag)
@@ -130,10 +141,8 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
                     selected_cav_processed['projected_lidar'])
 
         # exclude all repetitive objects
-        unique_indices = \
-            [object_id_stack.index(x) for x in set(object_id_stack)]
-        object_stack = np.vstack(object_stack)
-        object_stack = object_stack[unique_indices]
+        object_stack, unique_indices = \
+            box_utils.merge_object_stacks(object_stack, object_id_stack)
 
         # make sure bounding boxes across all frames have the same number
         object_bbx_center = \
@@ -215,7 +224,11 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
 
         # filter lidar
         lidar_np = selected_cav_base['lidar_np']
-        lidar_np = shuffle_points(lidar_np)
+        # the cached features keep the points of a voxel in the file order,
+        # otherwise they would freeze one random max_points_per_voxel
+        # truncation
+        if self.feature_cache is None:
+            lidar_np = shuffle_points(lidar_np)
         # remove points that hit itself
         lidar_np = mask_ego_points(lidar_np)
         # project the lidar to ego space
@@ -226,7 +239,17 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         lidar_np = mask_points_by_range(lidar_np,
                                         self.params['preprocess'][
                                             'cav_lidar_range'])
-        processed_lidar = self.pre_processor.preprocess(lidar_np)
+
+        processed_lidar = None
+        if self.feature_cache is not None:
+            cache_key = self.feature_cache.key(
+                selected_cav_base['lidar_file'],
+                transformation_matrix if self.proj_first else None)
+            processed_lidar = self.feature_cache.load(cache_key)
+        if processed_lidar is None:
+            processed_lidar = self.pre_processor.preprocess(lidar_np)
+            if self.feature_cache is not None:
+                self.feature_cache.save(cache_key, processed_lidar)
 
         # velocity
         velocity = selected_cav_base['params']['ego_speed']
@@ -366,9 +389,13 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         return output_dict
 
     def collate_batch_test(self, batch):
-        assert len(batch) <= 1, "Batch size 1 is required during testing!"
         output_dict = self.collate_batch_train(batch)
 
+        # keep the object ids of every frame when testing with batches
+        if len(batch) > 1:
+            output_dict['ego']['object_ids'] = \
+                [x['ego']['object_ids'] for x in batch]
+
         # check if anchor box in the batch
         if batch[0]['ego']['anchor_box'] is not None:
             output_dict['ego'].update({'anchor_box':
@@ -399,10 +426,19 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         Returns
         -------
         pred_box_tensor : torch.Tensor
-            The tensor of prediction bounding box after NMS.
+            The tensor of prediction bounding box after NMS. A list of the
+            tensors of every frame if the batch size is larger than 1.
         gt_box_tensor : torch.Tensor
             The tensor of gt bounding box.
         """
+        if data_dict['ego']['object_bbx_center'].shape[0] > 1:
+            pred_box_tensor, pred_score = \
+                self.post_processor.post_process_batch(data_dict,
+                                                       output_dict)
+            gt_box_tensor = self.post_processor.generate_gt_bbx_batch(
+                data_dict)
+            return pred_box_tensor, pred_score, gt_box_tensor
+
         pred_box_tensor, pred_score = \
             self.post_processor.post_process(data_dict, output_dict)
         gt_box_tensor = self.post_processor.generate_gt_bbx(data_dict)
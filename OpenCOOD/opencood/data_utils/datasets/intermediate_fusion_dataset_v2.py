@@ -91,10 +91,8 @@ class IntermediateFusionDatasetV2(basedataset.BaseDataset):
                     selected_cav_processed['projected_lidar'])
 
         # exclude all repetitive objects
-        unique_indices = \
-            [object_id_stack.index(x) for x in set(object_id_stack)]
-        object_stack_all = np.vstack(object_stack)
-        object_stack_all = object_stack_all[unique_indices]
+        object_stack_all, unique_indices = \
+            box_utils.merge_object_stacks(object_stack, object_id_stack)
 
         # make sure bounding boxes across all frames have the same number
         object_bbx_center = \
@@ -126,14 +124,12 @@ class IntermediateFusionDatasetV2(basedataset.BaseDataset):
                                                                 3, 6]])
             cur_mask = point_indices.sum(axis=1) > 0
             if cur_mask.sum() == 0:
-                label_dict_no_coop.append({
-                    'pos_equal_one': np.zeros((*anchor_box.shape[:2],
-                                               self.post_processor.anchor_num)),
-                    'neg_equal_one': np.ones((*anchor_box.shape[:2],
-                                              self.post_processor.anchor_num)),
-                    'targets': np.zeros((*anchor_box.shape[:2],
-                                         self.post_processor.anchor_num * 7))
-                })
+                # all anchors are negative, in the configured label format
+                label_dict_no_coop.append(
+                    self.post_processor.generate_label(
+                        gt_box_center=np.zeros((1, 7)),
+                        anchors=anchor_box,
+                        mask=np.zeros(1)))
                 continue
             object_stack_filtered.append(boxes[cur_mask])
             bbx_center = \
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Cache of the parsed per-frame yaml/json metadata.
+"""
+
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class MetadataCache(object):
+    """
+    Parse every metadata file only once. Parsed records are kept in an
+    in-process LRU and, optionally, in a sqlite file shared by all
+    processes and runs. A persisted record is reused as long as the mtime
+    and size of its source file are unchanged. New records are written in
+    batches so that the processes do not contend for the write lock on
+    every miss.
+
+    Parameters
+    ----------
+    db_path : str
+        The sqlite file. If None, only the in-process LRU is used.
+
+    lru_size : int
+        Maximum number of records kept in memory per process.
+
+    flush_size : int
+        Number of new records written to the sqlite file at once.
+
+    flush_interval : float
+        Maximum number of seconds a new record waits to be written.
+    """
+
+    def __init__(self, db_path=None, lru_size=4096, flush_size=256,
+                 flush_interval=10.0):
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # records parsed by this process and not yet written
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+        self.connection = None
+        # sqlite connections can not be shared across forked workers
+        self.connection_pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        state['connection_pid'] = None
+        state['lru'] = OrderedDict()
+        state['pending'] = []
+        return state
+
+    def __del__(self):
+        self.flush()
+
+    def get_connection(self):
+        """
+        Open the sqlite file once per process.
+        """
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.db_path, timeout=60)
+            # readers do not block the writer and the other way round
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            # it is only a cache, losing the last writes on a crash is fine
+            self.connection.execute('PRAGMA synchronous = OFF')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                'path TEXT, kind TEXT, mtime_ns INTEGER, size INTEGER, '
+                'data BLOB, PRIMARY KEY (path, kind))')
+            self.connection.commit()
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def load(self, path, kind, parser):
+        """
+        Return the parsed record of a metadata file.
+
+        Parameters
+        ----------
+        path : str
+            The metadata file.
+
+        kind : str
+            Name of the record type, so the same file can be cached with
+            different parsers.
+
+        parser : callable
+            Convert the file path to the record, only called on a miss.
+
+        Returns
+        -------
+        record : object
+            The parsed record. It is shared by all callers and must be
+            treated as read-only.
+        """
+        key = (path, kind)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+
+        if self.db_path is not None:
+            record = self.load_persistent(path, kind, parser)
+        else:
+            record = parser(path)
+
+        self.lru[key] = record
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+        return record
+
+    def load_persistent(self, path, kind, parser):
+        """
+        Load the record from the sqlite file, or parse and save it.
+        """
+        stat = os.stat(path)
+        try:
+            connection = self.get_connection()
+            row = connection.execute(
+                'SELECT mtime_ns, size, data FROM records '
+                'WHERE path = ? AND kind = ?', (path, kind)).fetchone()
+        except sqlite3.Error as e:
+            print('Can not read metadata cache %s: %s' % (self.db_path, e))
+            self.db_path = None
+            return parser(path)
+
+        if row is not None and row[0] == stat.st_mtime_ns and \
+                row[1] == stat.st_size:
+            return pickle.loads(row[2])
+
+        record = parser(path)
+        self.pending.append(
+            (path, kind, stat.st_mtime_ns, stat.st_size,
+             pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)))
+        if len(self.pending) >= self.flush_size or \
+                time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+        return record
+
+    def flush(self):
+        """
+        Write the pending records to the sqlite file in one transaction.
+        """
+        self.last_flush = time.monotonic()
+        if not self.pending or self.db_path is None:
+            return
+        pending = self.pending
+        self.pending = []
+        try:
+            connection = self.get_connection()
+            connection.executemany(
+                'INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)',
+                pending)
+            connection.commit()
+        except sqlite3.Error as e:
+            print('Can not write metadata cache %s: %s' % (self.db_path, e))
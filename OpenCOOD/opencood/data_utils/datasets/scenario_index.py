@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Persistent, memory-mapped index of the scenario/cav/timestamp layout.
+"""
+
+import os
+import json
+import hashlib
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from functools import lru_cache
+
+import numpy as np
+
+
+INDEX_MAGIC = b'OCIDX\x00\x01\x00'
+INDEX_VERSION = 2
+INDEX_FILE_NAME = '.scenario_index.bin'
+# every column starts at a multiple of this many bytes
+COLUMN_ALIGN = 64
+
+
+def user_cache_dir():
+    """
+    The per-user folder of the index files of the datasets that can not be
+    written to.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'opencood')
+
+
+def cache_file_prefix(cache_dir, root_dir):
+    """
+    Path prefix of the cache files of a dataset folder. The folder name is
+    followed by a hash of its absolute path, so the datasets whose folders
+    share the same name (e.g. train/validate of different releases) do not
+    overwrite each other.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The folder of the cache files.
+
+    root_dir : str
+        The dataset folder.
+
+    Returns
+    -------
+    prefix : str
+        e.g. cache_dir/train_0123456789ab
+    """
+    root_dir = os.path.abspath(root_dir)
+    digest = hashlib.sha1(root_dir.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, '%s_%s' % (os.path.basename(root_dir),
+                                              digest))
+
+
+class ScenarioIndex(Mapping):
+    """
+    Columnar index of a dataset folder that replaces the nested
+    OrderedDict built by walking every scenario on startup.
+
+    The index is saved as a single binary file: a small json header
+    followed by aligned numpy columns. The file is memory-mapped when
+    loaded, so all DataLoader workers forked from the main process share
+    the same read-only pages. The scenario contents are materialized
+    lazily and only a few of them are kept alive per process.
+
+    Parameters
+    ----------
+    root_dir : str
+        The dataset folder that contains all scenarios.
+
+    max_cav : int
+        Maximum number of cavs kept per scenario.
+
+    index_path : str
+        Where to save the index. By default it is saved under root_dir, or
+        under the user cache folder if root_dir can not be written to.
+
+    Attributes
+    ----------
+    len_record : np.ndarray
+        Accumulated number of timestamps of each scenario.
+
+    columns : dict
+        scenario_names : (S,) bytes, scenario folder names.
+        scenario_cav_offset : (S+1,) int64, cav rows of each scenario.
+        cav_ids : (C,) bytes, cav folder names.
+        cav_ego : (C,) bool, whether the cav is the ego.
+        scenario_ts_offset : (S+1,) int64, timestamp rows of each scenario.
+        timestamps : (T,) bytes, timestamp keys.
+        sample_scenario : (N,) int32, scenario index of each sample.
+        dir_mtime : (2S+1,) float64, mtime of the root folder, the
+            scenario folders and their cooperative folders.
+    """
+
+    def __init__(self, root_dir, max_cav, index_path=None):
+        self.root_dir = root_dir
+        self.max_cav = max_cav
+        # read-only or shared dataset folders keep their index in the
+        # user cache folder
+        fallback_path = cache_file_prefix(user_cache_dir(), root_dir) + \
+            '.index'
+        if index_path:
+            self.index_path = index_path
+        elif os.access(root_dir, os.W_OK):
+            self.index_path = os.path.join(root_dir, INDEX_FILE_NAME)
+        else:
+            self.index_path = fallback_path
+
+        root_path = self.index_path
+        can_fallback = not index_path and root_path != fallback_path
+
+        self.columns = None
+        # a previous run may have failed to write into root_dir
+        if not self.load() and can_fallback:
+            self.index_path = fallback_path
+            if not self.load():
+                self.index_path = root_path
+        if self.columns is None:
+            self.columns = self.build(root_dir, max_cav)
+            if not self.save() and can_fallback:
+                self.index_path = fallback_path
+                self.save()
+            # reopen from disk so workers share the mmap pages
+            self.load()
+
+        self.len_record = self.columns['len_record']
+        self.scenario_content = lru_cache(maxsize=8)(self._scenario_content)
+
+    def __len__(self):
+        return self.columns['scenario_names'].shape[0]
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, scenario_index):
+        if not 0 <= scenario_index < len(self):
+            raise KeyError(scenario_index)
+        return self.scenario_content(scenario_index)
+
+    def __getstate__(self):
+        # the mmap can not be pickled, reopen it after unpickling (spawn)
+        state = self.__dict__.copy()
+        state.pop('scenario_content')
+        if os.path.isfile(self.index_path):
+            state['columns'] = None
+            state['len_record'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.columns is None:
+            assert self.load(), '%s is changed.' % self.index_path
+            self.len_record = self.columns['len_record']
+        self.scenario_content = lru_cache(maxsize=8)(self._scenario_content)
+
+    @staticmethod
+    def list_dir_mtime(root_dir, scenario_names):
+        """
+        Collect the mtime of all folders whose listing decides the index.
+        """
+        dir_list = [root_dir] + \
+                   [os.path.join(root_dir, x) for x in scenario_names] + \
+                   [os.path.join(root_dir, x, 'cooperative')
+                    for x in scenario_names]
+        return np.array([os.stat(x).st_mtime for x in dir_list],
+                        dtype=np.float64)
+
+    @staticmethod
+    def build(root_dir, max_cav):
+        """
+        Walk the dataset folder and build all index columns.
+
+        Parameters
+        ----------
+        root_dir : str
+            The dataset folder.
+
+        max_cav : int
+            Maximum number of cavs kept per scenario.
+
+        Returns
+        -------
+        columns : dict
+            The index columns.
+        """
+        scenario_folders = sorted([os.path.join(root_dir, x)
+                                   for x in os.listdir(root_dir) if
+                                   os.path.isdir(os.path.join(root_dir, x))])
+
+        scenario_names = []
+        scenario_cav_offset = [0]
+        cav_ids = []
+        cav_ego = []
+        scenario_ts_offset = [0]
+        timestamps = []
+
+        for scenario_folder in scenario_folders:
+            json_path = os.path.join(scenario_folder, 'cooperative')
+            if not os.path.isdir(json_path):
+                continue
+
+            # at least 1 cav should show up
+            cav_list = sorted([x for x in os.listdir(scenario_folder)
+                               if os.path.isdir(
+                    os.path.join(scenario_folder, x)) and x != '3' and
+                               x != 'cooperative'])
+            assert len(cav_list) > 0
+
+            # roadside unit data's id is always negative, so here we want to
+            # make sure they will be in the end of the list as they shouldn't
+            # be ego vehicle.
+            if int(cav_list[0]) < 0:
+                cav_list = cav_list[1:] + [cav_list[0]]
+            if len(cav_list) > max_cav:
+                print('too many cavs')
+                cav_list = cav_list[:max_cav]
+
+            # all cavs share the timestamps of the cooperative folder
+            json_files = sorted([x for x in os.listdir(json_path)
+                                 if x.endswith('.json') and
+                                 'additional' not in x])
+
+            scenario_names.append(os.path.basename(scenario_folder))
+            # the front cav is the ego
+            cav_ids += cav_list
+            cav_ego += [j == 0 for j in range(len(cav_list))]
+            scenario_cav_offset.append(len(cav_ids))
+            timestamps += [x.replace('.json', '') for x in json_files]
+            scenario_ts_offset.append(len(timestamps))
+
+        scenario_ts_offset = np.array(scenario_ts_offset, dtype=np.int64)
+
+        columns = {
+            'scenario_names': np.array(scenario_names, dtype=np.bytes_),
+            'scenario_cav_offset': np.array(scenario_cav_offset,
+                                            dtype=np.int64),
+            'cav_ids': np.array(cav_ids, dtype=np.bytes_),
+            'cav_ego': np.array(cav_ego, dtype=np.bool_),
+            'scenario_ts_offset': scenario_ts_offset,
+            'timestamps': np.array(timestamps, dtype=np.bytes_),
+            'len_record': np.cumsum(np.diff(scenario_ts_offset)),
+            'sample_scenario': np.repeat(
+                np.arange(len(scenario_names), dtype=np.int32),
+                np.diff(scenario_ts_offset)),
+            'dir_mtime': ScenarioIndex.list_dir_mtime(root_dir,
+                                                      scenario_names)}
+        return columns
+
+    def save(self):
+        """
+        Save the index columns into a single aligned binary file. Failing
+        to write (e.g. read-only dataset folder) only disables the cache.
+
+        Returns
+        -------
+        success : bool
+            False if the index could not be written.
+        """
+        header = {'version': INDEX_VERSION,
+                  'max_cav': self.max_cav,
+                  'columns': OrderedDict()}
+        offset = 0
+        for name, column in self.columns.items():
+            column = np.ascontiguousarray(column)
+            offset = -(-offset // COLUMN_ALIGN) * COLUMN_ALIGN
+            header['columns'][name] = {'dtype': column.dtype.str,
+                                       'shape': list(column.shape),
+                                       'offset': offset}
+            offset += column.nbytes
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = len(INDEX_MAGIC) + 8 + len(header_bytes)
+        data_start = -(-data_start // COLUMN_ALIGN) * COLUMN_ALIGN
+
+        tmp_path = '%s.%d.tmp' % (self.index_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)),
+                        exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(INDEX_MAGIC)
+                f.write(struct.pack('<Q', len(header_bytes)))
+                f.write(header_bytes)
+                for name, column in self.columns.items():
+                    f.seek(data_start + header['columns'][name]['offset'])
+                    f.write(np.ascontiguousarray(column).tobytes())
+            os.replace(tmp_path, self.index_path)
+
+            # saving the index into root_dir touches its mtime, so the
+            # mtime column is refreshed in place after the rename.
+            scenario_names = \
+                [x.decode() for x in self.columns['scenario_names']]
+            self.columns['dir_mtime'] = \
+                self.list_dir_mtime(self.root_dir, scenario_names)
+            with open(self.index_path, 'r+b') as f:
+                f.seek(data_start + header['columns']['dir_mtime']['offset'])
+                f.write(self.columns['dir_mtime'].tobytes())
+        except OSError as e:
+            print('Can not save scenario index to %s: %s' %
+                  (self.index_path, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
+
+    def load(self):
+        """
+        Memory-map the saved index if it is still valid.
+
+        Returns
+        -------
+        success : bool
+            False if the index is missing, outdated or corrupted.
+        """
+        if not os.path.isfile(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return False
+                header_len, = struct.unpack('<Q', f.read(8))
+                header = json.loads(f.read(header_len).decode('utf-8'))
+            data_start = len(INDEX_MAGIC) + 8 + header_len
+            data_start = -(-data_start // COLUMN_ALIGN) * COLUMN_ALIGN
+
+            if header['version'] != INDEX_VERSION or \
+                    header['max_cav'] != self.max_cav:
+                return False
+
+            buffer = np.memmap(self.index_path, dtype=np.uint8, mode='r')
+            columns = {}
+            for name, info in header['columns'].items():
+                dtype = np.dtype(info['dtype'])
+                count = int(np.prod(info['shape'], dtype=np.int64))
+                start = data_start + info['offset']
+                columns[name] = \
+                    buffer[start:start + count * dtype.itemsize].view(
+                        dtype).reshape(info['shape'])
+        except (OSError, ValueError, KeyError) as e:
+            print('Can not load scenario index %s: %s' % (self.index_path, e))
+            return False
+
+        # any added/removed scenario, cav or timestamp changes the mtime
+        # of the folders that were listed when building the index.
+        scenario_names = [x.decode() for x in columns['scenario_names']]
+        try:
+            dir_mtime = self.list_dir_mtime(self.root_dir, scenario_names)
+        except OSError:
+            return False
+        if not np.array_equal(dir_mtime, columns['dir_mtime']):
+            return False
+
+        self.columns = columns
+        return True
+
+    def scenario_folder(self, scenario_index):
+        return os.path.join(
+            self.root_dir,
+            self.columns['scenario_names'][scenario_index].decode())
+
+    def timestamps(self, scenario_index):
+        """
+        Timestamp keys of the scenario, e.g. ['000068', '000070', ...].
+        """
+        start, end = \
+            self.columns['scenario_ts_offset'][scenario_index:
+                                               scenario_index + 2]
+        return [x.decode() for x in self.columns['timestamps'][start:end]]
+
+    def locate(self, idx):
+        """
+        Given the dataset index, return the scenario index and the timestamp
+        index inside the scenario in constant time.
+        """
+        scenario_index = int(self.columns['sample_scenario'][idx])
+        timestamp_index = idx if scenario_index == 0 else \
+            idx - int(self.len_record[scenario_index - 1])
+        return scenario_index, timestamp_index
+
+    def timestamp_key(self, scenario_index, timestamp_index):
+        """
+        Given the timestamp index, return the correct timestamp key, e.g.
+        2 --> '000078'.
+        """
+        row = self.columns['scenario_ts_offset'][scenario_index] + \
+            timestamp_index
+        return self.columns['timestamps'][row].decode()
+
+    def timestamp_index(self, scenario_index, timestamp_key):
+        """
+        Inverse of timestamp_key. Return -1 if the key does not exist.
+        """
+        start, end = \
+            self.columns['scenario_ts_offset'][scenario_index:
+                                               scenario_index + 2]
+        timestamps = self.columns['timestamps'][start:end]
+        key = timestamp_key.encode()
+        position = int(np.searchsorted(timestamps, key))
+        if position < len(timestamps) and timestamps[position] == key:
+            return position
+        return -1
+
+    def _scenario_content(self, scenario_index):
+        """
+        Materialize one scenario in the same structure as the legacy
+        scenario_database: {cav_id : {timestamp : {json: path, yaml: path,
+        lidar: path, camera0: list of path}, ego: bool}}. The timestamp
+        entries are only created when they are accessed.
+        """
+        start, end = \
+            self.columns['scenario_cav_offset'][scenario_index:
+                                                scenario_index + 2]
+
+        scenario_content = OrderedDict()
+        for cav_row in range(start, end):
+            cav_id = self.columns['cav_ids'][cav_row].decode()
+            scenario_content[cav_id] = \
+                CavContent(self, scenario_index, cav_id,
+                           bool(self.columns['cav_ego'][cav_row]))
+
+        return scenario_content
+
+
+class CavContent(MutableMapping):
+    """
+    Lazy view of a single cav in a scenario. Timestamp keys map to the
+    file paths of that frame, all the other keys (e.g. 'ego') are stored
+    as regular dictionary entries.
+
+    Parameters
+    ----------
+    index : ScenarioIndex
+        The index this cav belongs to.
+
+    scenario_index : int
+        The scenario index.
+
+    cav_id : str
+        The cav folder name.
+
+    ego : bool
+        Whether the cav is the ego.
+    """
+
+    def __init__(self, index, scenario_index, cav_id, ego):
+        self.index = index
+        self.scenario_index = scenario_index
+        self.cav_path = os.path.join(index.scenario_folder(scenario_index),
+                                     cav_id)
+        self.json_path = os.path.join(index.scenario_folder(scenario_index),
+                                      'cooperative')
+        self.attributes = OrderedDict(ego=ego)
+
+    def __getitem__(self, key):
+        if key in self.attributes:
+            return self.attributes[key]
+        if not isinstance(key, str) or \
+                self.index.timestamp_index(self.scenario_index, key) < 0:
+            raise KeyError(key)
+        return self.frame_paths(key)
+
+    def __setitem__(self, key, value):
+        self.attributes[key] = value
+
+    def __delitem__(self, key):
+        del self.attributes[key]
+
+    def __iter__(self):
+        for timestamp in self.index.timestamps(self.scenario_index):
+            yield timestamp
+        for key in self.attributes:
+            yield key
+
+    def __len__(self):
+        start, end = \
+            self.index.columns['scenario_ts_offset'][self.scenario_index:
+                                                     self.scenario_index + 2]
+        return int(end - start) + len(self.attributes)
+
+    def frame_paths(self, timestamp):
+        """
+        Return the file paths of a single frame.
+        """
+        # imported here to avoid the circular import with basedataset
+        from opencood.data_utils.datasets.basedataset import BaseDataset
+
+        frame = OrderedDict()
+        frame['json'] = os.path.join(self.json_path, timestamp + '.json')
+        frame['yaml'] = os.path.join(self.cav_path, timestamp + '.yaml')
+        frame['lidar'] = os.path.join(self.cav_path, timestamp + '.pcd')
+        frame['camera0'] = BaseDataset.load_camera_files(self.cav_path,
+                                                         timestamp)
+        return frame
@@ -85,7 +85,7 @@ class BasePostprocessor(object):
         gt_box3d_list = torch.vstack(gt_box3d_list)
         # some of the bbx may be repetitive, use the id list to filter
         gt_box3d_selected_indices = \
-            [object_id_list.index(x) for x in set(object_id_list)]
+            box_utils.unique_object_indices(object_id_list)
         gt_box3d_tensor = gt_box3d_list[gt_box3d_selected_indices]
 
         # filter the gt_box to make sure all bbx are in the range
@@ -95,6 +95,54 @@ class BasePostprocessor(object):
 
         return gt_box3d_tensor
 
+    def generate_gt_bbx_batch(self, data_dict):
+        """
+        Generate the 3d groundtruth bounding box of every frame of a batch
+        from the ego content, e.g. in early and intermediate fusion.
+
+        Parameters
+        ----------
+        data_dict : dict
+            The dictionary containing the origin input data of model. The
+            ego 'object_ids' is a list of the object ids of every frame.
+
+        Returns
+        -------
+        gt_box3d_list : list
+            The groundtruth bounding box tensor of each frame, (N_i, 8, 3).
+        """
+        cav_content = data_dict['ego']
+        transformation_matrix = cav_content['transformation_matrix']
+
+        gt_box3d_list = []
+        for i, object_ids in enumerate(cav_content['object_ids']):
+            object_bbx_center = cav_content['object_bbx_center'][i]
+            object_bbx_mask = cav_content['object_bbx_mask'][i]
+            object_bbx_center = object_bbx_center[object_bbx_mask == 1]
+
+            # convert center to corner
+            object_bbx_corner = \
+                box_utils.boxes_to_corners_3d(object_bbx_center,
+                                              self.params['order'])
+            gt_box3d_tensor = \
+                box_utils.project_box3d(object_bbx_corner.float(),
+                                        transformation_matrix[i]
+                                        if transformation_matrix.dim() == 3
+                                        else transformation_matrix)
+
+            # some of the bbx may be repetitive, use the id list to filter
+            gt_box3d_selected_indices = \
+                box_utils.unique_object_indices(object_ids)
+            gt_box3d_tensor = gt_box3d_tensor[gt_box3d_selected_indices]
+
+            # filter the gt_box to make sure all bbx are in the range
+            mask = \
+                box_utils.get_mask_for_boxes_within_range_torch(
+                    gt_box3d_tensor)
+            gt_box3d_list.append(gt_box3d_tensor[mask, :, :])
+
+        return gt_box3d_list
+
     def generate_object_center(self,
                                cav_contents,
                                reference_lidar_pose):
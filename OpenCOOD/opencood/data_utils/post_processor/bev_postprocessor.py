@@ -27,6 +27,8 @@ class BevPostprocessor(BasePostprocessor):
         # Hard coded for now. Need to calculate for our own training dataset
         self.target_mean = np.array([0.008, 0.001, 0.202, 0.2, 0.43, 1.368])
         self.target_std_dev = np.array([0.866, 0.5, 0.954, 0.668, 0.09, 0.111])
+        # discretized coordinates of the label map, computed once
+        self.label_points = None
 
     def generate_anchor_box(self):
         return None
@@ -81,7 +83,9 @@ class BevPostprocessor(BasePostprocessor):
 
     def update_label_map(self, label_map, bev_corners, reg_targets):
         """
-        Update label_map based on bbx and regression targets.
+        Update label_map based on bbx and regression targets. Only the cells
+        inside the axis aligned bounds of a bbx are tested, so the cost
+        grows with the area of the objects instead of the label map.
 
         Parameters
         ----------
@@ -105,41 +109,71 @@ class BevPostprocessor(BasePostprocessor):
 
         # discretized bbx corner representations -- (n, 4, 2)
         bev_corners_dist = (bev_corners - bev_origin) / res / downsample_rate
-        # generate the coordinates of m
-        x = np.arange(self.geometry_param["label_shape"][0])
-        y = np.arange(self.geometry_param["label_shape"][1])
-        xx, yy = np.meshgrid(x, y)
-
-        # (label_shape[0]*label_shape[1], 2)
-        points = np.concatenate([xx.reshape(-1, 1), yy.reshape(-1, 1)],
-                                axis=-1)
+        # (label_shape[1], label_shape[0], 2)
+        points = self.get_label_points()
         bev_origin_dist = bev_origin / res / downsample_rate
 
-        # loop over each bbx, find the points within the bbx.
-        for i in range(bev_corners.shape[0]):
-            reg_target = reg_targets[i, :]
-
-            # find discredited points in bbx
-            points_in_box = \
-                box_utils.get_points_in_rotated_box(points,
-                                                    bev_corners_dist[i, ...])
-            # convert points to continuous space
-            points_continuous = dist_to_continuous(points_in_box,
-                                                   bev_origin_dist,
-                                                   res,
-                                                   downsample_rate)
-            actual_reg_target = np.repeat(reg_target.reshape(1, -1),
-                                          points_continuous.shape[0],
-                                          axis=0)
-            # build learning targets
-            actual_reg_target[:, 2:4] = \
-                actual_reg_target[:, 2:4] - points_continuous
-            actual_reg_target[:, 4:] = np.log(actual_reg_target[:, 4:])
-
-            # update label map
-            label_map[points_in_box[:, 0], points_in_box[:, 1], 0] = 1.0
-            label_map[points_in_box[:, 0], points_in_box[:, 1], 1:] = \
-                actual_reg_target
+        n = bev_corners.shape[0]
+        if n == 0:
+            return
+
+        # the cells to test for each bbx, its axis aligned bounds with one
+        # cell of margin, (n, 2) in (x, y)
+        grid_shape = np.array(self.geometry_param["label_shape"][:2])
+        lower = np.floor(bev_corners_dist.min(axis=1)).astype(np.int64) - 1
+        upper = np.ceil(bev_corners_dist.max(axis=1)).astype(np.int64) + 2
+        lower = np.clip(lower, 0, grid_shape)
+        upper = np.clip(upper, 0, grid_shape)
+
+        # find discredited points in each bbx
+        points_in_box = []
+        for i in range(n):
+            window = points[lower[i, 1]:upper[i, 1],
+                            lower[i, 0]:upper[i, 0]].reshape(-1, 2)
+            points_in_box.append(
+                box_utils.get_points_in_rotated_box(window,
+                                                    bev_corners_dist[i, ...]))
+        box_index = np.repeat(np.arange(n), [len(x) for x in points_in_box])
+        points_in_box = np.concatenate(points_in_box, axis=0)
+
+        # a later bbx overwrites the earlier ones on the cells they share
+        cell_index = points_in_box[:, 0] * grid_shape[1] + points_in_box[:, 1]
+        _, last = np.unique(cell_index[::-1], return_index=True)
+        keep = len(cell_index) - 1 - last
+        points_in_box = points_in_box[keep]
+        box_index = box_index[keep]
+
+        # convert points to continuous space
+        points_continuous = dist_to_continuous(points_in_box,
+                                               bev_origin_dist,
+                                               res,
+                                               downsample_rate)
+        actual_reg_target = reg_targets[box_index]
+        # build learning targets
+        actual_reg_target[:, 2:4] = \
+            actual_reg_target[:, 2:4] - points_continuous
+        actual_reg_target[:, 4:] = np.log(actual_reg_target[:, 4:])
+
+        # update label map
+        label_map[points_in_box[:, 0], points_in_box[:, 1], 0] = 1.0
+        label_map[points_in_box[:, 0], points_in_box[:, 1], 1:] = \
+            actual_reg_target
+
+    def get_label_points(self):
+        """
+        Get the discretized coordinates of all the label map cells.
+
+        Returns
+        -------
+        label_points : np.ndarray
+            (label_shape[1], label_shape[0], 2) coordinates in (x, y) order.
+        """
+        if self.label_points is None:
+            x = np.arange(self.geometry_param["label_shape"][0])
+            y = np.arange(self.geometry_param["label_shape"][1])
+            xx, yy = np.meshgrid(x, y)
+            self.label_points = np.stack([xx, yy], axis=-1)
+        return self.label_points
 
     def normalize_targets(self, label_map):
         """
@@ -24,8 +24,38 @@ class VoxelPostprocessor(BasePostprocessor):
     def __init__(self, anchor_params, train):
         super(VoxelPostprocessor, self).__init__(anchor_params, train)
         self.anchor_num = self.params['anchor_args']['num']
+        # anchors only depend on the config, so they and everything derived
+        # from them for label generation are computed once
+        self.anchor_box = None
+        self.anchor_cache = None
+        # dense: full label maps. sparse: only the positive anchors and the
+        # anchors that are neither positive nor negative, expanded to the
+        # full maps on the training device by expand_label
+        self.label_format = self.params['label_format'] \
+            if 'label_format' in self.params else 'dense'
+        assert self.label_format in ['dense', 'sparse'], \
+            'Unknown label format %s' % self.label_format
+        # optional bounds on the number of boxes before and after nms
+        self.pre_nms_topk = self.params['pre_nms_topk'] \
+            if 'pre_nms_topk' in self.params else None
+        self.post_nms_topk = self.params['post_nms_topk'] \
+            if 'post_nms_topk' in self.params else None
 
     def generate_anchor_box(self):
+        """
+        Generate the anchors of the feature map. The array is computed once
+        and shared by all the samples, so it should not be modified.
+
+        Returns
+        -------
+        anchors : np.ndarray
+            (H, W, anchor_num, 7)
+        """
+        if self.anchor_box is None:
+            self.anchor_box = self.compute_anchor_box()
+        return self.anchor_box
+
+    def compute_anchor_box(self):
         W = self.params['anchor_args']['W']
         H = self.params['anchor_args']['H']
 
@@ -87,7 +117,9 @@ class VoxelPostprocessor(BasePostprocessor):
         Returns
         -------
         label_dict : dict
-            Dictionary that contains all target related info.
+            Dictionary that contains all target related info. With the
+            sparse label format, it only keeps the positive anchor indices,
+            their targets and the indices of the ignored anchors.
         """
         assert self.params['order'] == 'hwl', 'Currently Voxel only support' \
                                               'hwl bbx order.'
@@ -101,16 +133,11 @@ class VoxelPostprocessor(BasePostprocessor):
         # (H, W)
         feature_map_shape = anchors.shape[:2]
 
+        anchor_cache = self.get_anchor_cache(anchors)
         # (H*W*anchor_num, 7)
-        anchors = anchors.reshape(-1, 7)
+        anchors = anchor_cache['anchors']
         # normalization factor, (H * W * anchor_num)
-        anchors_d = np.sqrt(anchors[:, 4] ** 2 + anchors[:, 5] ** 2)
-
-        # (H, W, 2)
-        pos_equal_one = np.zeros((*feature_map_shape, self.anchor_num))
-        neg_equal_one = np.zeros((*feature_map_shape, self.anchor_num))
-        # (H, W, self.anchor_num * 7)
-        targets = np.zeros((*feature_map_shape, self.anchor_num * 7))
+        anchors_d = anchor_cache['anchors_d']
 
         # (n, 7)
         gt_box_center_valid = gt_box_center[masks == 1]
@@ -118,84 +145,72 @@ class VoxelPostprocessor(BasePostprocessor):
         gt_box_corner_valid = \
             box_utils.boxes_to_corners_3d(gt_box_center_valid,
                                           self.params['order'])
-        # (H*W*anchor_num, 8, 3)
-        anchors_corner = \
-            box_utils.boxes_to_corners_3d(anchors,
-                                          order=self.params['order'])
-        # (H*W*anchor_num, 4)
-        anchors_standup_2d = \
-            box_utils.corner2d_to_standup_box(anchors_corner)
         # (n, 4)
         gt_standup_2d = \
             box_utils.corner2d_to_standup_box(gt_box_corner_valid)
-
-        # (H*W*anchor_n)
-        iou = bbox_overlaps(
-            np.ascontiguousarray(anchors_standup_2d).astype(np.float32),
-            np.ascontiguousarray(gt_standup_2d).astype(np.float32),
-        )
-
-        # the anchor boxes has the largest iou across
-        # shape: (n)
-        id_highest = np.argmax(iou.T, axis=1)
-        # [0, 1, 2, ..., n-1]
-        id_highest_gt = np.arange(iou.T.shape[0])
-        # make sure all highest iou is larger than 0
-        mask = iou.T[id_highest_gt, id_highest] > 0
-        id_highest, id_highest_gt = id_highest[mask], id_highest_gt[mask]
+        gt_standup_2d = np.ascontiguousarray(gt_standup_2d).astype(np.float32)
+
+        # the non-zero entries of the (H*W*anchor_num, n) iou matrix, sorted
+        # by anchor and then by gt
+        id_anchor, id_gt, iou = self.anchor_overlaps(anchor_cache,
+                                                     gt_standup_2d)
+
+        # the anchor boxes has the largest iou across, the one with the
+        # smallest index on ties. shape: (n)
+        order = np.lexsort((id_anchor, -iou, id_gt))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = id_gt[order][1:] != id_gt[order][:-1]
+        id_highest = id_anchor[order][first]
+        # [0, 1, 2, ..., n-1], only the gts whose highest iou is larger than 0
+        id_highest_gt = id_gt[order][first]
 
         # find anchors iou > params['pos_iou']
-        id_pos, id_pos_gt = \
-            np.where(iou >
-                     self.params['target_args']['pos_threshold'])
-        #  find anchors iou < params['neg_iou']
-        id_neg = np.where(np.sum(iou <
-                                 self.params['target_args']['neg_threshold'],
-                                 axis=1) == iou.shape[1])[0]
+        pos_mask = iou > self.params['target_args']['pos_threshold']
+        id_pos, id_pos_gt = id_anchor[pos_mask], id_gt[pos_mask]
+        #  find anchors iou < params['neg_iou'] for all the gts, the anchors
+        #  without any overlap have 0 iou
+        neg_threshold = self.params['target_args']['neg_threshold']
+        neg_mask = np.full(len(anchors),
+                           len(gt_standup_2d) == 0 or neg_threshold > 0)
+        neg_mask[id_anchor[iou >= neg_threshold]] = False
         id_pos = np.concatenate([id_pos, id_highest])
         id_pos_gt = np.concatenate([id_pos_gt, id_highest_gt])
         id_pos, index = np.unique(id_pos, return_index=True)
         id_pos_gt = id_pos_gt[index]
-        id_neg.sort()
-
-        # cal the target and set the equal one
-        index_x, index_y, index_z = np.unravel_index(
-            id_pos, (*feature_map_shape, self.anchor_num))
-        pos_equal_one[index_x, index_y, index_z] = 1
-
-        # print('*************************')
-        # # print(anchors)
-        # print(id_pos)
-        # print('*************************')
-        epsilon = 1e-6
-        # calculate the targets
-        # anchors[id_pos, 3:6] = np.where(anchors[id_pos, 3:6] == 0, 1.0, anchors[id_pos, 3:6])
-        targets[index_x, index_y, np.array(index_z) * 7] = \
-            (gt_box_center[id_pos_gt, 0] - anchors[id_pos, 0]) / anchors_d[
-                id_pos]
-        targets[index_x, index_y, np.array(index_z) * 7 + 1] = \
-            (gt_box_center[id_pos_gt, 1] - anchors[id_pos, 1]) / anchors_d[
-                id_pos]
-        targets[index_x, index_y, np.array(index_z) * 7 + 2] = \
-            (gt_box_center[id_pos_gt, 2] - anchors[id_pos, 2]) / anchors[
-                id_pos, 3]
-        targets[index_x, index_y, np.array(index_z) * 7 + 3] = np.log(
-            gt_box_center[id_pos_gt, 3] / anchors[id_pos, 3])
-        targets[index_x, index_y, np.array(index_z) * 7 + 4] = np.log(
-            gt_box_center[id_pos_gt, 4] / anchors[id_pos, 4])
-        targets[index_x, index_y, np.array(index_z) * 7 + 5] = np.log(
-            gt_box_center[id_pos_gt, 5] / anchors[id_pos, 5])
-        targets[index_x, index_y, np.array(index_z) * 7 + 6] = (
-                gt_box_center[id_pos_gt, 6] - anchors[id_pos, 6])
-
-        index_x, index_y, index_z = np.unravel_index(
-            id_neg, (*feature_map_shape, self.anchor_num))
-        neg_equal_one[index_x, index_y, index_z] = 1
 
         # to avoid a box be pos/neg in the same time
-        index_x, index_y, index_z = np.unravel_index(
-            id_highest, (*feature_map_shape, self.anchor_num))
-        neg_equal_one[index_x, index_y, index_z] = 0
+        neg_mask[id_highest] = False
+
+        # calculate the targets, (n_pos, 7)
+        pos_targets = np.stack([
+            (gt_box_center[id_pos_gt, 0] - anchors[id_pos, 0]) /
+            anchors_d[id_pos],
+            (gt_box_center[id_pos_gt, 1] - anchors[id_pos, 1]) /
+            anchors_d[id_pos],
+            (gt_box_center[id_pos_gt, 2] - anchors[id_pos, 2]) /
+            anchors[id_pos, 3],
+            np.log(gt_box_center[id_pos_gt, 3] / anchors[id_pos, 3]),
+            np.log(gt_box_center[id_pos_gt, 4] / anchors[id_pos, 4]),
+            np.log(gt_box_center[id_pos_gt, 5] / anchors[id_pos, 5]),
+            gt_box_center[id_pos_gt, 6] - anchors[id_pos, 6]], axis=1)
+
+        label_shape = (*feature_map_shape, self.anchor_num)
+        if self.label_format == 'sparse':
+            # the negatives are all the anchors except these two sets
+            ignore_mask = ~neg_mask
+            ignore_mask[id_pos] = False
+            return {'pos_index': id_pos.astype(np.int32),
+                    'pos_targets': pos_targets,
+                    'ignore_index': np.where(ignore_mask)[0].astype(np.int32),
+                    'label_shape': np.array(label_shape)}
+
+        # (H, W, 2)
+        pos_equal_one = np.zeros(label_shape)
+        pos_equal_one.reshape(-1)[id_pos] = 1
+        neg_equal_one = neg_mask.reshape(label_shape).astype(np.float64)
+        # (H, W, self.anchor_num * 7)
+        targets = np.zeros((*feature_map_shape, self.anchor_num * 7))
+        targets.reshape(-1, 7)[id_pos] = pos_targets
 
         label_dict = {'pos_equal_one': pos_equal_one,
                       'neg_equal_one': neg_equal_one,
@@ -203,6 +218,180 @@ class VoxelPostprocessor(BasePostprocessor):
 
         return label_dict
 
+    def get_anchor_cache(self, anchors):
+        """
+        Get the anchor information used by label generation, which is only
+        recomputed when different anchors are given.
+
+        Parameters
+        ----------
+        anchors : np.ndarray
+            (H, W, anchor_num, 7)
+
+        Returns
+        -------
+        anchor_cache : dict
+            The flattened anchors, their diagonals, their standup 2d boxes
+            and the grid used to search the anchors around a gt box, which
+            is None if the anchor centers are not on a regular grid.
+        """
+        if self.anchor_cache is not None:
+            source = self.anchor_cache['source']
+            if anchors is source or (anchors.shape == source.shape and
+                                     np.array_equal(anchors, source)):
+                return self.anchor_cache
+
+        # (H*W*anchor_num, 7)
+        anchors_flat = anchors.reshape(-1, 7)
+        # (H*W*anchor_num, 8, 3)
+        anchors_corner = \
+            box_utils.boxes_to_corners_3d(anchors_flat,
+                                          order=self.params['order'])
+        # (H*W*anchor_num, 4)
+        anchors_standup_2d = \
+            box_utils.corner2d_to_standup_box(anchors_corner)
+        anchors_standup_2d = \
+            np.ascontiguousarray(anchors_standup_2d).astype(np.float32)
+
+        self.anchor_cache = {
+            # the shared anchor box is never modified, other arrays might be
+            'source': anchors if anchors is self.anchor_box
+            else anchors.copy(),
+            'anchors': anchors_flat,
+            'anchors_d': np.sqrt(anchors_flat[:, 4] ** 2 +
+                                 anchors_flat[:, 5] ** 2),
+            'standup_2d': anchors_standup_2d,
+            'grid': self.anchor_grid(anchors, anchors_standup_2d)}
+        return self.anchor_cache
+
+    @staticmethod
+    def anchor_grid(anchors, anchors_standup_2d):
+        """
+        Describe the anchors as a regular grid of centers plus the largest
+        extent of the standup box of each anchor type around its center.
+
+        Parameters
+        ----------
+        anchors : np.ndarray
+            (H, W, anchor_num, 7)
+
+        anchors_standup_2d : np.ndarray
+            (H*W*anchor_num, 4)
+
+        Returns
+        -------
+        grid : dict
+            None if the anchor centers are not on a regular grid.
+        """
+        # (W,), (H,)
+        x = anchors[0, :, 0, 0]
+        y = anchors[:, 0, 0, 1]
+        if np.any(np.diff(x) <= 0) or np.any(np.diff(y) <= 0) or \
+                np.any(anchors[..., 0] != x[np.newaxis, :, np.newaxis]) or \
+                np.any(anchors[..., 1] != y[:, np.newaxis, np.newaxis]):
+            return None
+
+        # (H, W, anchor_num, 4)
+        standup = anchors_standup_2d.reshape(*anchors.shape[:3], 4)
+        # (anchor_num,) largest distance from the center to each side
+        left = np.max(anchors[..., 0] - standup[..., 0], axis=(0, 1))
+        right = np.max(standup[..., 2] - anchors[..., 0], axis=(0, 1))
+        down = np.max(anchors[..., 1] - standup[..., 1], axis=(0, 1))
+        up = np.max(standup[..., 3] - anchors[..., 1], axis=(0, 1))
+
+        return {'x': x, 'y': y,
+                'left': left, 'right': right, 'down': down, 'up': up}
+
+    @staticmethod
+    def anchor_overlaps(anchor_cache, gt_standup_2d):
+        """
+        Compute the non-zero standup ious between the anchors and the gt
+        boxes. With anchors on a grid, only the anchors around each gt box
+        are compared, so the cost grows with the number of objects instead
+        of the feature map size. The values are the same as bbox_overlaps.
+
+        Parameters
+        ----------
+        anchor_cache : dict
+            Output of get_anchor_cache.
+
+        gt_standup_2d : np.ndarray
+            (n, 4) float32 standup boxes of the gts.
+
+        Returns
+        -------
+        id_anchor : np.ndarray
+            (M,) anchor index of each non-zero iou, sorted.
+
+        id_gt : np.ndarray
+            (M,) gt index of each non-zero iou, sorted within an anchor.
+
+        iou : np.ndarray
+            (M,) float32 iou.
+        """
+        anchors_standup_2d = anchor_cache['standup_2d']
+        grid = anchor_cache['grid']
+
+        if grid is None:
+            iou = bbox_overlaps(anchors_standup_2d, gt_standup_2d)
+            id_anchor, id_gt = np.nonzero(iou)
+            return id_anchor, id_gt, iou[id_anchor, id_gt]
+
+        W, H = len(grid['x']), len(grid['y'])
+        anchor_num = len(grid['left'])
+        # boxes overlap in bbox_overlaps when they are less than 1 apart, a
+        # small margin makes the search robust to float32 rounding
+        margin = 1 + 1e-3
+
+        # (n, anchor_num) range of the candidate anchor centers
+        x0 = np.searchsorted(grid['x'], gt_standup_2d[:, [0]] - margin -
+                             grid['right'][np.newaxis], side='left')
+        x1 = np.searchsorted(grid['x'], gt_standup_2d[:, [2]] + margin +
+                             grid['left'][np.newaxis], side='right')
+        y0 = np.searchsorted(grid['y'], gt_standup_2d[:, [1]] - margin -
+                             grid['up'][np.newaxis], side='left')
+        y1 = np.searchsorted(grid['y'], gt_standup_2d[:, [3]] + margin +
+                             grid['down'][np.newaxis], side='right')
+        nx = np.maximum(x1 - x0, 0).reshape(-1)
+        ny = np.maximum(y1 - y0, 0).reshape(-1)
+        count = nx * ny
+
+        # enumerate the candidate windows of all (gt, anchor type) pairs
+        pair = np.repeat(np.arange(len(count)), count)
+        local = np.arange(len(pair)) - \
+            np.repeat(np.cumsum(count) - count, count)
+        ix = x0.reshape(-1)[pair] + local % nx[pair]
+        iy = y0.reshape(-1)[pair] + local // nx[pair]
+        id_gt = pair // anchor_num
+        id_anchor = (iy * W + ix) * anchor_num + pair % anchor_num
+        assert H * W * anchor_num == len(anchors_standup_2d)
+
+        # same arithmetic as bbox_overlaps, which adds 1 in float64 and
+        # stores iw, ih, box area and ua in float32
+        one = np.float64(1)
+        boxes = anchors_standup_2d[id_anchor]
+        query_boxes = gt_standup_2d[id_gt]
+        iw = (np.minimum(boxes[:, 2], query_boxes[:, 2]) -
+              np.maximum(boxes[:, 0], query_boxes[:, 0]) +
+              one).astype(np.float32)
+        ih = (np.minimum(boxes[:, 3], query_boxes[:, 3]) -
+              np.maximum(boxes[:, 1], query_boxes[:, 1]) +
+              one).astype(np.float32)
+        keep = (iw > 0) & (ih > 0)
+        boxes, query_boxes = boxes[keep], query_boxes[keep]
+        id_anchor, id_gt = id_anchor[keep], id_gt[keep]
+        inter = iw[keep] * ih[keep]
+        box_area = ((query_boxes[:, 2] - query_boxes[:, 0] + one) *
+                    (query_boxes[:, 3] - query_boxes[:, 1] + one))
+        ua = ((boxes[:, 2] - boxes[:, 0] + one) *
+              (boxes[:, 3] - boxes[:, 1] + one) +
+              box_area.astype(np.float32) - inter).astype(np.float32)
+        iou = inter / ua
+
+        keep = iou != 0
+        order = np.lexsort((id_gt[keep], id_anchor[keep]))
+        return id_anchor[keep][order], id_gt[keep][order], iou[keep][order]
+
     @staticmethod
     def collate_batch(label_batch_list):
         """
@@ -217,8 +406,33 @@ class VoxelPostprocessor(BasePostprocessor):
         Returns
         -------
         target_batch : dict
-            Reformatted labels in torch tensor.
+            Reformatted labels in torch tensor. Sparse labels stay sparse,
+            with the anchor indices flattened over the batch.
         """
+        if 'pos_index' in label_batch_list[0]:
+            label_shape = label_batch_list[0]['label_shape']
+            anchor_num = int(np.prod(label_shape))
+            pos_index = []
+            pos_targets = []
+            ignore_index = []
+
+            for i in range(len(label_batch_list)):
+                pos_index.append(
+                    label_batch_list[i]['pos_index'].astype(np.int64) +
+                    i * anchor_num)
+                pos_targets.append(label_batch_list[i]['pos_targets'])
+                ignore_index.append(
+                    label_batch_list[i]['ignore_index'].astype(np.int64) +
+                    i * anchor_num)
+
+            return {'pos_index': torch.from_numpy(np.concatenate(pos_index)),
+                    'pos_targets':
+                        torch.from_numpy(np.concatenate(pos_targets)),
+                    'ignore_index':
+                        torch.from_numpy(np.concatenate(ignore_index)),
+                    'label_shape': [len(label_batch_list)] +
+                                   [int(x) for x in label_shape]}
+
         pos_equal_one = []
         neg_equal_one = []
         targets = []
@@ -239,6 +453,43 @@ class VoxelPostprocessor(BasePostprocessor):
                 'pos_equal_one': pos_equal_one,
                 'neg_equal_one': neg_equal_one}
 
+    @staticmethod
+    def expand_label(label_dict):
+        """
+        Expand the collated sparse labels to the dense label maps on the
+        device of the labels. Dense labels are returned unchanged.
+
+        Parameters
+        ----------
+        label_dict : dict
+            Output of collate_batch, usually already moved to the training
+            device.
+
+        Returns
+        -------
+        label_dict : dict
+            targets (B, H, W, anchor_num * 7), pos_equal_one and
+            neg_equal_one (B, H, W, anchor_num).
+        """
+        if 'pos_index' not in label_dict:
+            return label_dict
+
+        B, H, W, anchor_num = label_dict['label_shape']
+        pos_index = label_dict['pos_index']
+        pos_targets = label_dict['pos_targets']
+
+        pos_equal_one = pos_targets.new_zeros(B * H * W * anchor_num)
+        pos_equal_one[pos_index] = 1
+        neg_equal_one = pos_targets.new_ones(B * H * W * anchor_num)
+        neg_equal_one[pos_index] = 0
+        neg_equal_one[label_dict['ignore_index']] = 0
+        targets = pos_targets.new_zeros((B * H * W * anchor_num, 7))
+        targets[pos_index] = pos_targets
+
+        return {'targets': targets.view(B, H, W, anchor_num * 7),
+                'pos_equal_one': pos_equal_one.view(B, H, W, anchor_num),
+                'neg_equal_one': neg_equal_one.view(B, H, W, anchor_num)}
+
     def post_process(self, data_dict, output_dict):
         """
         Process the outputs of the model to 2D/3D bounding box.
@@ -261,68 +512,151 @@ class VoxelPostprocessor(BasePostprocessor):
         gt_box3d_tensor : torch.Tensor
             The groundtruth bounding box tensor.
         """
-        # the final bounding box list
-        pred_box3d_list = []
-        pred_box2d_list = []
+        psm = []
+        rm = []
+        anchor_box = []
+        transformation_matrix = []
 
         for cav_id, cav_content in data_dict.items():
             assert cav_id in output_dict
+            # during validation/testing, the batch size should be 1
+            assert output_dict[cav_id]['psm'].shape[0] == 1
+            psm.append(output_dict[cav_id]['psm'])
+            rm.append(output_dict[cav_id]['rm'])
+            # (H, W, anchor_num, 7)
+            anchor_box.append(cav_content['anchor_box'].reshape(-1, 7))
             # the transformation matrix to ego space
-            transformation_matrix = cav_content['transformation_matrix']
+            transformation_matrix.append(
+                cav_content['transformation_matrix'])
+
+        # the outputs of all the cavs are decoded together
+        pred_box3d_tensor, scores, _ = \
+            self.decode_pred_boxes(torch.cat(psm), torch.cat(rm),
+                                   torch.stack(anchor_box),
+                                   torch.stack(transformation_matrix))
+        if pred_box3d_tensor is None:
+            return None, None
 
-            # (H, W, anchor_num, 7)
-            anchor_box = cav_content['anchor_box']
+        return self.filter_pred_boxes(pred_box3d_tensor, scores)
 
-            # classification probability
-            prob = output_dict[cav_id]['psm']
-            prob = F.sigmoid(prob.permute(0, 2, 3, 1))
-            prob = prob.reshape(1, -1)
+    def decode_pred_boxes(self, psm, rm, anchor_box, transformation_matrix,
+                          frame_num=1):
+        """
+        Decode the boxes above the score threshold of several cavs or
+        frames to the corners in ego space. Only the kept anchors are
+        decoded, and the boxes far outside the range are removed by their
+        centers before computing the corners.
 
-            # regression map
-            reg = output_dict[cav_id]['rm']
+        Parameters
+        ----------
+        psm : torch.Tensor
+            (C, anchor_num, H, W) classification map.
 
-            # convert regression map back to bounding box
-            # (N, W*L*anchor_num, 7)
-            batch_box3d = self.delta_to_boxes3d(reg, anchor_box)
-            mask = \
-                torch.gt(prob, self.params['target_args']['score_threshold'])
-            mask = mask.view(1, -1)
-            mask_reg = mask.unsqueeze(2).repeat(1, 1, 7)
+        rm : torch.Tensor
+            (C, anchor_num * 7, H, W) regression map.
 
-            # during validation/testing, the batch size should be 1
-            assert batch_box3d.shape[0] == 1
-            boxes3d = torch.masked_select(batch_box3d[0],
-                                          mask_reg[0]).view(-1, 7)
-            scores = torch.masked_select(prob[0], mask[0])
-
-            # convert output to bounding box
-            if len(boxes3d) != 0:
-                # (N, 8, 3)
-                boxes3d_corner = \
-                    box_utils.boxes_to_corners_3d(boxes3d,
-                                                  order=self.params['order'])
-                # (N, 8, 3)
-                projected_boxes3d = \
-                    box_utils.project_box3d(boxes3d_corner,
-                                            transformation_matrix)
-                # convert 3d bbx to 2d, (N,4)
-                projected_boxes2d = \
-                    box_utils.corner_to_standup_box_torch(projected_boxes3d)
-                # (N, 5)
-                boxes2d_score = \
-                    torch.cat((projected_boxes2d, scores.unsqueeze(1)), dim=1)
-
-                pred_box2d_list.append(boxes2d_score)
-                pred_box3d_list.append(projected_boxes3d)
-
-        if len(pred_box2d_list) ==0 or len(pred_box3d_list) == 0:
-            return None, None
-        # shape: (N, 5)
-        pred_box2d_list = torch.vstack(pred_box2d_list)
-        # scores
-        scores = pred_box2d_list[:, -1]
-        # predicted 3d bbx
-        pred_box3d_tensor = torch.vstack(pred_box3d_list)
+        anchor_box : torch.Tensor
+            (C, H * W * anchor_num, 7) anchors of each map, or
+            (1, H * W * anchor_num, 7) anchors shared by all the maps.
+
+        transformation_matrix : torch.Tensor
+            (C, 4, 4) transformation matrix of each map to ego space.
+
+        frame_num : int
+            The maps are split into frame_num frames of consecutive maps,
+            and pre_nms_topk is applied to each frame.
+
+        Returns
+        -------
+        pred_box3d_tensor : torch.Tensor
+            (N, 8, 3) boxes in ego space, ordered by map and anchor. None
+            if nothing is detected.
+        scores : torch.Tensor
+            (N,) confidence scores.
+        map_index : torch.Tensor
+            (N,) index of the map of each box.
+        """
+        from opencood.data_utils.datasets import GT_RANGE
+
+        C = psm.shape[0]
+        # (C * H * W * anchor_num)
+        prob = F.sigmoid(psm.permute(0, 2, 3, 1)).reshape(-1)
+        score_threshold = self.params['target_args']['score_threshold']
+
+        frame_size = prob.shape[0] // frame_num
+        if self.pre_nms_topk is not None and frame_size > self.pre_nms_topk:
+            scores, index = torch.topk(prob.view(frame_num, frame_size),
+                                       self.pre_nms_topk)
+            index = index + frame_size * torch.arange(
+                frame_num, device=index.device).unsqueeze(1)
+            index = index[scores > score_threshold]
+            # keep the map and anchor order of the full threshold
+            index = torch.sort(index).values
+        else:
+            index = torch.nonzero(prob > score_threshold).squeeze(1)
+        if len(index) == 0:
+            return None, None, None
+        scores = prob[index]
+
+        # (N, 7) boxes in the frame of their own map
+        map_size = prob.shape[0] // C
+        map_index = torch.div(index, map_size, rounding_mode='floor')
+        deltas = rm.permute(0, 2, 3, 1).reshape(-1, 7)[index]
+        anchor_index = index % map_size if anchor_box.shape[0] == 1 \
+            else index
+        anchors = anchor_box.reshape(-1, 7)[anchor_index].to(deltas.device)
+        boxes3d = self.decode_boxes3d(deltas, anchors)
+
+        # the corners of a box kept by remove_large_pred_bbx are at most
+        # 3m away from its center in x and y, so a center further outside
+        # the range means the box can neither be in range nor overlap a
+        # box in range
+        transformation_matrix = \
+            transformation_matrix.to(boxes3d.device).float()
+        centers = torch.matmul(transformation_matrix[map_index, :3, :3],
+                               boxes3d[:, :3, None])[..., 0] + \
+            transformation_matrix[map_index, :3, 3]
+        margin = 3
+        keep = (centers[:, 0] >= GT_RANGE[0] - margin) & \
+            (centers[:, 0] <= GT_RANGE[3] + margin) & \
+            (centers[:, 1] >= GT_RANGE[1] - margin) & \
+            (centers[:, 1] <= GT_RANGE[4] + margin)
+        if not torch.any(keep):
+            return None, None, None
+        boxes3d, scores, map_index = \
+            boxes3d[keep], scores[keep], map_index[keep]
+
+        # (N, 8, 3)
+        boxes3d_corner = \
+            box_utils.boxes_to_corners_3d(boxes3d, order=self.params['order'])
+        projected_boxes3d = torch.zeros_like(boxes3d_corner)
+        for i in torch.unique(map_index).tolist():
+            mask = map_index == i
+            projected_boxes3d[mask] = \
+                box_utils.project_box3d(boxes3d_corner[mask],
+                                        transformation_matrix[i])
+
+        return projected_boxes3d, scores, map_index
+
+    def filter_pred_boxes(self, pred_box3d_tensor, scores):
+        """
+        Remove the abnormal boxes, apply NMS and keep the boxes in range.
+
+        Parameters
+        ----------
+        pred_box3d_tensor : torch.Tensor
+            (N, 8, 3) predicted boxes in ego space.
+
+        scores : torch.Tensor
+            (N,) confidence scores.
+
+        Returns
+        -------
+        pred_box3d_tensor : torch.Tensor
+            The prediction bounding box tensor after NMS.
+        scores : torch.Tensor
+            The corresponding scores.
+        """
         # remove large bbx
         keep_index_1 = box_utils.remove_large_pred_bbx(pred_box3d_tensor)
         keep_index_2 = box_utils.remove_bbx_abnormal_z(pred_box3d_tensor)
@@ -331,11 +665,11 @@ class VoxelPostprocessor(BasePostprocessor):
         pred_box3d_tensor = pred_box3d_tensor[keep_index]
         scores = scores[keep_index]
 
-        # nms
-        keep_index = box_utils.nms_rotated(pred_box3d_tensor,
-                                           scores,
-                                           self.params['nms_thresh']
-                                           )
+        # nms on the device of the boxes
+        keep_index = box_utils.nms_rotated_torch(pred_box3d_tensor,
+                                                 scores,
+                                                 self.params['nms_thresh']
+                                                 )
 
         pred_box3d_tensor = pred_box3d_tensor[keep_index]
 
@@ -348,10 +682,108 @@ class VoxelPostprocessor(BasePostprocessor):
         pred_box3d_tensor = pred_box3d_tensor[mask, :, :]
         scores = scores[mask]
 
+        # the boxes are sorted by score after nms
+        if self.post_nms_topk is not None:
+            pred_box3d_tensor = pred_box3d_tensor[:self.post_nms_topk]
+            scores = scores[:self.post_nms_topk]
+
         assert scores.shape[0] == pred_box3d_tensor.shape[0]
 
         return pred_box3d_tensor, scores
 
+    def post_process_batch(self, data_dict, output_dict):
+        """
+        Process the ego outputs of a batch of frames, e.g. in early and
+        intermediate fusion. The boxes of the whole batch are decoded
+        together, then NMS is applied to each frame.
+
+        Parameters
+        ----------
+        data_dict : dict
+            The dictionary containing the origin input data of model.
+
+        output_dict :dict
+            The dictionary containing the output of the model.
+
+        Returns
+        -------
+        pred_box3d_list : list
+            The prediction bounding box tensor after NMS of each frame,
+            None if nothing is detected.
+        scores_list : list
+            The corresponding scores of each frame.
+        """
+        cav_content = data_dict['ego']
+        psm = output_dict['ego']['psm']
+        B = psm.shape[0]
+        # (4, 4) shared by the batch or (B, 4, 4)
+        transformation_matrix = cav_content['transformation_matrix']
+        if transformation_matrix.dim() == 2:
+            transformation_matrix = \
+                transformation_matrix.unsqueeze(0).repeat(B, 1, 1)
+        anchor_box = cav_content['anchor_box'].reshape(1, -1, 7)
+
+        pred_box3d_tensor, scores, map_index = \
+            self.decode_pred_boxes(psm, output_dict['ego']['rm'],
+                                   anchor_box, transformation_matrix,
+                                   frame_num=B)
+        if pred_box3d_tensor is None:
+            return [None] * B, [None] * B
+
+        # the boxes are ordered by frame
+        box_num = torch.bincount(map_index, minlength=B).tolist()
+        pred_box3d_list = []
+        scores_list = []
+        for frame_box3d, frame_scores in \
+                zip(torch.split(pred_box3d_tensor, box_num),
+                    torch.split(scores, box_num)):
+            if len(frame_scores) == 0:
+                pred_box3d_list.append(None)
+                scores_list.append(None)
+                continue
+            frame_box3d, frame_scores = \
+                self.filter_pred_boxes(frame_box3d, frame_scores)
+            pred_box3d_list.append(frame_box3d)
+            scores_list.append(frame_scores)
+
+        return pred_box3d_list, scores_list
+
+    @staticmethod
+    def decode_boxes3d(deltas, anchors):
+        """
+        Convert the deltas of a set of anchors to 3d bbx, with the same
+        arithmetic as delta_to_boxes3d.
+
+        Parameters
+        ----------
+        deltas : torch.Tensor
+            (N, 7)
+        anchors : torch.Tensor
+            (N, 7) -> xyzhwlr
+
+        Returns
+        -------
+        box3d : torch.Tensor
+            (N, 7)
+        """
+        anchors = anchors.float()
+        # the diagonal of the anchor 2d box, (N, 1)
+        anchors_d = torch.sqrt(anchors[:, [4]] ** 2 + anchors[:, [5]] ** 2)
+
+        boxes3d = torch.zeros_like(deltas)
+        # Inv-normalize to get xyz
+        boxes3d[:, [0, 1]] = torch.mul(deltas[:, [0, 1]], anchors_d) + \
+            anchors[:, [0, 1]]
+        boxes3d[:, [2]] = torch.mul(deltas[:, [2]], anchors[:, [3]]) + \
+            anchors[:, [2]]
+        # hwl
+        boxes3d[:, [3, 4, 5]] = torch.exp(deltas[:, [3, 4, 5]]) * \
+            anchors[:, [3, 4, 5]]
+        # yaw angle
+        boxes3d[:, 6] = deltas[:, 6] + anchors[:, 6]
+
+        return boxes3d
+
     @staticmethod
     def delta_to_boxes3d(deltas, anchors, channel_swap=True):
         """
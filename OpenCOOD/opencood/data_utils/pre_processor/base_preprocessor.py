@@ -3,6 +3,7 @@
 # License: TDG-Attribution-NonCommercial-NoDistrib
 
 import numpy as np
+import torch
 
 from opencood.utils import pcd_utils
 
@@ -77,3 +78,23 @@ class BasePreprocessor(object):
         indices = indices[mask, :]
         bev_map[indices[:, 0], indices[:, 1]] = 1
         return bev_map
+
+    @staticmethod
+    def collate_points(points_list):
+        """
+        Concatenate the raw points of all frames, for the preprocessors
+        that let the model process the whole batch on the training device.
+
+        Parameters
+        ----------
+        points_list : list
+            The (N_i, 4) raw lidar of every frame.
+
+        Returns
+        -------
+        processed_batch : dict
+            'points', (N, 4) concatenated points and 'points_num', (B,)
+            number of points of every frame.
+        """
+        return {"points": torch.from_numpy(np.concatenate(points_list)),
+                "points_num": torch.tensor([len(x) for x in points_list])}
@@ -18,6 +18,11 @@ class BevPreprocessor(BasePreprocessor):
         super(BevPreprocessor, self).__init__(preprocess_params, train)
         self.lidar_range = self.params['cav_lidar_range']
         self.geometry_param = preprocess_params["geometry_param"]
+        # keep the raw points and let the model rasterize the whole batch
+        # on the training device with rasterize_torch
+        self.rasterize_on_device = \
+            self.params['args']['rasterize_on_device'] \
+            if 'rasterize_on_device' in self.params['args'] else False
 
     def preprocess(self, pcd_raw):
         """
@@ -32,29 +37,113 @@ class BevPreprocessor(BasePreprocessor):
         -------
         data_dict : the structured output dictionary.
         """
+        if self.rasterize_on_device:
+            return {"points": np.ascontiguousarray(pcd_raw[:, :4],
+                                                   dtype=np.float32)}
+
         bev = np.zeros(self.geometry_param['input_shape'], dtype=np.float32)
-        intensity_map_count = np.zeros((bev.shape[0], bev.shape[1]),
-                                       dtype=np.int)
         bev_origin = np.array(
             [self.geometry_param["L1"], self.geometry_param["W1"],
              self.geometry_param["H1"]]).reshape(1, -1)
 
         indices = ((pcd_raw[:, :3] - bev_origin) / self.geometry_param[
-            "res"]).astype(int)
-
-        for i in range(indices.shape[0]):
-            bev[indices[i, 0], indices[i, 1], indices[i, 2]] = 1
-            bev[indices[i, 0], indices[i, 1], -1] += pcd_raw[i, 3]
-            intensity_map_count[indices[i, 0], indices[i, 1]] += 1
+            "res"]).astype(np.int64)
+        valid = self.valid_indices_mask(indices, bev.shape)
+        indices = indices[valid]
+        intensity = pcd_raw[valid, 3]
+
+        # flattened (L, W) cell of every point
+        cell = indices[:, 0] * bev.shape[1] + indices[:, 1]
+        # the points of the top height bin only count for the intensity, as
+        # the intensity channel overwrites their occupancy
+        occupied = indices[:, 2] < bev.shape[2] - 1
+        bev.reshape(-1)[cell[occupied] * bev.shape[2] +
+                        indices[occupied, 2]] = 1
+
+        intensity_map_count = np.bincount(cell, minlength=bev.shape[0] *
+                                          bev.shape[1])
+        intensity_map = np.bincount(cell, weights=intensity,
+                                    minlength=bev.shape[0] * bev.shape[1])
         divide_mask = intensity_map_count != 0
-        bev[divide_mask, -1] = np.divide(bev[divide_mask, -1],
-                                         intensity_map_count[divide_mask])
+        bev.reshape(-1, bev.shape[2])[divide_mask, -1] = \
+            intensity_map[divide_mask] / intensity_map_count[divide_mask]
 
         data_dict = {
             "bev_input": np.transpose(bev, (2, 0, 1))
         }
         return data_dict
 
+    @staticmethod
+    def rasterize_torch(processed_lidar, geometry_param):
+        """
+        Rasterize the collated raw points of a batch to BEV representations
+        with torch, on the device of the points.
+
+        Parameters
+        ----------
+        processed_lidar : dict
+            'points', (N, 4) torch.Tensor of the concatenated lidar of all
+            frames, and 'points_num', (B,) torch.Tensor number of points of
+            every frame.
+
+        geometry_param : dict
+            The geometry_param of the preprocess params.
+
+        Returns
+        -------
+        data_dict : dict
+            'bev_input' is a (B, C, L, W) torch.Tensor, identical to
+            stacking the output of `preprocess`, memory layout included.
+        """
+        L, W, C = geometry_param['input_shape']
+        pcd_raw = processed_lidar['points']
+        points_num = processed_lidar['points_num']
+        B = len(points_num)
+        device = pcd_raw.device
+        batch_idx = torch.repeat_interleave(
+            torch.arange(B, device=device), points_num,
+            output_size=len(pcd_raw))
+
+        # float64 as in the numpy version, so both truncate the same way
+        bev_origin = torch.tensor(
+            [geometry_param["L1"], geometry_param["W1"],
+             geometry_param["H1"]], dtype=torch.float64, device=device)
+        indices = ((pcd_raw[:, :3].double() - bev_origin) /
+                   geometry_param["res"]).long()
+        valid = BevPreprocessor.valid_indices_mask(indices, (L, W, C))
+        indices = indices[valid]
+        intensity = pcd_raw[valid, 3].double()
+        batch_idx = batch_idx[valid]
+
+        # (B, L, W, C) like the numpy version, then permuted to the same
+        # memory layout
+        bev = torch.zeros((B, L, W, C), dtype=torch.float32, device=device)
+        cell = (batch_idx * L + indices[:, 0]) * W + indices[:, 1]
+        # the points of the top height bin only count for the intensity
+        occupied = indices[:, 2] < C - 1
+        bev.view(-1)[cell[occupied] * C + indices[occupied, 2]] = 1
+
+        intensity_map_count = torch.bincount(cell, minlength=B * L * W)
+        intensity_map = torch.bincount(cell, weights=intensity,
+                                       minlength=B * L * W)
+        # the empty cells have a zero sum
+        intensity_map = intensity_map / intensity_map_count.clamp(min=1)
+        bev.view(-1, C)[:, -1] = intensity_map.float()
+        bev = bev.permute(0, 3, 1, 2)
+
+        return {"bev_input": bev}
+
+    @staticmethod
+    def valid_indices_mask(indices, input_shape):
+        """
+        Mask of the points inside the BEV grid, including the top height
+        bin, which shares its index with the intensity channel.
+        """
+        L, W, C = input_shape
+        return (indices[:, 0] >= 0) & (indices[:, 0] < L) & \
+            (indices[:, 1] >= 0) & (indices[:, 1] < W) & \
+            (indices[:, 2] >= 0) & (indices[:, 2] < C)
+
     @staticmethod
     def collate_batch_list(batch):
         """
@@ -70,6 +159,9 @@ class BevPreprocessor(BasePreprocessor):
         processed_batch : dict
             Updated lidar batch.
         """
+        if "points" in batch[0]:
+            return BasePreprocessor.collate_points([x["points"]
+                                                   for x in batch])
         bev_input_list = [
             x["bev_input"][np.newaxis, ...] for x in batch
         ]
@@ -94,6 +186,8 @@ class BevPreprocessor(BasePreprocessor):
         processed_batch : dict
             Updated lidar batch.
         """
+        if "points" in batch:
+            return BasePreprocessor.collate_points(batch["points"])
         bev_input_list = [
             x[np.newaxis, ...] for x in batch["bev_input"]
         ]
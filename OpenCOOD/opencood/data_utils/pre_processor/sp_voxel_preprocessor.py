@@ -3,29 +3,23 @@
 # License: TDG-Attribution-NonCommercial-NoDistrib
 
 """
-Transform points to voxels using sparse conv library
+Transform points to voxels with the built-in voxel generator or the sparse
+conv library
 """
 import sys
 
 import numpy as np
 import torch
-from cumm import tensorview as tv
 from opencood.data_utils.pre_processor.base_preprocessor import \
     BasePreprocessor
+from opencood.data_utils.pre_processor.voxel_generator import \
+    VoxelGenerator
 
 
 class SpVoxelPreprocessor(BasePreprocessor):
     def __init__(self, preprocess_params, train):
         super(SpVoxelPreprocessor, self).__init__(preprocess_params,
                                                   train)
-        self.spconv = 1
-        try:
-            # spconv v1.x
-            from spconv.utils import VoxelGeneratorV2 as VoxelGenerator
-        except:
-            # spconv v2.x
-            from spconv.utils import Point2VoxelCPU3d as VoxelGenerator
-            self.spconv = 2
         self.lidar_range = self.params['cav_lidar_range']
         self.voxel_size = self.params['args']['voxel_size']
         self.max_points_per_voxel = self.params['args']['max_points_per_voxel']
@@ -39,16 +33,48 @@ class SpVoxelPreprocessor(BasePreprocessor):
                      np.array(self.lidar_range[0:3])) / np.array(self.voxel_size)
         self.grid_size = np.round(grid_size).astype(np.int64)
 
+        # builtin or spconv, both give the same voxels
+        self.generator_type = self.params['args'].get('voxel_generator',
+                                                      'builtin')
+        assert self.generator_type in ['builtin', 'spconv']
+        # keep the raw points and let the model voxelize the whole batch on
+        # the training device with voxelize_torch
+        self.voxelize_on_device = \
+            self.params['args']['voxelize_on_device'] \
+            if 'voxelize_on_device' in self.params['args'] else False
+        assert not self.voxelize_on_device or \
+            self.generator_type == 'builtin', \
+            'voxelize_on_device needs the built-in voxel generator'
+        # the spconv version, 0 for the built-in generator
+        self.spconv = 0
+
+        if self.generator_type == 'builtin':
+            self.voxel_generator = VoxelGenerator(
+                voxel_size=self.voxel_size,
+                lidar_range=self.lidar_range,
+                max_points_per_voxel=self.max_points_per_voxel,
+                max_voxels=self.max_voxels
+            )
+        else:
+            self.spconv = 1
+            try:
+                # spconv v1.x
+                from spconv.utils import VoxelGeneratorV2 as SpVoxelGenerator
+            except:
+                # spconv v2.x
+                from spconv.utils import Point2VoxelCPU3d as SpVoxelGenerator
+                self.spconv = 2
+
         # use sparse conv library to generate voxel
         if self.spconv == 1:
-            self.voxel_generator = VoxelGenerator(
+            self.voxel_generator = SpVoxelGenerator(
                 voxel_size=self.voxel_size,
                 point_cloud_range=self.lidar_range,
                 max_num_points=self.max_points_per_voxel,
                 max_voxels=self.max_voxels
             )
-        else:
-            self.voxel_generator = VoxelGenerator(
+        elif self.spconv == 2:
+            self.voxel_generator = SpVoxelGenerator(
                 vsize_xyz=self.voxel_size,
                 coors_range_xyz=self.lidar_range,
                 max_num_points_per_voxel=self.max_points_per_voxel,
@@ -57,10 +83,15 @@ class SpVoxelPreprocessor(BasePreprocessor):
             )
 
     def preprocess(self, pcd_np):
+        if self.voxelize_on_device:
+            return {'points': np.ascontiguousarray(pcd_np[:, :4],
+                                                   dtype=np.float32)}
+
         data_dict = {}
-        if self.spconv == 1:
+        if self.spconv != 2:
             voxel_output = self.voxel_generator.generate(pcd_np)
         else:
+            from cumm import tensorview as tv
             pcd_tv = tv.from_numpy(pcd_np)
             voxel_output = self.voxel_generator.point_to_voxel(pcd_tv)
         if isinstance(voxel_output, dict):
@@ -118,6 +149,10 @@ class SpVoxelPreprocessor(BasePreprocessor):
         processed_batch : dict
             Updated lidar batch.
         """
+        if 'points' in batch[0]:
+            return BasePreprocessor.collate_points([x['points']
+                                                    for x in batch])
+
         voxel_features = []
         voxel_num_points = []
         voxel_coords = []
@@ -153,6 +188,9 @@ class SpVoxelPreprocessor(BasePreprocessor):
         processed_batch : dict
             Updated lidar batch.
         """
+        if 'points' in batch:
+            return BasePreprocessor.collate_points(batch['points'])
+
         voxel_features = \
             torch.from_numpy(np.concatenate(batch['voxel_features']))
         voxel_num_points = \
@@ -169,3 +207,43 @@ class SpVoxelPreprocessor(BasePreprocessor):
         return {'voxel_features': voxel_features,
                 'voxel_coords': voxel_coords,
                 'voxel_num_points': voxel_num_points}
+
+    @staticmethod
+    def voxelize_torch(processed_lidar, voxel_args, train):
+        """
+        Voxelize the collated raw points of a batch in one call on their
+        device, used by the models when voxelize_on_device is set.
+
+        Parameters
+        ----------
+        processed_lidar : dict
+            'points', (N, 4) concatenated points and 'points_num', (B,)
+            number of points of every frame.
+
+        voxel_args : dict
+            voxel_size, lidar_range, max_points_per_voxel, max_voxel_train
+            and max_voxel_test, filled by load_point_pillar_params.
+
+        train : bool
+            Train or test mode, selects the voxel budget.
+
+        Returns
+        -------
+        processed_batch : dict
+            Same output as collate_batch on the preprocessed frames.
+        """
+        voxel_generator = VoxelGenerator(
+            voxel_size=voxel_args['voxel_size'],
+            lidar_range=voxel_args['lidar_range'],
+            max_points_per_voxel=voxel_args['max_points_per_voxel'],
+            max_voxels=voxel_args['max_voxel_train'] if train
+            else voxel_args['max_voxel_test'])
+
+        pcd_list = torch.split(processed_lidar['points'],
+                               processed_lidar['points_num'].tolist())
+        voxels, coordinates, num_points = \
+            voxel_generator.generate_batch(pcd_list)
+
+        return {'voxel_features': voxels,
+                'voxel_coords': coordinates,
+                'voxel_num_points': num_points}
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Sort based point to voxel conversion in pure torch, which runs on cpu or
+gpu and voxelizes all the point clouds of a batch in one call.
+"""
+
+import numpy as np
+import torch
+
+
+class VoxelGenerator(object):
+    """
+    Group the points into a sparse voxel grid. The output follows the
+    convention of the spconv voxel generators: voxels are ordered by their
+    first point, every voxel keeps its first `max_points_per_voxel` points
+    in the original order, points outside the range are dropped and only
+    the first `max_voxels` voxels of every point cloud are kept.
+
+    Parameters
+    ----------
+    voxel_size : list
+        Voxel size along x, y, z.
+
+    lidar_range : list
+        [x_min, y_min, z_min, x_max, y_max, z_max].
+
+    max_points_per_voxel : int
+        Maximum number of points kept in a voxel.
+
+    max_voxels : int
+        Maximum number of voxels kept in a point cloud.
+    """
+
+    def __init__(self, voxel_size, lidar_range, max_points_per_voxel,
+                 max_voxels):
+        self.voxel_size = np.array(voxel_size, dtype=np.float32)
+        self.lidar_range = np.array(lidar_range, dtype=np.float32)
+        self.max_points_per_voxel = max_points_per_voxel
+        self.max_voxels = max_voxels
+
+        grid_size = (self.lidar_range[3:6] - self.lidar_range[0:3]) / \
+            self.voxel_size
+        # (x, y, z)
+        self.grid_size = np.round(grid_size).astype(np.int64)
+
+    def generate(self, pcd_np):
+        """
+        Voxelize a single point cloud.
+
+        Parameters
+        ----------
+        pcd_np : np.ndarray
+            (N, C) lidar points.
+
+        Returns
+        -------
+        voxels : np.ndarray
+            (V, max_points_per_voxel, C) zero padded points of every voxel.
+
+        coordinates : np.ndarray
+            (V, 3) int32 voxel coordinates in (z, y, x) order.
+
+        num_points : np.ndarray
+            (V,) int32 number of points of every voxel.
+        """
+        voxels, coordinates, num_points = \
+            self.generate_batch([torch.from_numpy(pcd_np)])
+        return voxels.numpy(), coordinates[:, 1:].numpy(), num_points.numpy()
+
+    def generate_batch(self, pcd_list):
+        """
+        Voxelize a list of point clouds at once.
+
+        Parameters
+        ----------
+        pcd_list : list
+            List of (N_i, C) torch.Tensor lidar points on the same device.
+
+        Returns
+        -------
+        voxels : torch.Tensor
+            (V, max_points_per_voxel, C) zero padded points of every voxel.
+
+        coordinates : torch.Tensor
+            (V, 4) int32 voxel coordinates in (batch_idx, z, y, x) order,
+            sorted by batch index.
+
+        num_points : torch.Tensor
+            (V,) int32 number of points of every voxel.
+        """
+        device = pcd_list[0].device
+        points = torch.cat(pcd_list, dim=0)
+        batch_idx = torch.repeat_interleave(
+            torch.arange(len(pcd_list), device=device),
+            torch.tensor([len(x) for x in pcd_list], device=device))
+
+        voxel_size = torch.from_numpy(self.voxel_size).to(device)
+        range_min = torch.from_numpy(self.lidar_range[0:3]).to(device)
+        grid_size = torch.from_numpy(self.grid_size).to(device)
+
+        coords = torch.floor((points[:, :3].float() - range_min) /
+                             voxel_size).long()
+        valid = ((coords >= 0) & (coords < grid_size)).all(dim=1)
+        point_idx = torch.nonzero(valid).squeeze(1)
+        coords = coords[point_idx]
+        batch_idx = batch_idx[point_idx]
+
+        # linear index of the voxel, unique across the batch
+        key = ((batch_idx * grid_size[2] + coords[:, 2]) * grid_size[1] +
+               coords[:, 1]) * grid_size[0] + coords[:, 0]
+
+        # group the points by voxel, keeping their order inside the voxel
+        key, order = torch.sort(key, stable=True)
+        point_idx = point_idx[order]
+        is_new = torch.ones_like(key, dtype=torch.bool)
+        is_new[1:] = key[1:] != key[:-1]
+        group_start = torch.nonzero(is_new).squeeze(1)
+        group_ind = torch.cumsum(is_new, dim=0) - 1
+        point_rank = torch.arange(len(key), device=device) - \
+            group_start[group_ind]
+
+        # voxels in the order of their first point, which is also sorted by
+        # batch index since the point clouds are concatenated
+        batch_idx = batch_idx[order]
+        coords = coords[order]
+        _, voxel_order = torch.sort(point_idx[group_start])
+        voxel_batch_idx = batch_idx[group_start[voxel_order]]
+        batch_start = torch.searchsorted(
+            voxel_batch_idx, torch.arange(len(pcd_list), device=device))
+        voxel_rank = torch.arange(len(voxel_order), device=device) - \
+            batch_start[voxel_batch_idx]
+        keep_voxel = voxel_rank < self.max_voxels
+        voxel_order = voxel_order[keep_voxel]
+
+        # group index -> output voxel index, -1 for the dropped voxels
+        voxel_id = torch.full((len(group_start),), -1, dtype=torch.long,
+                              device=device)
+        voxel_id[voxel_order] = torch.arange(len(voxel_order), device=device)
+        point_voxel = voxel_id[group_ind]
+        keep_point = (point_voxel >= 0) & \
+            (point_rank < self.max_points_per_voxel)
+
+        voxels = points.new_zeros((len(voxel_order),
+                                   self.max_points_per_voxel,
+                                   points.shape[1]))
+        voxels[point_voxel[keep_point], point_rank[keep_point]] = \
+            points[point_idx[keep_point]]
+
+        voxel_start = group_start[voxel_order]
+        coordinates = torch.stack([batch_idx[voxel_start],
+                                   coords[voxel_start, 2],
+                                   coords[voxel_start, 1],
+                                   coords[voxel_start, 0]], dim=1).int()
+        group_end = torch.cat([group_start[1:],
+                               group_start.new_tensor([len(key)])])
+        num_points = torch.clamp(group_end - group_start,
+                                 max=self.max_points_per_voxel)
+        num_points = num_points[voxel_order].int()
+
+        return voxels, coordinates, num_points
@@ -51,29 +51,91 @@ class VoxelPreprocessor(BasePreprocessor):
 
         # convert to  (D, H, W) as the paper
         voxel_coords = voxel_coords[:, [2, 1, 0]]
-        voxel_coords, inv_ind, voxel_counts = np.unique(voxel_coords, axis=0,
-                                                        return_inverse=True,
-                                                        return_counts=True)
+        voxel_coords, order, sorted_ind, voxel_counts = \
+            self.group_voxels(voxel_coords)
+
+        # rank of every point inside its voxel, only the first T are kept
+        voxel_start = np.cumsum(voxel_counts) - voxel_counts
+        point_rank = np.arange(len(order)) - voxel_start[sorted_ind]
+
+        keep = point_rank < self.T
+        order, sorted_ind, point_rank = \
+            order[keep], sorted_ind[keep], point_rank[keep]
+        voxel_counts = np.minimum(voxel_counts, self.T)
+
+        # accumulate the points slot by slot, which adds them in the same
+        # order as np.mean over the points of a single voxel
+        pts = pcd_np[order]
+        voxel_xyz = np.zeros((len(voxel_coords), self.T, 3), dtype=pts.dtype)
+        voxel_xyz[sorted_ind, point_rank] = pts[:, :3]
+        voxel_mean = voxel_xyz[:, 0].copy()
+        for i in range(1, min(self.T, voxel_counts.max(initial=0))):
+            voxel_mean += voxel_xyz[:, i]
+        voxel_mean /= voxel_counts[:, np.newaxis].astype(pts.dtype)
+
+        # augment the points
+        voxel_features = np.zeros((len(voxel_coords), self.T,
+                                   pts.shape[1] + 3), dtype=np.float32)
+        voxel_features[sorted_ind, point_rank, :pts.shape[1]] = pts
+        voxel_features[sorted_ind, point_rank, pts.shape[1]:] = \
+            pts[:, :3] - voxel_mean[sorted_ind]
+
+        data_dict['voxel_features'] = voxel_features
+        data_dict['voxel_coords'] = voxel_coords
 
-        voxel_features = []
+        return data_dict
 
-        for i in range(len(voxel_coords)):
-            voxel = np.zeros((self.T, 7), dtype=np.float32)
-            pts = pcd_np[inv_ind == i]
-            if voxel_counts[i] > self.T:
-                pts = pts[:self.T, :]
-                voxel_counts[i] = self.T
+    @staticmethod
+    def group_voxels(voxel_coords):
+        """
+        Group the points by voxel, equivalent to np.unique(voxel_coords,
+        axis=0) but with a single sort of a scalar key.
 
-            # augment the points
-            voxel[:pts.shape[0], :] = np.concatenate((pts, pts[:, :3] -
-                                                      np.mean(pts[:, :3], 0)),
-                                                     axis=1)
-            voxel_features.append(voxel)
+        Parameters
+        ----------
+        voxel_coords : np.ndarray
+            (N, 3) int voxel coordinates of the points.
 
-        data_dict['voxel_features'] = np.array(voxel_features)
-        data_dict['voxel_coords'] = voxel_coords
+        Returns
+        -------
+        unique_coords : np.ndarray
+            (V, 3) coordinates of the voxels in lexicographic order.
 
-        return data_dict
+        order : np.ndarray
+            (N,) point indices sorted by voxel. Points of the same voxel
+            keep their original order.
+
+        sorted_ind : np.ndarray
+            (N,) voxel index of every point in `order`.
+
+        voxel_counts : np.ndarray
+            (V,) number of points in every voxel.
+        """
+        coords_min = voxel_coords.min(0, initial=0).astype(np.int64)
+        extent = voxel_coords.max(0, initial=0).astype(np.int64) - \
+            coords_min + 1
+
+        if np.prod(extent.astype(np.float64)) < 2 ** 62:
+            # row-major linear index, which sorts like the rows
+            shifted = voxel_coords.astype(np.int64) - coords_min
+            key = (shifted[:, 0] * extent[1] + shifted[:, 1]) * \
+                extent[2] + shifted[:, 2]
+        else:
+            _, key = np.unique(voxel_coords, axis=0, return_inverse=True)
+            key = key.reshape(-1)
+
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        is_new = np.empty(len(order), dtype=bool)
+        is_new[:1] = True
+        np.not_equal(sorted_key[1:], sorted_key[:-1], out=is_new[1:])
+
+        voxel_start = np.flatnonzero(is_new)
+        sorted_ind = np.cumsum(is_new) - 1
+        voxel_counts = np.diff(np.append(voxel_start, len(order)))
+
+        return voxel_coords[order[voxel_start]], order, sorted_ind, \
+            voxel_counts
 
     def collate_batch(self, batch):
         """
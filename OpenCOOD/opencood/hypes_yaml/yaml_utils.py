@@ -11,6 +11,27 @@ import math
 import numpy as np
 
 
+class FloatLoader(getattr(yaml, 'CLoader', yaml.Loader)):
+    """
+    Yaml loader that also parses scientific notations without a dot, e.g.
+    1e-3, as float. The resolver is registered once on this subclass
+    instead of on the global yaml.Loader at every load.
+    """
+    pass
+
+
+FloatLoader.add_implicit_resolver(
+    u'tag:yaml.org,2002:float',
+    re.compile(u'''^(?:
+     [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+    |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
+    |\\.[0-9_]+(?:[eE][-+][0-9]+)?
+    |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\\.[0-9_]*
+    |[-+]?\\.(?:inf|Inf|INF)
+    |\\.(?:nan|NaN|NAN))$''', re.X),
+    list(u'-+0123456789.'))
+
+
 def load_yaml(file, opt=None):
     """
     Load yaml file and return a dictionary.
@@ -30,19 +51,8 @@ def load_yaml(file, opt=None):
     if opt and opt.model_dir:
         file = os.path.join(opt.model_dir, 'config.yaml')
 
-    stream = open(file, 'r')
-    loader = yaml.Loader
-    loader.add_implicit_resolver(
-        u'tag:yaml.org,2002:float',
-        re.compile(u'''^(?:
-         [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
-        |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
-        |\\.[0-9_]+(?:[eE][-+][0-9]+)?
-        |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\\.[0-9_]*
-        |[-+]?\\.(?:inf|Inf|INF)
-        |\\.(?:nan|NaN|NAN))$''', re.X),
-        list(u'-+0123456789.'))
-    param = yaml.load(stream, Loader=loader)
+    with open(file, 'r') as stream:
+        param = yaml.load(stream, Loader=FloatLoader)
     if "yaml_parser" in param:
         param = eval(param["yaml_parser"])(param)
 
@@ -115,6 +125,17 @@ def load_point_pillar_params(param):
     grid_size = np.round(grid_size).astype(np.int64)
     param['model']['args']['point_pillar_scatter']['grid_size'] = grid_size
 
+    # the model voxelizes the raw points itself with voxelize_on_device
+    preprocess_args = param['preprocess']['args']
+    if 'voxelize_on_device' in preprocess_args and \
+            preprocess_args['voxelize_on_device']:
+        param['model']['args']['voxel_args'] = {
+            'voxel_size': voxel_size,
+            'lidar_range': cav_lidar_range,
+            'max_points_per_voxel': preprocess_args['max_points_per_voxel'],
+            'max_voxel_train': preprocess_args['max_voxel_train'],
+            'max_voxel_test': preprocess_args['max_voxel_test']}
+
     anchor_args = param['postprocess']['anchor_args']
 
     vw = voxel_size[0]
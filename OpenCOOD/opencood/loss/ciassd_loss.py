@@ -27,7 +27,7 @@ class CiassdLoss(nn.Module):
         target_dict : dict
         """
         preds_dict = output_dict['preds_dict_stage1']
-        target_dict = label_dict['stage1']
+        target_dict = VoxelPostprocessor.expand_label(label_dict['stage1'])
         if 'record_len' in output_dict:
             batch_size = int(output_dict['record_len'].sum())
         else:
@@ -8,6 +8,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
+from opencood.data_utils.post_processor.voxel_postprocessor import \
+    VoxelPostprocessor
+
 
 class WeightedSmoothL1Loss(nn.Module):
     """
@@ -90,6 +93,7 @@ class PointPillarLoss(nn.Module):
         """
         rm = output_dict['rm']
         psm = output_dict['psm']
+        target_dict = VoxelPostprocessor.expand_label(target_dict)
         targets = target_dict['targets']
 
         cls_preds = psm.permute(0, 2, 3, 1).contiguous()
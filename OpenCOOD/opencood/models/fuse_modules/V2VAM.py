@@ -33,11 +33,12 @@ class V2V_AttFusion(nn.Module):
         split_x = self.regroup(x, record_len)  #x =[5, 64, 100, 352], record_len=[3,2]
 
         out = []
-        att = []
         for xx in split_x:#split_x[0] [num_car, C, W, H]
 
             ''' CCNet: Criss-Cross Attention Module: attention for ego vehicle feature + cav feature '''
 
+            # the attended features are pooled over the cavs of this sample only
+            att = []
             ego_q, ego_k, ego_v = xx[0:1], xx[0:1], xx[0:1] 
             for i in range(len(xx[:,0,0,0])):
                 att_vehicle = self.CCNet(ego_q, xx[i:i+1], xx[i:i+1])
@@ -65,8 +66,8 @@ class V2V_AttFusion(nn.Module):
 
 
 
-def INF(B,H,W):
-     return -torch.diag(torch.tensor(float("inf")).cuda().repeat(H),0).unsqueeze(0).repeat(B*W,1,1)
+def INF(B,H,W,device):
+     return -torch.diag(torch.tensor(float("inf"), device=device).repeat(H),0).unsqueeze(0).repeat(B*W,1,1)
 
 
 class CrissCrossAttention(nn.Module):
@@ -118,7 +119,7 @@ class CrissCrossAttention(nn.Module):
         proj_value = self.value_conv(value)
         proj_value_H = proj_value.permute(0,3,1,2).contiguous().view(m_batchsize*width,-1,height)
         proj_value_W = proj_value.permute(0,2,1,3).contiguous().view(m_batchsize*height,-1,width)
-        energy_H = (torch.bmm(proj_query_H, proj_key_H)+self.INF(m_batchsize, height, width)).view(m_batchsize,width,height,height).permute(0,2,1,3)
+        energy_H = (torch.bmm(proj_query_H, proj_key_H)+self.INF(m_batchsize, height, width, query.device)).view(m_batchsize,width,height,height).permute(0,2,1,3)
         energy_W = torch.bmm(proj_query_W, proj_key_W).view(m_batchsize,height,width,width)
         concate = self.softmax(torch.cat([energy_H, energy_W], 3))
 
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from opencood.models.fuse_modules import fuse_utils
 from opencood.models.fuse_modules.self_attn import ScaledDotProductAttention
 
 def regroup(x, record_len):
@@ -58,24 +59,14 @@ class Att_w_Warp(nn.Module):
 
     def forward(self, xx, record_len, normalized_affine_matrix):
         _, C, H, W = xx.shape
-        B, L = normalized_affine_matrix.shape[:2]
-        split_x = regroup(xx, record_len)
-        batch_node_features = split_x
-        out = []
-        # iterate each batch
-        for b in range(B):
-            N = record_len[b]
-            t_matrix = normalized_affine_matrix[b][:N, :N, :, :]
-            # update each node i
-            i = 0 # ego
-            x = warp_affine_simple(batch_node_features[b], t_matrix[i, :, :, :], (H, W))
-            cav_num = x.shape[0]
-            x = x.view(cav_num, C, -1).permute(2, 0, 1) #  (H*W, cav_num, C), perform self attention on each pixel.
-            h = self.att(x, x, x)
-            h = h.permute(1, 2, 0).view(cav_num, C, H, W)[0, ...]  # C, W, H before
-            out.append(h)
-
-        out = torch.stack(out)
+        # the first cav of every sample is the ego
+        _, node_batch, node_agent = fuse_utils.get_agent_index(record_len, xx.shape[0])
+        # warp all the cavs of the batch to their ego at once
+        x = warp_affine_simple(xx, normalized_affine_matrix[node_batch, 0, node_agent], (H, W))
+        # (B, L, C, H, W), (B, L)
+        x, mask = fuse_utils.regroup(x, record_len, int(record_len.max()))
+        # perform self attention on each pixel for the whole batch
+        out = fuse_utils.ego_attention_fusion(x, mask)
         return out
     
     def forward_debug(self, xx, record_len, normalized_affine_matrix):
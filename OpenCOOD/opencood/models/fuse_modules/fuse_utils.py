@@ -6,61 +6,157 @@
 import torch
 import numpy as np
 
-from einops import rearrange
-from opencood.utils.common_utils import torch_tensor_to_numpy
 
+def get_agent_index(record_len, node_num=None):
+    """
+    Locate every cav of the batch in the padded layout.
+
+    Parameters
+    ----------
+    record_len : torch.Tensor
+        [sample1_len, sample2_len, ...]
+    node_num : int
+        sum(record_len) if known, which saves a host sync on gpu.
+
+    Returns
+    -------
+    ego_index : torch.Tensor
+        B, the index of the ego, i.e. the first cav, of every sample.
+    batch_index : torch.Tensor
+        sum(record_len), the sample of every cav.
+    agent_index : torch.Tensor
+        sum(record_len), the position of every cav in its sample.
+    """
+    ego_index = torch.cumsum(record_len, dim=0) - record_len
+    batch_index = torch.repeat_interleave(
+        torch.arange(len(record_len), device=record_len.device), record_len,
+        output_size=node_num)
+    agent_index = torch.arange(len(batch_index), device=record_len.device) - \
+        ego_index[batch_index]
+
+    return ego_index, batch_index, agent_index
+
+
+def get_regroup_index(record_len, max_len, node_num=None):
+    """
+    Compute the row of every cav in the flattened (B * L) padded layout,
+    which can be computed once and shared by all the regroup and ungroup
+    calls with the same record_len.
+
+    Parameters
+    ----------
+    record_len : torch.Tensor
+        [sample1_len, sample2_len, ...]
+    max_len : int
+        Maximum cav number
+    node_num : int
+        sum(record_len) if known, which saves a host sync on gpu.
+
+    Returns
+    -------
+    regroup_index : torch.Tensor
+        sum(record_len)
+    """
+    _, batch_index, agent_index = get_agent_index(record_len, node_num)
+    return batch_index * max_len + agent_index
 
-def regroup(dense_feature, record_len, max_len):
+
+def regroup(dense_feature, record_len, max_len, regroup_index=None):
     """
-    Regroup the data based on the record_len.
+    Regroup the data based on the record_len. The padded output is
+    allocated once and filled with a single index_copy_, and nothing is
+    synchronized with the host.
 
     Parameters
     ----------
     dense_feature : torch.Tensor
         N, C, H, W
-    record_len : list
+    record_len : torch.Tensor
         [sample1_len, sample2_len, ...]
     max_len : int
         Maximum cav number
+    regroup_index : torch.Tensor
+        Precomputed get_regroup_index, optional.
 
     Returns
     -------
     regroup_feature : torch.Tensor
         B, L, C, H, W
+    mask : torch.Tensor
+        B, L, 1 for the valid cavs and 0 for the padding.
     """
-    cum_sum_len = list(np.cumsum(torch_tensor_to_numpy(record_len)))
-    split_features = torch.tensor_split(dense_feature,
-                                        cum_sum_len[:-1])
-    regroup_features = []
-    mask = []
-
-    for split_feature in split_features:
-        # M, C, H, W
-        feature_shape = split_feature.shape
-
-        # the maximum M is 5 as most 5 cavs
-        padding_len = max_len - feature_shape[0]
-        mask.append([1] * feature_shape[0] + [0] * padding_len)
-
-        padding_tensor = torch.zeros(padding_len, feature_shape[1],
-                                     feature_shape[2], feature_shape[3])
-        padding_tensor = padding_tensor.to(split_feature.device)
-
-        split_feature = torch.cat([split_feature, padding_tensor],
-                                  dim=0)
-
-        # 1, 5C, H, W
-        split_feature = split_feature.view(-1,
-                                           feature_shape[2],
-                                           feature_shape[3]).unsqueeze(0)
-        regroup_features.append(split_feature)
-
-    # B, 5C, H, W
-    regroup_features = torch.cat(regroup_features, dim=0)
-    # B, L, C, H, W
-    regroup_features = rearrange(regroup_features,
-                                 'b (l c) h w -> b l c h w',
-                                 l=max_len)
-    mask = torch.from_numpy(np.array(mask)).to(regroup_features.device)
-
-    return regroup_features, mask
+    record_len = torch.as_tensor(record_len, device=dense_feature.device)
+    B = len(record_len)
+    feature_shape = dense_feature.shape[1:]
+    if regroup_index is None:
+        regroup_index = get_regroup_index(record_len, max_len,
+                                          dense_feature.shape[0])
+
+    regroup_feature = dense_feature.new_zeros((B * max_len,) + feature_shape)
+    regroup_feature.index_copy_(0, regroup_index, dense_feature)
+    regroup_feature = regroup_feature.view((B, max_len) + feature_shape)
+
+    mask = (torch.arange(max_len, device=dense_feature.device)[None, :] <
+            record_len[:, None]).long()
+
+    return regroup_feature, mask
+
+
+def ungroup(regroup_feature, record_len, regroup_index=None):
+    """
+    The inverse of regroup, gather the valid cavs of the padded batch.
+
+    Parameters
+    ----------
+    regroup_feature : torch.Tensor
+        B, L, C, H, W
+    record_len : torch.Tensor
+        [sample1_len, sample2_len, ...]
+    regroup_index : torch.Tensor
+        Precomputed get_regroup_index, optional.
+
+    Returns
+    -------
+    dense_feature : torch.Tensor
+        N, C, H, W
+    """
+    if regroup_index is None:
+        record_len = torch.as_tensor(record_len,
+                                     device=regroup_feature.device)
+        regroup_index = get_regroup_index(record_len,
+                                          regroup_feature.shape[1])
+
+    return regroup_feature.flatten(0, 1).index_select(0, regroup_index)
+
+
+def ego_attention_fusion(regroup_feature, mask):
+    """
+    Pixel-wise scaled dot-product attention of the ego agent over all the
+    agents, computed for every sample of the batch at once. This is the ego
+    row of ScaledDotProductAttention applied on the (cav_num, C) features
+    of each pixel, with the padded agents masked out.
+
+    Parameters
+    ----------
+    regroup_feature : torch.Tensor
+        B, L, C, H, W, the ego agent comes first in every sample.
+    mask : torch.Tensor
+        B, L, 1 for the valid agents and 0 for the padding.
+
+    Returns
+    -------
+    fused_feature : torch.Tensor
+        B, C, H, W
+    """
+    B, L, C, H, W = regroup_feature.shape
+    # the ego query has a single row, thus the products are reduced in
+    # place instead of going through bmm, which would permute the features
+    # B, L, H, W
+    score = torch.sum(regroup_feature[:, :1] * regroup_feature, dim=2) / \
+        np.sqrt(C)
+    score = score.masked_fill(~mask.bool()[:, :, None, None], float('-inf'))
+    attn = torch.softmax(score, dim=1)
+    # B, C, H, W
+    fused_feature = torch.sum(attn[:, :, None] * regroup_feature, dim=1)
+
+    return fused_feature
@@ -9,10 +9,11 @@ Implementation of V2VNet Fusion
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from opencood.models.sub_modules.torch_transformation_utils import \
     get_discretized_transformation_matrix, get_transformation_matrix, \
-    warp_affine, get_rotated_roi
+    get_warp_affine_grid, get_rotated_roi
 from opencood.models.sub_modules.convgru import ConvGRU
 
 
@@ -42,16 +43,17 @@ class V2VNetFusion(nn.Module):
                                 bias=True,
                                 return_all_layers=False)
         self.mlp = nn.Linear(in_channels, in_channels)
-
-    def regroup(self, x, record_len):
-        cum_sum_len = torch.cumsum(record_len, dim=0)
-        split_x = torch.tensor_split(x, cum_sum_len[:-1].cpu())
-        return split_x
+        # memory bound of the messages in MB, all the (receiver, sender)
+        # pairs are warped at once unless they exceed it
+        self.max_message_memory = args['max_message_memory'] \
+            if 'max_message_memory' in args else None
 
     def forward(self, x, record_len, pairwise_t_matrix):
         """
-        Fusion forwarding.
-        
+        Fusion forwarding. The messages of all the valid (receiver, sender)
+        pairs of the batch are computed at once, or in chunks of pairs if
+        they take more than max_message_memory.
+
         Parameters
         ----------
         x : torch.Tensor
@@ -68,82 +70,108 @@ class V2VNetFusion(nn.Module):
         -------
         Fused feature.
         """
-        _, C, H, W = x.shape
+        N, C, H, W = x.shape
         B, L = pairwise_t_matrix.shape[:2]
+        device = x.device
 
-        # split x:[(L1, C, H, W), (L2, C, H, W)]
-        split_x = self.regroup(x, record_len)
-        # (B,L,L,2,3)
+        # (B,L,L,2,3), t_matrix[b, j, i] -> from j to i
         pairwise_t_matrix = get_discretized_transformation_matrix(
             pairwise_t_matrix.reshape(-1, L, 4, 4), self.discrete_ratio,
             self.downsample_rate).reshape(B, L, L, 2, 3)
-        # (B*L,L,1,H,W)
-        roi_mask = get_rotated_roi((B * L, L, 1, H, W),
-                                   pairwise_t_matrix.reshape(B * L * L, 2, 3))
-        roi_mask = roi_mask.reshape(B, L, L, 1, H, W)
-        batch_node_features = split_x
-        
+
+        # batch and agent index of every node, (N,)
+        cum_sum_len = torch.cumsum(record_len, dim=0)
+        node_start = cum_sum_len - record_len
+        node_batch = torch.repeat_interleave(
+            torch.arange(B, device=device), record_len, output_size=N)
+        node_mask = torch.arange(L, device=device)[None, :] < \
+            record_len[:, None]
+
+        # all the valid (sender j, receiver i) pairs, (P,). The number of
+        # pairs is the only value read back from the device
+        pair_b, pair_j, pair_i = torch.nonzero(
+            node_mask[:, :, None] & node_mask[:, None, :], as_tuple=True)
+        P = len(pair_b)
+        sender = node_start[pair_b] + pair_j
+        receiver = node_start[pair_b] + pair_i
+        # (P,2,3)
+        pair_t_matrix = pairwise_t_matrix[pair_b, pair_j, pair_i]
+        # (P,1,H,W)
+        pair_roi_mask = get_rotated_roi((len(pair_b), 1, 1, H, W),
+                                        pair_t_matrix)[:, 0]
+        pair_t_matrix = get_transformation_matrix(pair_t_matrix, (H, W))
+        # (P,H,W,2), the sampling grids are shared by the iterations
+        grid = get_warp_affine_grid(pair_t_matrix, (H, W), (H, W))
+
+        chunk_size = P
+        if self.max_message_memory is not None:
+            # the warped features, the neighbor messages and the messages
+            pair_memory = 3 * C * H * W * x.element_size()
+            chunk_size = max(1, min(
+                P, int(self.max_message_memory * 2 ** 20) // pair_memory))
+
+        # msg_cnn(cat(neighbor, ego)) is split into the neighbor part, which
+        # is computed for every pair, and the ego part, computed per node
+        neighbor_weight, ego_weight = \
+            torch.split(self.msg_cnn.weight, [C, C], dim=1)
+        if self.agg_operator == "avg":
+            # the ego part is the same for all the senders of a receiver, so
+            # its sum is weighted by the sum of the roi masks, (N,1,H,W)
+            roi_mask_sum = pair_roi_mask.new_zeros((N, 1, H, W)).index_add(
+                0, receiver, pair_roi_mask)
+        node_features = x
+
         # iteratively update the features for num_iteration times
         for l in range(self.num_iteration):
+            # (N,C,H,W)
+            ego_message = F.conv2d(node_features, ego_weight,
+                                   self.msg_cnn.bias,
+                                   padding=self.msg_cnn.padding)
+            if self.agg_operator == "avg":
+                agg_feature = torch.zeros_like(node_features)
+            elif self.agg_operator == "max":
+                agg_feature = torch.full_like(node_features, float('-inf'))
+            else:
+                raise ValueError("agg_operator has wrong value")
+
+            for start in range(0, P, chunk_size):
+                chunk = slice(start, start + chunk_size)
+                # warp every sender to its receiver, (P',C,H,W)
+                neighbor_feature = F.grid_sample(
+                    node_features[sender[chunk]], grid[chunk],
+                    align_corners=True)
+                neighbor_message = F.conv2d(neighbor_feature,
+                                            neighbor_weight,
+                                            padding=self.msg_cnn.padding)
 
-            batch_updated_node_features = []
-            # iterate each batch
-            for b in range(B):
-
-                # number of valid agent
-                N = record_len[b]
-                # (N,N,4,4)
-                # t_matrix[i, j]-> from i to j
-                t_matrix = pairwise_t_matrix[b][:N, :N, :, :]
-                updated_node_features = []
-                # update each node i
-                for i in range(N):
-                    # (N,1,H,W)
-                    mask = roi_mask[b, :N, i, ...]
-
-                    current_t_matrix = t_matrix[:, i, :, :]
-                    current_t_matrix = get_transformation_matrix(
-                        current_t_matrix, (H, W))
-
-                    # (N,C,H,W)
-                    neighbor_feature = warp_affine(batch_node_features[b],
-                                                   current_t_matrix,
-                                                   (H, W))
-                    # (N,C,H,W)
-                    ego_agent_feature = batch_node_features[b][i].unsqueeze(
-                        0).repeat(N, 1, 1, 1)
-                    #(N,2C,H,W)
-                    neighbor_feature = torch.cat(
-                        [neighbor_feature, ego_agent_feature], dim=1)
-                    # (N,C,H,W)
-                    message = self.msg_cnn(neighbor_feature) * mask
-
-                    # (C,H,W)
-                    if self.agg_operator=="avg":
-                        agg_feature = torch.mean(message, dim=0)
-                    elif self.agg_operator=="max":
-                        agg_feature = torch.max(message, dim=0)[0]
-                    else:
-                        raise ValueError("agg_operator has wrong value")
-                    # (2C, H, W)
-                    cat_feature = torch.cat(
-                        [batch_node_features[b][i, ...], agg_feature], dim=0)
-                    # (C,H,W)
-                    if self.gru_flag:
-                        gru_out = \
-                            self.conv_gru(cat_feature.unsqueeze(0).unsqueeze(0))[
-                                0][
-                                0].squeeze(0).squeeze(0)
-                    else:
-                        gru_out = batch_node_features[b][i, ...] + agg_feature
-                    updated_node_features.append(gru_out.unsqueeze(0))
                 # (N,C,H,W)
-                batch_updated_node_features.append(
-                    torch.cat(updated_node_features, dim=0))
-            batch_node_features = batch_updated_node_features
+                if self.agg_operator == "avg":
+                    agg_feature = agg_feature.index_add(
+                        0, receiver[chunk],
+                        neighbor_message * pair_roi_mask[chunk])
+                else:
+                    message = (neighbor_message +
+                               ego_message[receiver[chunk]]) * \
+                        pair_roi_mask[chunk]
+                    agg_feature = agg_feature.scatter_reduce(
+                        0, receiver[chunk].view(-1, 1, 1, 1).expand_as(
+                            message), message, 'amax')
+
+            if self.agg_operator == "avg":
+                agg_feature = (agg_feature + ego_message * roi_mask_sum) / \
+                    record_len[node_batch].view(N, 1, 1, 1)
+
+            if self.gru_flag:
+                # (N,1,2C,H,W)
+                cat_feature = torch.cat([node_features, agg_feature],
+                                        dim=1).unsqueeze(1)
+                # (N,C,H,W)
+                node_features = self.conv_gru(cat_feature)[0][0][:, 0]
+            else:
+                node_features = node_features + agg_feature
+
         # (B,C,H,W)
-        out = torch.cat(
-            [itm[0, ...].unsqueeze(0) for itm in batch_node_features], dim=0)
+        out = node_features[node_start]
         # (B,C,H,W)
         out = self.mlp(out.permute(0, 2, 3, 1)).permute(0, 3, 1, 2)
 
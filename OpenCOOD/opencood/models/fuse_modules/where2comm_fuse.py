@@ -8,7 +8,62 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from opencood.models.fuse_modules.self_attn import ScaledDotProductAttention
+from opencood.models.fuse_modules.fuse_utils import regroup, get_agent_index, get_regroup_index, \
+    ego_attention_fusion
+from opencood.models.sub_modules.feature_codec import QUANTIZATION_DTYPES, quantize_rows, dequantize_rows
+
+
+def encode_sparse_feature(feature, cell_mask, dtype='fp16'):
+    """
+    Serialize the selected cells of a feature map into the byte buffer a cav sends to the ego.
+
+    Args:
+        feature: (C, H, W), the feature map of the cav.
+        cell_mask: (H, W), the cells to send are non zero.
+        dtype: 'fp32', 'fp16' or 'int8'. int8 features are quantized per cell with a float32 scale.
+
+    Returns:
+        The buffer: the int32 header (cell number, C, H, W, dtype code), the int32 flat cell indices,
+        the float32 scales of the cells for int8 and the (cell number, C) features.
+    """
+    C, H, W = feature.shape
+    index = torch.nonzero(cell_mask.reshape(-1)).squeeze(1)
+    # (K, C)
+    values = feature.reshape(C, H * W)[:, index].t()
+
+    header = np.array([len(index), C, H, W, QUANTIZATION_DTYPES[dtype]], dtype=np.int32)
+    chunks = [header.tobytes(), index.int().cpu().numpy().tobytes(), quantize_rows(values, dtype)]
+
+    return b''.join(chunks)
+
+
+def decode_sparse_feature(buffer, device=None):
+    """
+    Scatter a buffer of encode_sparse_feature back into a dense feature map.
+
+    Args:
+        buffer: bytes received from a cav.
+        device: device of the output.
+
+    Returns:
+        feature: (C, H, W) float32, zeros at the cells that are not sent.
+        cell_mask: (H, W) bool, the cells that are sent.
+    """
+    header = np.frombuffer(buffer, dtype=np.int32, count=5)
+    K, C, H, W, code = header.tolist()
+    offset = header.nbytes
+    index = np.frombuffer(buffer, dtype=np.int32, count=K, offset=offset)
+    offset += index.nbytes
+
+    values, _ = dequantize_rows(buffer, offset, K, C, code)
+
+    index = torch.from_numpy(index.astype(np.int64)).to(device)
+    feature = torch.zeros(C, H * W, device=device)
+    feature[:, index] = torch.from_numpy(values).to(device).t()
+    cell_mask = torch.zeros(H * W, dtype=torch.bool, device=device)
+    cell_mask[index] = True
+
+    return feature.reshape(C, H, W), cell_mask.reshape(H, W)
 
 
 class Communication(nn.Module):
@@ -36,61 +91,88 @@ class Communication(nn.Module):
             self.gaussian_filter.weight.device).unsqueeze(0).unsqueeze(0)
         self.gaussian_filter.bias.data.zero_()
 
-    def forward(self, batch_confidence_maps, B):
+    def forward(self, batch_confidence_maps, record_len):
         """
         Args:
-            batch_confidence_maps: [(L1, H, W), (L2, H, W), ...]
+            batch_confidence_maps: (sum(n_cav), A, H, W), the confidence maps of all the cavs of the batch.
+            record_len: (B)
         """
 
-        _, _, H, W = batch_confidence_maps[0].shape
-
-        communication_masks = []
-        communication_rates = []
-        for b in range(B):
-            ori_communication_maps, _ = batch_confidence_maps[b].sigmoid().max(dim=1, keepdim=True)
-            if self.smooth:
-                communication_maps = self.gaussian_filter(ori_communication_maps)
-            else:
-                communication_maps = ori_communication_maps
-
-            L = communication_maps.shape[0]
-            if self.training:
-                # Official training proxy objective
-                K = int(H * W * random.uniform(0, 1))
-                communication_maps = communication_maps.reshape(L, H * W)
-                _, indices = torch.topk(communication_maps, k=K, sorted=False)
-                communication_mask = torch.zeros_like(communication_maps).to(communication_maps.device)
-                ones_fill = torch.ones(L, K, dtype=communication_maps.dtype, device=communication_maps.device)
-                communication_mask = torch.scatter(communication_mask, -1, indices, ones_fill).reshape(L, 1, H, W)
-            elif self.threshold:
-                ones_mask = torch.ones_like(communication_maps).to(communication_maps.device)
-                zeros_mask = torch.zeros_like(communication_maps).to(communication_maps.device)
-                communication_mask = torch.where(communication_maps > self.threshold, ones_mask, zeros_mask)
-            else:
-                communication_mask = torch.ones_like(communication_maps).to(communication_maps.device)
-
-            communication_rate = communication_mask.sum() / (L * H * W)
-            # Ego
-            communication_mask[0] = 1
-
-            communication_masks.append(communication_mask)
-            communication_rates.append(communication_rate)
-        communication_rates = sum(communication_rates) / B
-        communication_masks = torch.cat(communication_masks, dim=0)
-        return communication_masks, communication_rates
+        N, _, H, W = batch_confidence_maps.shape
+        B = len(record_len)
+        device = batch_confidence_maps.device
+        # the first cav of every sample is the ego
+        ego_index, node_batch, _ = get_agent_index(record_len, N)
+
+        ori_communication_maps, _ = batch_confidence_maps.sigmoid().max(dim=1, keepdim=True)
+        if self.smooth:
+            communication_maps = self.gaussian_filter(ori_communication_maps)
+        else:
+            communication_maps = ori_communication_maps
+
+        if self.training:
+            # Official training proxy objective, with a random K for every sample
+            K = torch.tensor([int(H * W * random.uniform(0, 1)) for _ in range(B)], device=device)
+            communication_maps = communication_maps.reshape(N, H * W)
+            # keep the K most confident pixels of every cav
+            order = torch.argsort(communication_maps, dim=-1, descending=True)
+            ones_fill = (torch.arange(H * W, device=device)[None, :] < K[node_batch][:, None]).to(communication_maps.dtype)
+            communication_mask = torch.zeros_like(communication_maps)
+            communication_mask = torch.scatter(communication_mask, -1, order, ones_fill).reshape(N, 1, H, W)
+        elif self.threshold:
+            ones_mask = torch.ones_like(communication_maps).to(communication_maps.device)
+            zeros_mask = torch.zeros_like(communication_maps).to(communication_maps.device)
+            communication_mask = torch.where(communication_maps > self.threshold, ones_mask, zeros_mask)
+        else:
+            communication_mask = torch.ones_like(communication_maps).to(communication_maps.device)
+
+        # communication rate of every sample, averaged over the batch
+        communication_rates = torch.zeros(B, dtype=communication_mask.dtype, device=device).index_add_(
+            0, node_batch, communication_mask.sum(dim=(1, 2, 3)))
+        communication_rates = (communication_rates / (record_len * H * W)).mean()
+        # Ego
+        communication_mask[ego_index] = 1
+
+        return communication_mask, communication_rates
 
 
 class AttentionFusion(nn.Module):
     def __init__(self, feature_dim):
         super(AttentionFusion, self).__init__()
-        self.att = ScaledDotProductAttention(feature_dim)
 
-    def forward(self, x):
-        cav_num, C, H, W = x.shape
-        x = x.view(cav_num, C, -1).permute(2, 0, 1)  # (H*W, cav_num, C), perform self attention on each pixel
-        x = self.att(x, x, x)
-        x = x.permute(1, 2, 0).view(cav_num, C, H, W)[0]  # C, W, H before
-        return x
+    def forward(self, x, mask, active_cells=None):
+        """
+        Args:
+            x: (B, L, C, H, W), the padded features of the batch.
+            mask: (B, L), the valid agents.
+            active_cells: (B, H, W), the cells where the ego received features, all the cells if None.
+
+        Returns:
+            The ego features after the pixel-wise self attention, (B, C, H, W).
+        """
+        if active_cells is None:
+            return ego_attention_fusion(x, mask)
+
+        B, L, C, H, W = x.shape
+        # self attention only at the active cells, (P, L, C)
+        b, h, w = torch.nonzero(active_cells, as_tuple=True)
+        active_feature = x.permute(0, 3, 4, 1, 2)[b, h, w]
+        score = torch.sum(active_feature[:, :1] * active_feature, dim=-1) / np.sqrt(C)
+        score = score.masked_fill(~mask.bool()[b], float('-inf'))
+        attn = torch.softmax(score, dim=1)
+        active_feature = torch.sum(attn[:, :, None] * active_feature, dim=1)
+
+        # at the other cells the keys and values of the collaborators are zeros, so the attention
+        # reduces to the ego feature weighted by exp(s) / (exp(s) + n), where s is the ego score
+        # and n the number of collaborators
+        ego_feature = x[:, 0]
+        ego_score = torch.sum(ego_feature * ego_feature, dim=1) / np.sqrt(C)
+        collaborator_num = (mask.sum(dim=1) - 1).to(x.dtype)
+        ego_weight = 1 / (1 + collaborator_num[:, None, None] * torch.exp(-ego_score))
+        x_fuse = ego_feature * ego_weight[:, None]
+        x_fuse = x_fuse.permute(0, 2, 3, 1).index_put((b, h, w), active_feature)
+
+        return x_fuse.permute(0, 3, 1, 2)
 
 
 class Where2comm(nn.Module):
@@ -119,10 +201,106 @@ class Where2comm(nn.Module):
 
         self.naive_communication = Communication(args['communication'])
 
-    def regroup(self, x, record_len):
-        cum_sum_len = torch.cumsum(record_len, dim=0)
-        split_x = torch.tensor_split(x, cum_sum_len[:-1].cpu())
-        return split_x
+        # send the selected cells as sparse byte buffers at inference, instead of masking the dense features
+        self.transmission_dtype = None
+        if 'transmission' in args['communication']:
+            self.transmission_dtype = args['communication']['transmission']['dtype']
+            assert self.transmission_dtype in QUANTIZATION_DTYPES, \
+                '%s is not a supported transmission dtype' % self.transmission_dtype
+        self.reset_statistics()
+
+    def communicate(self, x, psm_single, record_len):
+        """
+        Select the cells every cav sends to its ego.
+
+        Parameters:
+            x: The features of all the cavs, (sum(n_cav), C, H, W).
+            psm_single: The confidence maps of all the cavs, (sum(n_cav), A, H', W').
+            record_len: (B).
+
+        Returns:
+            x: The features the ego receives from every cav, (sum(n_cav), C, H, W).
+            communication_rates: The ratio of the sent cells.
+            active_cells: The cells where the ego receives features from the collaborators, (B, H, W),
+                None if the dense features are used.
+            transmitted_bytes: The bytes sent to the ego of every sample, None if the dense features are used.
+        """
+        if self.fully:
+            return x, torch.tensor(1).to(x.device), None, None
+
+        # Prune
+        communication_masks, communication_rates = self.naive_communication(psm_single, record_len)
+        if x.shape[-1] != communication_masks.shape[-1]:
+            communication_masks = F.interpolate(communication_masks, size=(x.shape[-2], x.shape[-1]),
+                                                mode='bilinear', align_corners=False)
+        x = x * communication_masks
+        if self.transmission_dtype is None or self.training:
+            return x, communication_rates, None, None
+
+        N, _, H, W = x.shape
+        B = len(record_len)
+        ego_index, node_batch, _ = get_agent_index(record_len, N)
+        is_ego = torch.zeros(N, dtype=torch.bool, device=x.device)
+        is_ego[ego_index] = True
+
+        # the ego keeps its own features, the collaborators send their selected cells
+        received_cells = torch.zeros(N, H, W, dtype=torch.bool, device=x.device)
+        transmitted_bytes = [0] * B
+        x = x.clone()
+        for n, b in zip(torch.nonzero(~is_ego).squeeze(1).tolist(), node_batch[~is_ego].tolist()):
+            buffer = encode_sparse_feature(x[n], communication_masks[n, 0], self.transmission_dtype)
+            x[n], received_cells[n] = decode_sparse_feature(buffer, x.device)
+            transmitted_bytes[b] += len(buffer)
+
+        active_cells = torch.zeros(B, H, W, dtype=torch.long, device=x.device).index_add_(
+            0, node_batch, received_cells.long()) > 0
+
+        return x, communication_rates, active_cells, transmitted_bytes
+
+    def reset_statistics(self):
+        # accumulated over the samples sent as sparse buffers
+        self.transmitted_samples = 0
+        self.comm_bytes = 0
+        self.dense_comm_bytes = 0
+        self.fusion_flops = 0
+        self.dense_fusion_flops = 0
+
+    def update_statistics(self, x, record_len, active_cells, transmitted_bytes):
+        """
+        Accumulate the bytes sent to the egos and the multiply-adds of the pixel-wise attention.
+
+        Parameters:
+            x: The received features, (sum(n_cav), C, H, W).
+            record_len: (B).
+            active_cells: The cells where the ego receives features from the collaborators, (B, H, W).
+            transmitted_bytes: The bytes sent to the ego of every sample.
+        """
+        _, C, H, W = x.shape
+        B = len(record_len)
+        active_num = active_cells.reshape(B, -1).sum(dim=1)
+        # the scores and the weighted sum of every agent at a cell
+        cell_flops = 4 * C * record_len
+        # the ego score and the scaling at the inactive cells
+        fusion_flops = cell_flops * active_num + 3 * C * (H * W - active_num)
+
+        self.transmitted_samples += B
+        self.comm_bytes += sum(transmitted_bytes)
+        # the full fp32 feature maps of the collaborators
+        self.dense_comm_bytes += int((record_len - 1).sum()) * C * H * W * 4
+        self.fusion_flops += int(fusion_flops.sum())
+        self.dense_fusion_flops += int((cell_flops * H * W).sum())
+
+    def transmission_summary(self):
+        """
+        Returns:
+            The mean bytes sent to an ego per frame, sparse and dense, and the ratio of the fusion flops saved
+            since the last reset, None if no frame was sent as sparse buffers.
+        """
+        if self.transmitted_samples == 0:
+            return None
+        return {'comm_bytes_per_frame': self.comm_bytes / self.transmitted_samples,
+                'dense_comm_bytes_per_frame': self.dense_comm_bytes / self.transmitted_samples,
+                'fusion_flops_saved': 1 - self.fusion_flops / max(self.dense_fusion_flops, 1)}
 
     def forward(self, x, psm_single, record_len, pairwise_t_matrix, backbone=None):
         """
@@ -134,11 +312,14 @@ class Where2comm(nn.Module):
             pairwise_t_matrix: The transformation matrix from each cav to ego, (B, L, L, 4, 4).
 
         Returns:
-            Fused feature.
+            Fused feature and communication rates. The bytes and flops of the sparse transmission are
+            accumulated, see transmission_summary.
         """
 
-        _, C, H, W = x.shape
-        B = pairwise_t_matrix.shape[0]
+        # pad to the largest number of agents in the batch, the scatter index
+        # of the padded layout is shared by all the levels
+        L = int(record_len.max())
+        regroup_index = get_regroup_index(record_len, L, x.shape[0])
 
         if self.multi_scale:
             ups = []
@@ -147,29 +328,19 @@ class Where2comm(nn.Module):
                 x = backbone.blocks[i](x)
 
                 # 1. Communication (mask the features)
+                active_cells = None
                 if i == 0:
-                    if self.fully:
-                        communication_rates = torch.tensor(1).to(x.device)
-                    else:
-                        # Prune
-                        batch_confidence_maps = self.regroup(psm_single, record_len)
-                        communication_masks, communication_rates = self.naive_communication(batch_confidence_maps, B)
-                        if x.shape[-1] != communication_masks.shape[-1]:
-                            communication_masks = F.interpolate(communication_masks, size=(x.shape[-2], x.shape[-1]),
-                                                                mode='bilinear', align_corners=False)
-                        x = x * communication_masks
-
-                # 2. Split the features
-                # split_x: [(L1, C, H, W), (L2, C, H, W), ...]
-                # For example [[2, 256, 48, 176], [1, 256, 48, 176], ...]
-                batch_node_features = self.regroup(x, record_len)
-
-                # 3. Fusion
-                x_fuse = []
-                for b in range(B):
-                    neighbor_feature = batch_node_features[b]
-                    x_fuse.append(self.fuse_modules[i](neighbor_feature))
-                x_fuse = torch.stack(x_fuse)
+                    x, communication_rates, active_cells, transmitted_bytes = \
+                        self.communicate(x, psm_single, record_len)
+                    if active_cells is not None:
+                        self.update_statistics(x, record_len, active_cells, transmitted_bytes)
+
+                # 2. Pad the features of every sample
+                # batch_node_features: (B, L, C, H, W), agent_mask: (B, L)
+                batch_node_features, agent_mask = regroup(x, record_len, L, regroup_index)
+
+                # 3. Fusion of the whole batch, only at the received cells after a sparse transmission
+                x_fuse = self.fuse_modules[i](batch_node_features, agent_mask, active_cells)
 
                 # 4. Deconv
                 if len(backbone.deblocks) > 0:
@@ -186,23 +357,16 @@ class Where2comm(nn.Module):
                 x_fuse = backbone.deblocks[-1](x_fuse)
         else:
             # 1. Communication (mask the features)
-            if self.fully:
-                communication_rates = torch.tensor(1).to(x.device)
-            else:
-                # Prune
-                batch_confidence_maps = self.regroup(psm_single, record_len)
-                communication_masks, communication_rates = self.naive_communication(batch_confidence_maps, B)
-                x = x * communication_masks
-
-            # 2. Split the features
-            # split_x: [(L1, C, H, W), (L2, C, H, W), ...]
-            # For example [[2, 256, 48, 176], [1, 256, 48, 176], ...]
-            batch_node_features = self.regroup(x, record_len)
-
-            # 3. Fusion
-            x_fuse = []
-            for b in range(B):
-                neighbor_feature = batch_node_features[b]
-                x_fuse.append(self.fuse_modules(neighbor_feature))
-            x_fuse = torch.stack(x_fuse)
+            x, communication_rates, active_cells, transmitted_bytes = \
+                self.communicate(x, psm_single, record_len)
+            if active_cells is not None:
+                self.update_statistics(x, record_len, active_cells, transmitted_bytes)
+
+            # 2. Pad the features of every sample
+            # batch_node_features: (B, L, C, H, W), agent_mask: (B, L)
+            batch_node_features, agent_mask = regroup(x, record_len, L, regroup_index)
+
+            # 3. Fusion of the whole batch, only at the received cells after a sparse transmission
+            x_fuse = self.fuse_modules(batch_node_features, agent_mask, active_cells)
+
         return x_fuse, communication_rates
@@ -9,6 +9,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from opencood.data_utils.pre_processor.bev_preprocessor import \
+    BevPreprocessor
+
 
 def conv3x3(in_planes, out_planes, stride=1, bias=False):
     """3x3 convolution with padding"""
@@ -277,6 +280,7 @@ class PIXOR(nn.Module):
         super(PIXOR, self).__init__()
         geom = args["geometry_param"]
         use_bn = args["use_bn"]
+        self.geometry_param = geom
         self.backbone = BackBone(Bottleneck, [3, 6, 6, 3], geom, use_bn)
         self.header = Header(use_bn)
 
@@ -295,7 +299,12 @@ class PIXOR(nn.Module):
         self.header.reghead.bias.data.fill_(0)
 
     def forward(self, data_dict):
-        bev_input = data_dict['processed_lidar']["bev_input"]
+        processed_lidar = data_dict['processed_lidar']
+        if "bev_input" not in processed_lidar:
+            # raw points with rasterize_on_device
+            processed_lidar = BevPreprocessor.rasterize_torch(
+                processed_lidar, self.geometry_param)
+        bev_input = processed_lidar["bev_input"]
 
         features = self.backbone(bev_input)
         # cls -- (N, 1, W/4, L/4)
@@ -7,6 +7,8 @@ import math
 
 import torch.nn as nn
 
+from opencood.data_utils.pre_processor.bev_preprocessor import \
+    BevPreprocessor
 from opencood.models.fuse_modules.self_attn import AttFusion
 from opencood.models.pixor import Bottleneck, BackBone, Header
 
@@ -57,6 +59,7 @@ class PIXORIntermediate(nn.Module):
         super(PIXORIntermediate, self).__init__()
         geom = args["geometry_param"]
         use_bn = args["use_bn"]
+        self.geometry_param = geom
         self.backbone = BackBoneIntermediate(Bottleneck, [3, 6, 6, 3],
                                              geom,
                                              use_bn)
@@ -77,7 +80,12 @@ class PIXORIntermediate(nn.Module):
         self.header.reghead.bias.data.fill_(0)
 
     def forward(self, data_dict):
-        bev_input = data_dict['processed_lidar']["bev_input"]
+        processed_lidar = data_dict['processed_lidar']
+        if "bev_input" not in processed_lidar:
+            # raw points with rasterize_on_device
+            processed_lidar = BevPreprocessor.rasterize_torch(
+                processed_lidar, self.geometry_param)
+        bev_input = processed_lidar["bev_input"]
         record_len = data_dict['record_len']
 
         features = self.backbone(bev_input, record_len)
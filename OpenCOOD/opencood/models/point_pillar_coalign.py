@@ -12,10 +12,12 @@ import torch
 import torch.nn as nn
 
 
+from opencood.data_utils.pre_processor.sp_voxel_preprocessor import \
+    SpVoxelPreprocessor
 from opencood.models.sub_modules.pillar_vfe import PillarVFE
 from opencood.models.sub_modules.point_pillar_scatter import PointPillarScatter
 from opencood.models.sub_modules.res_bev_backbone import ResBEVBackbone
-from opencood.models.sub_modules.naive_compress import NaiveCompressor
+from opencood.models.sub_modules.feature_codec import build_compressor
 from opencood.models.sub_modules.downsample_conv import DownsampleConv
 from opencood.models.fuse_modules.coalign_fuse import Att_w_Warp, normalize_pairwise_tfm
 
@@ -23,6 +25,9 @@ class PointPillarCoAlign(nn.Module):
     def __init__(self, args):
         super(PointPillarCoAlign, self).__init__()
 
+        # raw points of voxelize_on_device are voxelized in forward
+        self.voxel_args = args['voxel_args'] \
+            if 'voxel_args' in args else None
         # PIllar VFE
         self.pillar_vfe = PillarVFE(args['pillar_vfe'],
                                     num_point_features=4,
@@ -43,7 +48,7 @@ class PointPillarCoAlign(nn.Module):
         self.compression = False
         if 'compression' in args:
             self.compression = True
-            self.naive_compressor = NaiveCompressor(args['res_bev_backbone']['num_filters'][0], args['compression'])
+            self.naive_compressor = build_compressor(args['res_bev_backbone']['num_filters'][0], args)
 
         # used to downsample the feature map for efficient computation
         self.shrink_flag = False
@@ -59,9 +64,14 @@ class PointPillarCoAlign(nn.Module):
 
     def forward(self, data_dict):
 
-        voxel_features = data_dict['processed_lidar']['voxel_features']
-        voxel_coords = data_dict['processed_lidar']['voxel_coords']
-        voxel_num_points = data_dict['processed_lidar']['voxel_num_points']
+        processed_lidar = data_dict['processed_lidar']
+        if 'voxel_features' not in processed_lidar:
+            # raw points with voxelize_on_device
+            processed_lidar = SpVoxelPreprocessor.voxelize_torch(
+                processed_lidar, self.voxel_args, self.training)
+        voxel_features = processed_lidar['voxel_features']
+        voxel_coords = processed_lidar['voxel_coords']
+        voxel_num_points = processed_lidar['voxel_num_points']
         record_len = data_dict['record_len']
 
         batch_dict = {'voxel_features': voxel_features,
@@ -7,6 +7,8 @@ import torch
 import torch.nn as nn
 
 
+from opencood.data_utils.pre_processor.sp_voxel_preprocessor import \
+    SpVoxelPreprocessor
 from opencood.models.sub_modules.pillar_vfe import PillarVFE
 from opencood.models.sub_modules.point_pillar_scatter import PointPillarScatter
 from opencood.models.sub_modules.att_bev_backbone import AttBEVBackbone
@@ -16,6 +18,9 @@ class PointPillarIntermediate(nn.Module):
     def __init__(self, args):
         super(PointPillarIntermediate, self).__init__()
 
+        # raw points of voxelize_on_device are voxelized in forward
+        self.voxel_args = args['voxel_args'] \
+            if 'voxel_args' in args else None
         # PIllar VFE
         self.pillar_vfe = PillarVFE(args['pillar_vfe'],
                                     num_point_features=4,
@@ -31,9 +36,14 @@ class PointPillarIntermediate(nn.Module):
 
     def forward(self, data_dict):
 
-        voxel_features = data_dict['processed_lidar']['voxel_features']
-        voxel_coords = data_dict['processed_lidar']['voxel_coords']
-        voxel_num_points = data_dict['processed_lidar']['voxel_num_points']
+        processed_lidar = data_dict['processed_lidar']
+        if 'voxel_features' not in processed_lidar:
+            # raw points with voxelize_on_device
+            processed_lidar = SpVoxelPreprocessor.voxelize_torch(
+                processed_lidar, self.voxel_args, self.training)
+        voxel_features = processed_lidar['voxel_features']
+        voxel_coords = processed_lidar['voxel_coords']
+        voxel_num_points = processed_lidar['voxel_num_points']
         record_len = data_dict['record_len']
 
         batch_dict = {'voxel_features': voxel_features,
@@ -1,12 +1,14 @@
 import torch
 import torch.nn as nn
 
+from opencood.data_utils.pre_processor.sp_voxel_preprocessor import \
+    SpVoxelPreprocessor
 from opencood.models.sub_modules.pillar_vfe import PillarVFE
 from opencood.models.sub_modules.point_pillar_scatter import PointPillarScatter
 from opencood.models.sub_modules.base_bev_backbone import BaseBEVBackbone
 from opencood.models.fuse_modules.fuse_utils import regroup
 from opencood.models.sub_modules.downsample_conv import DownsampleConv
-from opencood.models.sub_modules.naive_compress import NaiveCompressor
+from opencood.models.sub_modules.feature_codec import build_compressor
 from opencood.models.fuse_modules.v2xvit_basic import V2XTransformer
 
 
@@ -15,6 +17,9 @@ class PointPillarTransformer(nn.Module):
         super(PointPillarTransformer, self).__init__()
 
         self.max_cav = args['max_cav']
+        # raw points of voxelize_on_device are voxelized in forward
+        self.voxel_args = args['voxel_args'] \
+            if 'voxel_args' in args else None
         # PIllar VFE
         self.pillar_vfe = PillarVFE(args['pillar_vfe'],
                                     num_point_features=4,
@@ -31,7 +36,7 @@ class PointPillarTransformer(nn.Module):
 
         if args['compression'] > 0:
             self.compression = True
-            self.naive_compressor = NaiveCompressor(256, args['compression'])
+            self.naive_compressor = build_compressor(256, args)
 
         self.fusion_net = V2XTransformer(args['transformer'])
 
@@ -69,9 +74,14 @@ class PointPillarTransformer(nn.Module):
             p.requires_grad = False
 
     def forward(self, data_dict):
-        voxel_features = data_dict['processed_lidar']['voxel_features']
-        voxel_coords = data_dict['processed_lidar']['voxel_coords']
-        voxel_num_points = data_dict['processed_lidar']['voxel_num_points']
+        processed_lidar = data_dict['processed_lidar']
+        if 'voxel_features' not in processed_lidar:
+            # raw points with voxelize_on_device
+            processed_lidar = SpVoxelPreprocessor.voxelize_torch(
+                processed_lidar, self.voxel_args, self.training)
+        voxel_features = processed_lidar['voxel_features']
+        voxel_coords = processed_lidar['voxel_coords']
+        voxel_num_points = processed_lidar['voxel_num_points']
         record_len = data_dict['record_len']
         spatial_correction_matrix = data_dict['spatial_correction_matrix']
 
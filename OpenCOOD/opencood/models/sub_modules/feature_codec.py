@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Feature codec that turns the intermediate features of every agent into the
+byte buffer it transmits: channel compression of NaiveCompressor, fp16 or
+int8 quantization and optional entropy coding.
+"""
+
+import importlib.util
+import zlib
+
+import numpy as np
+import torch
+
+from opencood.models.sub_modules.naive_compress import NaiveCompressor
+
+# data type of the quantized values and its code in the buffer header
+QUANTIZATION_DTYPES = {'fp32': 0, 'fp16': 1, 'int8': 2}
+# entropy coder of the quantized values and its code in the buffer header
+ENTROPY_CODERS = {'none': 0, 'zlib': 1, 'lz4': 2}
+
+
+def quantize_rows(values, dtype):
+    """
+    Serialize a matrix with the given data type. int8 values are scaled
+    per row by max(|row|) / 127.
+
+    Parameters
+    ----------
+    values : torch.Tensor
+        (R, D) float values.
+
+    dtype : str
+        'fp32', 'fp16' or 'int8'.
+
+    Returns
+    -------
+    buffer : bytes
+        The float32 scales of the rows for int8, followed by the values.
+    """
+    chunks = []
+    if dtype == 'int8':
+        scale = values.abs().amax(dim=1, keepdim=True) / 127
+        scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+        chunks.append(scale.float().cpu().numpy().tobytes())
+        values = torch.round(values / scale).to(torch.int8)
+    elif dtype == 'fp16':
+        values = values.half()
+    else:
+        values = values.float()
+    chunks.append(values.contiguous().cpu().numpy().tobytes())
+
+    return b''.join(chunks)
+
+
+def dequantize_rows(buffer, offset, rows, cols, code):
+    """
+    Read back a matrix written by quantize_rows.
+
+    Parameters
+    ----------
+    buffer : bytes
+        The buffer that contains the matrix.
+
+    offset : int
+        Position of the matrix in the buffer.
+
+    rows : int
+    cols : int
+
+    code : int
+        The code of the data type in QUANTIZATION_DTYPES.
+
+    Returns
+    -------
+    values : np.ndarray
+        (rows, cols) float32 values.
+
+    offset : int
+        Position right after the matrix.
+    """
+    if code == QUANTIZATION_DTYPES['int8']:
+        scale = np.frombuffer(buffer, dtype=np.float32, count=rows,
+                              offset=offset)
+        offset += scale.nbytes
+        values = np.frombuffer(buffer, dtype=np.int8, count=rows * cols,
+                               offset=offset)
+        offset += values.nbytes
+        values = values.reshape(rows, cols).astype(np.float32) * \
+            scale[:, np.newaxis]
+    else:
+        values = np.frombuffer(buffer,
+                               dtype=np.float16 if
+                               code == QUANTIZATION_DTYPES['fp16'] else
+                               np.float32,
+                               count=rows * cols, offset=offset)
+        offset += values.nbytes
+        values = values.reshape(rows, cols).astype(np.float32)
+
+    return values, offset
+
+
+def entropy_encode(data, coder):
+    if coder == 'zlib':
+        return zlib.compress(data)
+    if coder == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress(data)
+    return data
+
+
+def entropy_decode(data, code):
+    if code == ENTROPY_CODERS['zlib']:
+        return zlib.decompress(data)
+    if code == ENTROPY_CODERS['lz4']:
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    return data
+
+
+class FeatureCodec(NaiveCompressor):
+    """
+    NaiveCompressor whose compressed features go through a byte buffer at
+    inference. During training the quantization is simulated with a
+    straight-through estimator so that the decoder learns to undo it.
+
+    Parameters
+    ----------
+    input_dim : int
+        Channels of the features.
+
+    compress_raito : int
+        Channel compression ratio of the encoder.
+
+    dtype : str
+        Quantization of the compressed features, 'fp32', 'fp16' or 'int8'.
+        int8 features are scaled per channel of every agent.
+
+    entropy_coder : str
+        'none', 'zlib' or 'lz4', lossless coding of the quantized features.
+    """
+
+    def __init__(self, input_dim, compress_raito, dtype='fp16',
+                 entropy_coder='none'):
+        super().__init__(input_dim, compress_raito)
+        assert dtype in QUANTIZATION_DTYPES, \
+            '%s is not a supported quantization dtype' % dtype
+        assert entropy_coder in ENTROPY_CODERS, \
+            '%s is not a supported entropy coder' % entropy_coder
+        # fail at construction rather than at the first frame
+        assert entropy_coder != 'lz4' or \
+            importlib.util.find_spec('lz4') is not None, \
+            'the lz4 entropy coder needs the lz4 package'
+        self.dtype = dtype
+        self.entropy_coder = entropy_coder
+
+        # buffer sizes accumulated at inference. The features of every
+        # agent are encoded, the ego included, although the ego does not
+        # send its own.
+        self.encoded_bytes = 0
+        self.encoded_agents = 0
+
+    def encode(self, x):
+        """
+        Compress the features of every agent into a byte buffer.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            (N, C, H, W) features of N agents.
+
+        Returns
+        -------
+        buffers : list
+            N byte buffers: an int32 header (C', H, W, dtype code, entropy
+            coder code) followed by the coded (C', H * W) features.
+        """
+        x = self.encoder(x)
+        N, C, H, W = x.shape
+        header = np.array([C, H, W, QUANTIZATION_DTYPES[self.dtype],
+                           ENTROPY_CODERS[self.entropy_coder]],
+                          dtype=np.int32).tobytes()
+
+        buffers = []
+        for feature in x:
+            payload = quantize_rows(feature.reshape(C, H * W), self.dtype)
+            buffers.append(header + entropy_encode(payload,
+                                                   self.entropy_coder))
+        return buffers
+
+    def decode(self, buffers, device=None):
+        """
+        Restore the features of every agent from their byte buffers.
+
+        Parameters
+        ----------
+        buffers : list
+            Byte buffers produced by encode.
+
+        device : torch.device
+            Device of the output.
+
+        Returns
+        -------
+        x : torch.Tensor
+            (N, C, H, W) decoded features.
+        """
+        features = []
+        for buffer in buffers:
+            header = np.frombuffer(buffer, dtype=np.int32, count=5)
+            C, H, W, dtype_code, coder_code = header.tolist()
+            payload = entropy_decode(buffer[header.nbytes:], coder_code)
+            feature, _ = dequantize_rows(payload, 0, C, H * W, dtype_code)
+            features.append(torch.from_numpy(feature.reshape(C, H, W)))
+        x = torch.stack(features).to(device)
+
+        return self.decoder(x)
+
+    def fake_quantize(self, x):
+        """
+        Round the compressed features like the byte buffer does while
+        keeping the gradient of the identity.
+        """
+        if self.dtype == 'int8':
+            scale = x.abs().amax(dim=(2, 3), keepdim=True) / 127
+            scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+            quantized = torch.round(x / scale) * scale
+        elif self.dtype == 'fp16':
+            quantized = x.half().float()
+        else:
+            return x
+        return x + (quantized - x).detach()
+
+    def reset_statistics(self):
+        self.encoded_bytes = 0
+        self.encoded_agents = 0
+
+    def encoded_bytes_per_agent(self):
+        """
+        Mean size of the buffers encoded since the last reset, i.e. the
+        bytes a cav sends for its features. The ego buffers are included.
+        """
+        return self.encoded_bytes / max(self.encoded_agents, 1)
+
+    def forward(self, x):
+        if self.training:
+            x = self.fake_quantize(self.encoder(x))
+            return self.decoder(x)
+
+        buffers = self.encode(x)
+        self.encoded_bytes += sum(len(buffer) for buffer in buffers)
+        self.encoded_agents += len(buffers)
+        return self.decode(buffers, x.device)
+
+
+def build_compressor(input_dim, args):
+    """
+    NaiveCompressor, or FeatureCodec when the codec is configured.
+
+    Parameters
+    ----------
+    input_dim : int
+        Channels of the features.
+
+    args : dict
+        Model args with the compression ratio under 'compression' and the
+        optional codec params, e.g. {'dtype': 'int8', 'entropy_coder':
+        'zlib'}, under 'codec'.
+    """
+    if 'codec' in args:
+        return FeatureCodec(input_dim, args['compression'], **args['codec'])
+    return NaiveCompressor(input_dim, args['compression'])
@@ -14,31 +14,26 @@ class PointPillarScatter(nn.Module):
     def forward(self, batch_dict):
         pillar_features, coords = batch_dict['pillar_features'], batch_dict[
             'voxel_coords']
-        batch_spatial_features = []
         batch_size = coords[:, 0].max().int().item() + 1
 
-        for batch_idx in range(batch_size):
-            spatial_feature = torch.zeros(
-                self.num_bev_features,
-                self.nz * self.nx * self.ny,
-                dtype=pillar_features.dtype,
-                device=pillar_features.device)
+        batch_spatial_features = torch.zeros(
+            batch_size,
+            self.num_bev_features,
+            self.nz * self.nx * self.ny,
+            dtype=pillar_features.dtype,
+            device=pillar_features.device)
 
-            batch_mask = coords[:, 0] == batch_idx
-            this_coords = coords[batch_mask, :]
+        batch_indices = coords[:, 0].type(torch.long)
+        indices = coords[:, 1] + \
+                  coords[:, 2] * self.nx + \
+                  coords[:, 3]
+        indices = indices.type(torch.long)
 
-            indices = this_coords[:, 1] + \
-                      this_coords[:, 2] * self.nx + \
-                      this_coords[:, 3]
-            indices = indices.type(torch.long)
+        # scatter the pillars of all samples at once through a
+        # (batch, spatial, feature) view of the buffer
+        batch_spatial_features.permute(0, 2, 1).index_put_(
+            (batch_indices, indices), pillar_features)
 
-            pillars = pillar_features[batch_mask, :]
-            pillars = pillars.t()
-            spatial_feature[:, indices] = pillars
-            batch_spatial_features.append(spatial_feature)
-
-        batch_spatial_features = \
-            torch.stack(batch_spatial_features, 0)
         batch_spatial_features = \
             batch_spatial_features.view(batch_size, self.num_bev_features *
                                         self.nz, self.ny, self.nx)
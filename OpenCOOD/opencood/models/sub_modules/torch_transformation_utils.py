@@ -315,6 +315,34 @@ def convert_affinematrix_to_homography(A):
     return H
 
 
+def get_warp_affine_grid(M, src_size, dsize, align_corners=True):
+    r"""
+    Compute the sampling grid of warp_affine, so the same grid can be
+    reused or sampled from several sources in one F.grid_sample call.
+    Args:
+        M : torch.Tensor
+            Transformation matrix with shape :math:`(B,2,3)`.
+        src_size : tuple
+            Tuple of input image H and W.
+        dsize : tuple
+            Tuple of output image H_out and W_out.
+        align_corners : boolean
+            Parameter of F.affine_grid.
+
+    Returns:
+        Sampling grid with shape :math:`(B,H_out,W_out,2)`.
+    """
+    # we generate a 3x3 transformation matrix from 2x3 affine
+    M_3x3 = convert_affinematrix_to_homography(M)
+    dst_norm_trans_src_norm = normalize_homography(M_3x3, src_size, dsize)
+
+    # src_norm_trans_dst_norm = torch.inverse(dst_norm_trans_src_norm)
+    src_norm_trans_dst_norm = _torch_inverse_cast(dst_norm_trans_src_norm)
+    return F.affine_grid(src_norm_trans_dst_norm[:, :2, :],
+                         [M.shape[0], 1, dsize[0], dsize[1]],
+                         align_corners=align_corners)
+
+
 def warp_affine(
         src, M, dsize,
         mode='bilinear',
@@ -341,16 +369,7 @@ def warp_affine(
     """
 
     B, C, H, W = src.size()
-
-    # we generate a 3x3 transformation matrix from 2x3 affine
-    M_3x3 = convert_affinematrix_to_homography(M)
-    dst_norm_trans_src_norm = normalize_homography(M_3x3, (H, W), dsize)
-
-    # src_norm_trans_dst_norm = torch.inverse(dst_norm_trans_src_norm)
-    src_norm_trans_dst_norm = _torch_inverse_cast(dst_norm_trans_src_norm)
-    grid = F.affine_grid(src_norm_trans_dst_norm[:, :2, :],
-                         [B, C, dsize[0], dsize[1]],
-                         align_corners=align_corners)
+    grid = get_warp_affine_grid(M, (H, W), dsize, align_corners)
 
     return F.grid_sample(src.half() if grid.dtype==torch.half else src, 
                          grid, align_corners=align_corners, mode=mode,
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time the label map rasterization of BevPostprocessor for different numbers
+of objects.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from opencood.data_utils.post_processor.bev_postprocessor import \
+    BevPostprocessor
+from opencood.hypes_yaml.yaml_utils import load_yaml
+from opencood.utils import box_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="bev label generation "
+                                                 "benchmark")
+    parser.add_argument('--hypes_yaml', type=str,
+                        default='opencood/hypes_yaml/'
+                                'pixor_intermediate_fusion.yaml',
+                        help='hypes yaml of a pixor model')
+    parser.add_argument('--object_nums', type=int, nargs='+',
+                        default=[10, 50, 100],
+                        help='number of objects per frame')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of frames per object number')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_objects(lidar_range, object_num):
+    """
+    Random lwh boxes inside the lidar range, some of them overlapping.
+    """
+    object_bbx_center = np.zeros((object_num, 7))
+    object_bbx_center[:, 0] = \
+        np.random.uniform(lidar_range[0], lidar_range[3], object_num)
+    object_bbx_center[:, 1] = \
+        np.random.uniform(lidar_range[1], lidar_range[4], object_num)
+    object_bbx_center[:, 2] = np.random.uniform(-2, 0, object_num)
+    object_bbx_center[:, 3] = np.random.uniform(3.5, 6, object_num)
+    object_bbx_center[:, 4] = np.random.uniform(1.5, 2.5, object_num)
+    object_bbx_center[:, 5] = np.random.uniform(1.4, 2, object_num)
+    object_bbx_center[:, 6] = np.random.uniform(-np.pi, np.pi, object_num)
+    return object_bbx_center
+
+
+def main():
+    opt = test_parser()
+    hypes = load_yaml(opt.hypes_yaml)
+    post_processor = BevPostprocessor(hypes['postprocess'], train=True)
+    lidar_range = [post_processor.geometry_param[x] for x in
+                   ['L1', 'W1', 'H1', 'L2', 'W2', 'H2']]
+    label_shape = post_processor.geometry_param['label_shape']
+
+    print('label map %d x %d' % (label_shape[0], label_shape[1]))
+    for object_num in opt.object_nums:
+        label_time = 0
+        for _ in range(opt.repeat):
+            object_bbx_center = random_objects(lidar_range, object_num)
+            bev_corners = box_utils.boxes_to_corners2d(
+                object_bbx_center, post_processor.params['order'])[:, :, :2]
+            yaw = object_bbx_center[:, -1]
+            reg_targets = np.column_stack(
+                [np.cos(yaw), np.sin(yaw), object_bbx_center[:, 0],
+                 object_bbx_center[:, 1], object_bbx_center[:, 3],
+                 object_bbx_center[:, 4]])
+
+            label_map = np.zeros(label_shape)
+            start = time.perf_counter()
+            post_processor.update_label_map(label_map, bev_corners,
+                                            reg_targets)
+            label_time += time.perf_counter() - start
+
+        print('%d objects: %.2f ms per frame'
+              % (object_num, label_time / opt.repeat * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Encode the intermediate features of a PointPillar model with FeatureCodec
+and report the encoded bytes per agent, the coding time and the error to
+the fp32 NaiveCompressor for every compression ratio, dtype and entropy
+coder. The ap of a trained codec model is reported by inference.py along
+with its encoded bytes per agent.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.data_utils.datasets import build_dataset
+from opencood.models.sub_modules.feature_codec import FeatureCodec
+from opencood.models.sub_modules.naive_compress import NaiveCompressor
+from opencood.tools import train_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="feature codec benchmark")
+    parser.add_argument('--hypes_yaml', type=str,
+                        default='opencood/hypes_yaml/'
+                                'point_pillar_fcooper.yaml',
+                        help='hypes yaml of a pointpillar intermediate '
+                             'fusion model')
+    parser.add_argument('--validate_dir', type=str, default='',
+                        help='override the validate_dir of the hypes')
+    parser.add_argument('--ratios', type=int, nargs='+',
+                        default=[1, 4, 16, 32],
+                        help='channel compression ratios')
+    parser.add_argument('--dtypes', type=str, nargs='+',
+                        default=['fp32', 'fp16', 'int8'],
+                        help='quantization dtypes')
+    parser.add_argument('--entropy_coders', type=str, nargs='+',
+                        default=['none', 'zlib'],
+                        help='entropy coders, lz4 needs the lz4 package')
+    parser.add_argument('--frame_num', type=int, default=5,
+                        help='number of encoded frames')
+    opt = parser.parse_args()
+    return opt
+
+
+def collect_features(hypes, frame_num):
+    """
+    The features every agent would compress, i.e. the input of the fusion
+    network of the model without compression.
+    """
+    hypes['model']['args']['compression'] = 0
+    dataset = build_dataset(hypes, visualize=False, train=False)
+    model = train_utils.create_model(hypes)
+    model.eval()
+
+    features = []
+    model.fusion_net.register_forward_pre_hook(
+        lambda module, inputs: features.append(inputs[0]))
+    with torch.no_grad():
+        for i in range(min(frame_num, len(dataset))):
+            model(dataset.collate_batch_test([dataset[i]])['ego'])
+    return features
+
+
+def main():
+    opt = test_parser()
+    hypes = yaml_utils.load_yaml(opt.hypes_yaml)
+    if opt.validate_dir:
+        hypes['validate_dir'] = opt.validate_dir
+    features = collect_features(hypes, opt.frame_num)
+    input_dim = features[0].shape[1]
+    print('%d frames of %d x %d x %d features, %.1f KB per agent in fp32'
+          % (len(features), *features[0].shape[1:],
+             features[0][0].numel() * 4 / 1024))
+
+    for ratio in opt.ratios:
+        torch.manual_seed(0)
+        compressor = NaiveCompressor(input_dim, ratio)
+        compressor.eval()
+        for dtype in opt.dtypes:
+            for entropy_coder in opt.entropy_coders:
+                codec = FeatureCodec(input_dim, ratio, dtype, entropy_coder)
+                codec.load_state_dict(compressor.state_dict())
+                codec.eval()
+
+                encode_time = 0
+                decode_time = 0
+                error = []
+                with torch.no_grad():
+                    for x in features:
+                        start = time.perf_counter()
+                        buffers = codec.encode(x)
+                        encode_time += time.perf_counter() - start
+                        start = time.perf_counter()
+                        output = codec.decode(buffers, x.device)
+                        decode_time += time.perf_counter() - start
+
+                        codec.encoded_bytes += \
+                            sum(len(buffer) for buffer in buffers)
+                        codec.encoded_agents += len(buffers)
+                        expected = compressor(x)
+                        error.append(float((output - expected).abs().max() /
+                                           expected.abs().max()))
+                if dtype == 'fp32':
+                    assert max(error) < 1e-6, \
+                        'fp32 buffers are different from NaiveCompressor'
+
+                print('ratio %d, %s, %s: %.1f KB per agent, encode %.1f ms, '
+                      'decode %.1f ms per frame, max relative error %.2e'
+                      % (ratio, dtype, entropy_coder,
+                         codec.encoded_bytes_per_agent() / 1024,
+                         encode_time / len(features) * 1000,
+                         decode_time / len(features) * 1000,
+                         np.max(error)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Compare the throughput of the Where2comm and CoAlign fusion modules called
+once on the whole batch and once per sample.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from opencood.models.fuse_modules.coalign_fuse import Att_w_Warp
+from opencood.models.fuse_modules.where2comm_fuse import AttentionFusion, \
+    Communication
+from opencood.models.fuse_modules.fuse_utils import regroup as pad_regroup
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="fusion modules benchmark")
+    parser.add_argument('--record_len', type=int, nargs='+',
+                        default=[3, 2, 5, 1],
+                        help='number of agents of every sample')
+    parser.add_argument('--channels', type=int, default=64,
+                        help='feature channels')
+    parser.add_argument('--H', type=int, default=100,
+                        help='feature map height')
+    parser.add_argument('--W', type=int, default=352,
+                        help='feature map width')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed forward passes')
+    opt = parser.parse_args()
+    return opt
+
+
+def split_samples(x, record_len):
+    start = torch.cumsum(record_len, dim=0) - record_len
+    return [x[s:s + n] for s, n in zip(start.tolist(), record_len.tolist())]
+
+
+def random_affine_matrix(B, max_cav):
+    """
+    Random normalized rotations and translations within the map.
+    """
+    yaw = torch.rand(B, max_cav, max_cav) * 2 * np.pi
+    affine_matrix = torch.zeros(B, max_cav, max_cav, 2, 3)
+    affine_matrix[..., 0, 0] = torch.cos(yaw)
+    affine_matrix[..., 0, 1] = -torch.sin(yaw)
+    affine_matrix[..., 1, 0] = torch.sin(yaw)
+    affine_matrix[..., 1, 1] = torch.cos(yaw)
+    affine_matrix[..., 2] = torch.rand(B, max_cav, max_cav, 2) - 0.5
+    return affine_matrix
+
+
+def compare(name, batched_fn, per_sample_fn, batch_size, repeat):
+    """
+    Time the module on the whole batch and on every sample separately.
+    """
+    timing = []
+    with torch.no_grad():
+        for fn in [per_sample_fn, batched_fn]:
+            # warm up
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            timing.append(time.perf_counter() - start)
+    print('%s: per sample %.1f samples/s, batched %.1f samples/s, '
+          'speedup %.1fx' % (name, batch_size * repeat / timing[0],
+                             batch_size * repeat / timing[1],
+                             timing[0] / timing[1]))
+
+
+def main():
+    opt = test_parser()
+    torch.manual_seed(0)
+    record_len = torch.tensor(opt.record_len)
+    B = len(record_len)
+    N = int(record_len.sum())
+    x = torch.randn(N, opt.channels, opt.H, opt.W)
+    psm_single = torch.randn(N, 2, opt.H, opt.W)
+
+    communication = Communication({'threshold': 0.5,
+                                   'gaussian_smooth': {'k_size': 5,
+                                                       'c_sigma': 1.0}})
+    communication.eval()
+    compare('Where2comm communication',
+            lambda: communication(psm_single, record_len),
+            lambda: [communication(sample, record_len[b:b + 1])
+                     for b, sample in enumerate(
+                         split_samples(psm_single, record_len))],
+            B, opt.repeat)
+
+    attention_fusion = AttentionFusion(opt.channels)
+    L = int(record_len.max())
+    compare('Where2comm fusion',
+            lambda: attention_fusion(*pad_regroup(x, record_len, L)),
+            lambda: [attention_fusion(*pad_regroup(sample,
+                                                   record_len[b:b + 1],
+                                                   len(sample)))
+                     for b, sample in enumerate(
+                         split_samples(x, record_len))],
+            B, opt.repeat)
+
+    normalized_affine_matrix = random_affine_matrix(B, 5)
+    att_w_warp = Att_w_Warp(opt.channels)
+    compare('CoAlign Att_w_Warp',
+            lambda: att_w_warp(x, record_len, normalized_affine_matrix),
+            lambda: [att_w_warp(sample, record_len[b:b + 1],
+                                normalized_affine_matrix[b:b + 1])
+                     for b, sample in enumerate(
+                         split_samples(x, record_len))],
+            B, opt.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Microbenchmark of the per-sample overhead to resolve a dataset index to
+its scenario and timestamp on a synthetic dataset tree.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from opencood.data_utils.datasets.scenario_index import ScenarioIndex
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="scenario index benchmark")
+    parser.add_argument('--scenario_num', type=int, default=400,
+                        help='number of synthetic scenarios')
+    parser.add_argument('--timestamp_num', type=int, default=100,
+                        help='number of timestamps per scenario')
+    parser.add_argument('--cav_num', type=int, default=3,
+                        help='number of cavs per scenario')
+    parser.add_argument('--sample_num', type=int, default=20000,
+                        help='number of random lookups to time')
+    opt = parser.parse_args()
+    return opt
+
+
+def create_synthetic_tree(root_dir, scenario_num, timestamp_num, cav_num):
+    """
+    Create the folder layout of the dataset with empty frame files.
+    """
+    for i in range(scenario_num):
+        scenario_folder = os.path.join(root_dir, '%04d' % i)
+        os.makedirs(os.path.join(scenario_folder, 'cooperative'))
+        for cav_id in range(cav_num):
+            os.makedirs(os.path.join(scenario_folder, str(cav_id)))
+        for j in range(timestamp_num):
+            open(os.path.join(scenario_folder, 'cooperative',
+                              '%06d.json' % (2 * j)), 'w').close()
+
+
+def index_lookup(index, idx):
+    scenario_index, timestamp_index = index.locate(idx)
+    return scenario_index, index.timestamp_key(scenario_index,
+                                               timestamp_index)
+
+
+def main():
+    opt = test_parser()
+    root_dir = tempfile.mkdtemp(prefix='opencood_index_')
+
+    try:
+        create_synthetic_tree(root_dir, opt.scenario_num, opt.timestamp_num,
+                              opt.cav_num)
+
+        start = time.perf_counter()
+        index = ScenarioIndex(root_dir, max_cav=7)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        index = ScenarioIndex(root_dir, max_cav=7)
+        load_time = time.perf_counter() - start
+
+        len_record = index.len_record
+        sample_idx = np.random.randint(0, len_record[-1], opt.sample_num)
+        start = time.perf_counter()
+        for idx in sample_idx:
+            index_lookup(index, idx)
+        index_time = (time.perf_counter() - start) / opt.sample_num
+
+        print('%d scenarios, %d samples' % (len(index), len_record[-1]))
+        print('index build: %.3f s, index load: %.3f s'
+              % (build_time, load_time))
+        print('index lookup: %.2f us/sample' % (index_time * 1e6))
+    finally:
+        shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time the anchor label generation of VoxelPostprocessor for different
+numbers of objects. The size of the dense and sparse label formats of a
+batch is reported as well.
+"""
+
+import argparse
+import copy
+import pickle
+import time
+
+import numpy as np
+import torch
+
+from opencood.data_utils.post_processor.voxel_postprocessor import \
+    VoxelPostprocessor
+from opencood.hypes_yaml.yaml_utils import load_yaml
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="label generation "
+                                                 "benchmark")
+    parser.add_argument('--hypes_yaml', type=str,
+                        default='opencood/hypes_yaml/'
+                                'point_pillar_intermediate_fusion.yaml',
+                        help='hypes yaml of an anchor based model')
+    parser.add_argument('--object_nums', type=int, nargs='+',
+                        default=[10, 50, 100],
+                        help='number of objects per frame')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of frames per object number')
+    parser.add_argument('--batch_size', type=int, default=4,
+                        help='number of frames per batch for the label '
+                             'size report')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_objects(lidar_range, object_num, max_num):
+    """
+    Random hwl boxes inside the lidar range, padded to max_num.
+    """
+    object_bbx_center = np.zeros((max_num, 7))
+    mask = np.zeros(max_num)
+    object_bbx_center[:object_num, 0] = \
+        np.random.uniform(lidar_range[0], lidar_range[3], object_num)
+    object_bbx_center[:object_num, 1] = \
+        np.random.uniform(lidar_range[1], lidar_range[4], object_num)
+    object_bbx_center[:object_num, 2] = np.random.uniform(-2, 0, object_num)
+    object_bbx_center[:object_num, 3] = np.random.uniform(1.4, 2, object_num)
+    object_bbx_center[:object_num, 4] = np.random.uniform(1.5, 2.5, object_num)
+    object_bbx_center[:object_num, 5] = np.random.uniform(3.5, 6, object_num)
+    object_bbx_center[:object_num, 6] = \
+        np.random.uniform(-np.pi, np.pi, object_num)
+    mask[:object_num] = 1
+    return object_bbx_center, mask
+
+
+def label_size(label_batch_list, post_processor):
+    """
+    Bytes pickled from a dataloader worker and bytes of the collated
+    tensors of a batch of labels.
+    """
+    ipc_bytes = len(pickle.dumps(label_batch_list,
+                                 protocol=pickle.HIGHEST_PROTOCOL))
+    label_torch_dict = post_processor.collate_batch(label_batch_list)
+    tensor_bytes = sum(x.element_size() * x.nelement()
+                       for x in label_torch_dict.values()
+                       if isinstance(x, torch.Tensor))
+    return ipc_bytes, tensor_bytes, label_torch_dict
+
+
+def main():
+    opt = test_parser()
+    hypes = load_yaml(opt.hypes_yaml)
+    post_processor = VoxelPostprocessor(hypes['postprocess'], train=True)
+    sparse_params = copy.deepcopy(hypes['postprocess'])
+    sparse_params['label_format'] = 'sparse'
+    sparse_post_processor = VoxelPostprocessor(sparse_params, train=True)
+    lidar_range = hypes['postprocess']['anchor_args']['cav_lidar_range']
+    max_num = max(hypes['postprocess']['max_num'], max(opt.object_nums))
+
+    anchor_box = post_processor.generate_anchor_box()
+    print('%d anchors' % (anchor_box.size // 7))
+    # warm up
+    object_bbx_center, mask = random_objects(lidar_range, 1, max_num)
+    post_processor.generate_label(gt_box_center=object_bbx_center,
+                                  anchors=anchor_box, mask=mask)
+    for object_num in opt.object_nums:
+        label_time = 0
+        dense_batch = []
+        sparse_batch = []
+        for i in range(opt.repeat):
+            object_bbx_center, mask = \
+                random_objects(lidar_range, object_num, max_num)
+
+            start = time.perf_counter()
+            output = post_processor.generate_label(
+                gt_box_center=object_bbx_center,
+                anchors=post_processor.generate_anchor_box(),
+                mask=mask)
+            label_time += time.perf_counter() - start
+
+            if i < opt.batch_size:
+                dense_batch.append(output)
+                sparse_batch.append(sparse_post_processor.generate_label(
+                    gt_box_center=object_bbx_center,
+                    anchors=sparse_post_processor.generate_anchor_box(),
+                    mask=mask))
+
+        print('%d objects: %.2f ms per frame'
+              % (object_num, label_time / opt.repeat * 1000))
+
+        dense_ipc, dense_tensor, dense_dict = \
+            label_size(dense_batch, post_processor)
+        sparse_ipc, sparse_tensor, sparse_dict = \
+            label_size(sparse_batch, sparse_post_processor)
+        sparse_dict = VoxelPostprocessor.expand_label(sparse_dict)
+        for key in dense_dict:
+            assert torch.equal(dense_dict[key], sparse_dict[key]), \
+                'expanded sparse %s is different from the dense one' % key
+        print('    batch of %d: ipc %.1f KB dense / %.1f KB sparse, '
+              'collated %.1f KB dense / %.1f KB sparse'
+              % (len(dense_batch), dense_ipc / 1024, sparse_ipc / 1024,
+                 dense_tensor / 1024, sparse_tensor / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time the object merging of box_utils.merge_object_stacks for crowded
+frames, e.g. the uav views which observe hundreds of objects each, with
+integer and string object ids.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from opencood.utils import box_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="object merging benchmark")
+    parser.add_argument('--object_nums', type=int, nargs='+',
+                        default=[50, 500, 2000],
+                        help='number of objects in the scene')
+    parser.add_argument('--cav_num', type=int, default=5,
+                        help='number of cavs observing the scene')
+    parser.add_argument('--visible_ratio', type=float, default=0.6,
+                        help='ratio of the objects observed by every cav')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of frames per object number')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_frame(object_num, cav_num, visible_ratio):
+    """
+    Every cav observes a random subset of the objects, in random order.
+    """
+    scene_ids = np.random.choice(1000000, object_num, replace=False)
+    scene_objects = np.random.uniform(-100, 100, (object_num, 7))
+
+    object_stack = []
+    object_id_stack = []
+    for _ in range(cav_num):
+        visible = np.random.permutation(object_num)[
+                  :int(object_num * visible_ratio)]
+        object_stack.append(scene_objects[visible])
+        object_id_stack += scene_ids[visible].tolist()
+    return object_stack, object_id_stack
+
+
+def main():
+    opt = test_parser()
+    # warm up
+    box_utils.merge_object_stacks(
+        *random_frame(10, opt.cav_num, opt.visible_ratio))
+
+    for object_num in opt.object_nums:
+        int_time = 0
+        str_time = 0
+        for _ in range(opt.repeat):
+            object_stack, object_id_stack = \
+                random_frame(object_num, opt.cav_num, opt.visible_ratio)
+            str_id_stack = [str(x) for x in object_id_stack]
+
+            start = time.perf_counter()
+            box_utils.merge_object_stacks(object_stack, object_id_stack)
+            int_time += time.perf_counter() - start
+
+            # the string ids go through the dict mapping
+            start = time.perf_counter()
+            box_utils.merge_object_stacks(object_stack, str_id_stack)
+            str_time += time.perf_counter() - start
+
+        print('%d objects, %d cavs: int ids %.3f ms, str ids %.3f ms'
+              % (object_num, opt.cav_num, int_time / opt.repeat * 1000,
+                 str_time / opt.repeat * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Compare the native pcd reader with the open3d reader on dataset frames.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from opencood.utils import pcd_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="pcd reader benchmark")
+    parser.add_argument('--pcd_dir', type=str, required=True,
+                        help='dataset folder, all pcd files under it are '
+                             'searched recursively')
+    parser.add_argument('--frame_num', type=int, default=200,
+                        help='maximum number of frames to read')
+    opt = parser.parse_args()
+    return opt
+
+
+def time_reader(reader, pcd_files):
+    start = time.perf_counter()
+    for pcd_file in pcd_files:
+        reader(pcd_file)
+    return (time.perf_counter() - start) / len(pcd_files)
+
+
+def main():
+    opt = test_parser()
+    pcd_files = sorted(glob.glob(os.path.join(opt.pcd_dir, '**', '*.pcd'),
+                                 recursive=True))[:opt.frame_num]
+    assert len(pcd_files) > 0, 'No pcd file found in %s' % opt.pcd_dir
+
+    try:
+        import open3d
+        has_open3d = True
+    except ImportError:
+        has_open3d = False
+
+    # the first pass also warms up the page cache for both readers
+    point_num = sum(pcd_utils.read_pcd(pcd_file).shape[0]
+                    for pcd_file in pcd_files)
+    native_time = time_reader(pcd_utils.read_pcd, pcd_files)
+    print('%d frames, %.0f points per frame'
+          % (len(pcd_files), point_num / len(pcd_files)))
+    print('native reader: %.2f ms/frame' % (native_time * 1000))
+    if has_open3d:
+        open3d_time = time_reader(pcd_utils.pcd_to_np_open3d, pcd_files)
+        print('open3d reader: %.2f ms/frame' % (open3d_time * 1000))
+        print('speedup: %.1fx' % (open3d_time / native_time))
+
+
+if __name__ == '__main__':
+    main()
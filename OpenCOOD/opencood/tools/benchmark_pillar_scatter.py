@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time the single-shot PointPillarScatter for different numbers of cavs.
+"""
+
+import argparse
+import time
+
+import torch
+
+from opencood.models.sub_modules.point_pillar_scatter import \
+    PointPillarScatter
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="pillar scatter benchmark")
+    parser.add_argument('--cav_nums', type=int, nargs='+', default=[2, 5, 7],
+                        help='number of cavs in the batch')
+    parser.add_argument('--pillar_num', type=int, default=12000,
+                        help='number of non-empty pillars per cav')
+    parser.add_argument('--num_features', type=int, default=64,
+                        help='pillar feature dimension')
+    parser.add_argument('--grid_size', type=int, nargs=2, default=[704, 200],
+                        help='bev grid size nx, ny')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of timed steps')
+    parser.add_argument('--device', type=str, default='cpu')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_batch(opt, cav_num):
+    nx, ny = opt.grid_size
+    coords = []
+    for i in range(cav_num):
+        # unique pillars, as given by the voxel generator
+        flat = torch.randperm(nx * ny)[:opt.pillar_num]
+        coords.append(torch.stack([torch.full_like(flat, i),
+                                   torch.zeros_like(flat),
+                                   flat // nx, flat % nx], dim=1))
+    coords = torch.cat(coords).int().to(opt.device)
+    pillar_features = torch.randn(len(coords), opt.num_features,
+                                  device=opt.device)
+    return {'pillar_features': pillar_features, 'voxel_coords': coords}
+
+
+def time_step(function, repeat, device):
+    function()
+    if device != 'cpu':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    if device != 'cpu':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    opt = test_parser()
+    scatter = PointPillarScatter({'num_features': opt.num_features,
+                                  'grid_size': [opt.grid_size[0],
+                                                opt.grid_size[1], 1]})
+
+    for cav_num in opt.cav_nums:
+        batch_dict = random_batch(opt, cav_num)
+        with torch.no_grad():
+            scatter_time = time_step(
+                lambda: scatter(dict(batch_dict)), opt.repeat, opt.device)
+        print('%d cavs: %.2f ms, %.2f ms per cav'
+              % (cav_num, scatter_time * 1000,
+                 scatter_time * 1000 / cav_num))
+
+if __name__ == '__main__':
+    main()
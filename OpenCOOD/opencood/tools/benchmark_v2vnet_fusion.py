@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time a forward pass and a training step of the batched message passing of
+V2VNetFusion for different numbers of agents.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from opencood.models.fuse_modules.v2v_fuse import V2VNetFusion
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="v2vnet fusion benchmark")
+    parser.add_argument('--agent_nums', type=int, nargs='+',
+                        default=[2, 5, 7],
+                        help='number of agents of the sample')
+    parser.add_argument('--channels', type=int, default=64,
+                        help='feature channels')
+    parser.add_argument('--H', type=int, default=50,
+                        help='feature map height')
+    parser.add_argument('--W', type=int, default=176,
+                        help='feature map width')
+    parser.add_argument('--max_message_memory', type=float, default=None,
+                        help='memory bound of the messages in MB')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed steps')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_pairwise_t_matrix(record_len, max_cav):
+    """
+    Random planar poses of the agents within 40m of the ego.
+    """
+    B = len(record_len)
+    pairwise_t_matrix = np.tile(np.eye(4), (B, max_cav, max_cav, 1, 1))
+    for b, N in enumerate(record_len):
+        yaw = np.random.uniform(-np.pi, np.pi, N)
+        poses = np.tile(np.eye(4), (N, 1, 1))
+        poses[:, 0, 0] = np.cos(yaw)
+        poses[:, 0, 1] = -np.sin(yaw)
+        poses[:, 1, 0] = np.sin(yaw)
+        poses[:, 1, 1] = np.cos(yaw)
+        poses[:, :2, 3] = np.random.uniform(-40, 40, (N, 2))
+        for i in range(N):
+            for j in range(N):
+                pairwise_t_matrix[b, i, j] = \
+                    np.linalg.solve(poses[j], poses[i])
+    return torch.from_numpy(pairwise_t_matrix).float()
+
+
+def build_fusion(opt):
+    args = {'in_channels': opt.channels,
+            'voxel_size': [0.4, 0.4, 4],
+            'downsample_rate': 4,
+            'num_iteration': 2,
+            'gru_flag': True,
+            'agg_operator': 'avg',
+            'conv_gru': {'H': opt.H, 'W': opt.W,
+                         'num_layers': 1,
+                         'kernel_size': [[3, 3]]}}
+    if opt.max_message_memory is not None:
+        args['max_message_memory'] = opt.max_message_memory
+    return V2VNetFusion(args)
+
+
+def forward_step(fusion, x, record_len, pairwise_t_matrix):
+    start = time.perf_counter()
+    with torch.no_grad():
+        fusion(x, record_len, pairwise_t_matrix)
+    return time.perf_counter() - start
+
+
+def train_step(fusion, x, record_len, pairwise_t_matrix):
+    start = time.perf_counter()
+    fusion.zero_grad()
+    fusion(x, record_len, pairwise_t_matrix).sum().backward()
+    return time.perf_counter() - start
+
+
+def main():
+    opt = test_parser()
+    torch.manual_seed(0)
+    np.random.seed(0)
+    fusion = build_fusion(opt)
+    max_cav = max(opt.agent_nums)
+
+    for agent_num in opt.agent_nums:
+        record_len = torch.tensor([agent_num])
+        x = torch.randn(agent_num, opt.channels, opt.H, opt.W)
+        pairwise_t_matrix = random_pairwise_t_matrix([agent_num], max_cav)
+
+        # warm up
+        train_step(fusion, x, record_len, pairwise_t_matrix)
+        forward_time = 0
+        step_time = 0
+        for _ in range(opt.repeat):
+            forward_time += forward_step(fusion, x, record_len,
+                                         pairwise_t_matrix)
+            step_time += train_step(fusion, x, record_len,
+                                    pairwise_t_matrix)
+        print('%d agents, %d channels, %dx%d: forward %.1f ms, training '
+              'step %.1f ms'
+              % (agent_num, opt.channels, opt.H, opt.W,
+                 forward_time / opt.repeat * 1000,
+                 step_time / opt.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Time VoxelPreprocessor on dataset frames or clustered random points.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from opencood.data_utils.pre_processor.voxel_preprocessor import \
+    VoxelPreprocessor
+from opencood.utils import pcd_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="voxel preprocessor "
+                                                 "benchmark")
+    parser.add_argument('--pcd_dir', type=str, default='',
+                        help='dataset folder to read frames from. Random '
+                             'points are used if not given.')
+    parser.add_argument('--frame_num', type=int, default=10,
+                        help='number of frames to check and time')
+    parser.add_argument('--point_num', type=int, default=100000,
+                        help='number of points of a random frame')
+    parser.add_argument('--T', type=int, default=32,
+                        help='maximum number of points per voxel')
+    opt = parser.parse_args()
+    return opt
+
+
+def load_frames(opt):
+    if opt.pcd_dir:
+        pcd_files = sorted(glob.glob(os.path.join(opt.pcd_dir, '**', '*.pcd'),
+                                     recursive=True))[:opt.frame_num]
+        assert len(pcd_files) > 0, 'No pcd file found in %s' % opt.pcd_dir
+        return [pcd_utils.pcd_to_np(x) for x in pcd_files]
+
+    # clustered points, so that many voxels exceed T
+    frames = []
+    for _ in range(opt.frame_num):
+        centers = np.random.uniform([-50, -40, -3], [50, 40, 1],
+                                    (opt.point_num // 50, 3))
+        xyz = np.repeat(centers, 50, axis=0) + \
+            np.random.normal(0, 0.3, (len(centers) * 50, 3))
+        intensity = np.random.uniform(0, 1, (len(xyz), 1))
+        frames.append(np.hstack([xyz, intensity]).astype(np.float32))
+    return frames
+
+
+def main():
+    opt = test_parser()
+    pre_processor = VoxelPreprocessor(
+        {'cav_lidar_range': [-140.8, -40, -3, 140.8, 40, 1],
+         'args': {'vw': 0.4, 'vh': 0.4, 'vd': 0.4, 'T': opt.T}},
+        train=False)
+    frames = load_frames(opt)
+
+    preprocess_time = 0
+    voxel_num = 0
+    for pcd_np in frames:
+        start = time.perf_counter()
+        output = pre_processor.preprocess(pcd_np)
+        preprocess_time += time.perf_counter() - start
+        voxel_num += len(output['voxel_coords'])
+
+    print('%d frames, %.0f points and %.0f voxels per frame'
+          % (len(frames), np.mean([len(x) for x in frames]),
+             voxel_num / len(frames)))
+    print('preprocess: %.2f ms/frame'
+          % (preprocess_time / len(frames) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Run Where2comm with the sparse transmission of the selected cells and report
+the bytes sent to the ego per frame, the fusion flops saved by only fusing
+the received cells and the difference of the predictions to the dense
+masked features for every threshold and transmission dtype.
+"""
+
+import argparse
+
+import torch
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.data_utils.datasets import build_dataset
+from opencood.tools import train_utils
+
+
+def test_parser():
+    parser = argparse.ArgumentParser(description="where2comm transmission "
+                                                 "benchmark")
+    parser.add_argument('--hypes_yaml', type=str,
+                        default='opencood/hypes_yaml/'
+                                'point_pillar_where2comm.yaml',
+                        help='hypes yaml of a where2comm model')
+    parser.add_argument('--model_dir', type=str, default='',
+                        help='load the config and the checkpoint of a '
+                             'trained model instead')
+    parser.add_argument('--validate_dir', type=str, default='',
+                        help='override the validate_dir of the hypes')
+    parser.add_argument('--thresholds', type=float, nargs='+',
+                        default=[0.01, 0.1, 0.3],
+                        help='communication thresholds')
+    parser.add_argument('--dtypes', type=str, nargs='+',
+                        default=['fp32', 'fp16', 'int8'],
+                        help='transmission dtypes')
+    parser.add_argument('--frame_num', type=int, default=10,
+                        help='number of evaluated frames')
+    opt = parser.parse_args()
+    return opt
+
+
+def main():
+    opt = test_parser()
+    hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+    if opt.validate_dir:
+        hypes['validate_dir'] = opt.validate_dir
+
+    dataset = build_dataset(hypes, visualize=False, train=False)
+    model = train_utils.create_model(hypes)
+    if opt.model_dir:
+        _, model = train_utils.load_saved_model(opt.model_dir, model)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model.to(device)
+    model.eval()
+    fusion_net = model.fusion_net
+    assert not fusion_net.fully, 'the fully connected graph sends everything'
+
+    frames = [train_utils.to_device(
+        dataset.collate_batch_test([dataset[i]]), device)
+        for i in range(min(opt.frame_num, len(dataset)))]
+
+    for threshold in opt.thresholds:
+        fusion_net.naive_communication.threshold = threshold
+        # the features the cavs would send without the sparse transmission
+        fusion_net.transmission_dtype = None
+        with torch.no_grad():
+            dense_psm = [model(frame['ego'])['psm'] for frame in frames]
+
+        for dtype in opt.dtypes:
+            fusion_net.transmission_dtype = dtype
+            fusion_net.reset_statistics()
+            psm_error = []
+            with torch.no_grad():
+                for frame, expected in zip(frames, dense_psm):
+                    output_dict = model(frame['ego'])
+                    psm_error.append(float(
+                        (output_dict['psm'] - expected).abs().max()))
+            summary = fusion_net.transmission_summary()
+
+            print('threshold %.2f, %s: %.1f KB per frame (dense fp32 %.1f '
+                  'KB), %.1f%% fusion flops saved, max psm difference %.2e'
+                  % (threshold, dtype, summary['comm_bytes_per_frame'] / 1024,
+                     summary['dense_comm_bytes_per_frame'] / 1024,
+                     summary['fusion_flops_saved'] * 100, max(psm_error)))
+
+if __name__ == '__main__':
+    main()
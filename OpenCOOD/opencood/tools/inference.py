@@ -8,6 +8,7 @@ import os
 import time
 from tqdm import tqdm
 
+import numpy as np
 import torch
 import open3d as o3d
 from torch.utils.data import DataLoader
@@ -15,6 +16,8 @@ from torch.utils.data import DataLoader
 import opencood.hypes_yaml.yaml_utils as yaml_utils
 from opencood.tools import train_utils, inference_utils
 from opencood.data_utils.datasets import build_dataset
+from opencood.models.fuse_modules.where2comm_fuse import Where2comm
+from opencood.models.sub_modules.feature_codec import FeatureCodec
 from opencood.utils import eval_utils
 from opencood.visualization import vis_utils
 import matplotlib.pyplot as plt
@@ -41,6 +44,14 @@ def test_parser():
                         help='whether to globally sort detections by confidence score.'
                              'If set to True, it is the mainstream AP computing method,'
                              'but would increase the tolerance for FP (False Positives).')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of frames inferred together in early '
+                             'and intermediate fusion')
+    parser.add_argument('--num_eval_workers', type=int, default=0,
+                        help='number of processes evaluating the predictions '
+                             'while the model runs. 0 evaluates in the main '
+                             'loop. If set, saving npy files also moves '
+                             'to a background thread.')
     opt = parser.parse_args()
     return opt
 
@@ -48,6 +59,8 @@ def test_parser():
 def main():
     opt = test_parser()
     assert opt.fusion_method in ['late', 'early', 'intermediate']
+    assert opt.batch_size == 1 or opt.fusion_method != 'late', \
+        'late fusion only supports batch size 1'
     assert not (opt.show_vis and opt.show_sequence), 'you can only visualize ' \
                                                     'the results in single ' \
                                                     'image mode or video mode'
@@ -57,8 +70,14 @@ def main():
     print('Dataset Building')
     opencood_dataset = build_dataset(hypes, visualize=True, train=False)
     print(f"{len(opencood_dataset)} samples found.")
+    # only the postprocessors with post_process_batch decode several
+    # frames at once
+    assert opt.batch_size == 1 or \
+        hasattr(opencood_dataset.post_processor, 'post_process_batch'), \
+        '%s only supports batch size 1' % \
+        type(opencood_dataset.post_processor).__name__
     data_loader = DataLoader(opencood_dataset,
-                             batch_size=1,
+                             batch_size=opt.batch_size,
                              num_workers=16,
                              collate_fn=opencood_dataset.collate_batch_test,
                              shuffle=False,
@@ -77,11 +96,17 @@ def main():
     _, model = train_utils.load_saved_model(saved_path, model)
     model.eval()
 
-    # Create the dictionary for evaluation.
+    # Create the statistics for evaluation.
     # also store the confidence score for each prediction
-    result_stat = {0.3: {'tp': [], 'fp': [], 'gt': 0, 'score': []},                
-                   0.5: {'tp': [], 'fp': [], 'gt': 0, 'score': []},                
-                   0.7: {'tp': [], 'fp': [], 'gt': 0, 'score': []}}
+    iou_thresholds = [0.3, 0.5, 0.7]
+    eval_pool = None
+    writer = None
+    if opt.num_eval_workers > 0:
+        eval_pool = inference_utils.EvalWorkerPool(iou_thresholds,
+                                                   opt.num_eval_workers)
+        writer = inference_utils.BackgroundWriter()
+    else:
+        result_stat = eval_utils.ResultStat(iou_thresholds)
 
     if opt.show_sequence:
         vis = o3d.visualization.Visualizer()
@@ -123,83 +148,119 @@ def main():
                 raise NotImplementedError('Only early, late and intermediate'
                                           'fusion is supported.')
 
-            eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                       pred_score,
-                                       gt_box_tensor,
-                                       result_stat,
-                                       0.3)
-            eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                       pred_score,
-                                       gt_box_tensor,
-                                       result_stat,
-                                       0.5)
-            eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                       pred_score,
-                                       gt_box_tensor,
-                                       result_stat,
-                                       0.7)
-            if opt.save_npy:
-                npy_save_path = os.path.join(opt.model_dir, 'npy')
-                if not os.path.exists(npy_save_path):
-                    os.makedirs(npy_save_path)
-                inference_utils.save_prediction_gt(pred_box_tensor,
-                                                   gt_box_tensor,
-                                                   batch_data['ego'][
-                                                       'origin_lidar'][0],
-                                                   i,
-                                                   npy_save_path)
-
-            if opt.show_vis or opt.save_vis:
-                vis_save_path = ''
-                if opt.save_vis:
-                    vis_save_path = os.path.join(opt.model_dir, 'vis')
-                    if not os.path.exists(vis_save_path):
-                        os.makedirs(vis_save_path)
-                    vis_save_path = os.path.join(vis_save_path, '%05d.png' % i)
-
-                opencood_dataset.visualize_result(pred_box_tensor,
-                                                  gt_box_tensor,
-                                                  batch_data['ego'][
-                                                      'origin_lidar'],
-                                                  opt.show_vis,
-                                                  vis_save_path,
-                                                  dataset=opencood_dataset)
-
-            if opt.show_sequence:
-                pcd, pred_o3d_box, gt_o3d_box = \
-                    vis_utils.visualize_inference_sample_dataloader(
-                        pred_box_tensor,
-                        gt_box_tensor,
-                        batch_data['ego']['origin_lidar'],
-                        vis_pcd,
-                        mode='constant'
-                        )
-                if i == 0:
-                    vis.add_geometry(pcd)
+            # batched inference returns the results of every frame
+            if not isinstance(gt_box_tensor, list):
+                pred_box_tensor = [pred_box_tensor]
+                pred_score = [pred_score]
+                gt_box_tensor = [gt_box_tensor]
+
+            for j in range(len(gt_box_tensor)):
+                frame_index = i * opt.batch_size + j
+                frame_pred_box = pred_box_tensor[j]
+                frame_pred_score = pred_score[j]
+                frame_gt_box = gt_box_tensor[j]
+                origin_lidar = batch_data['ego']['origin_lidar'][j:j + 1]
+                # all the detectors and annotations have a single class,
+                # vehicle, it is reported as the class 0 ap
+                frame_pred_label = None if frame_pred_box is None else \
+                    np.zeros(frame_pred_box.shape[0], dtype=np.int64)
+                frame_gt_label = np.zeros(frame_gt_box.shape[0],
+                                          dtype=np.int64)
+
+                # the iou matrix is shared by all the thresholds
+                if eval_pool is not None:
+                    eval_pool.submit(frame_pred_box,
+                                     frame_pred_score,
+                                     frame_gt_box,
+                                     frame_pred_label,
+                                     frame_gt_label)
+                else:
+                    result_stat.update(frame_pred_box,
+                                       frame_pred_score,
+                                       frame_gt_box,
+                                       frame_pred_label,
+                                       frame_gt_label)
+                if opt.save_npy:
+                    npy_save_path = os.path.join(opt.model_dir, 'npy')
+                    if not os.path.exists(npy_save_path):
+                        os.makedirs(npy_save_path)
+                    save_args = (frame_pred_box,
+                                 frame_gt_box,
+                                 origin_lidar[0],
+                                 frame_index,
+                                 npy_save_path)
+                    if writer is not None:
+                        writer.submit(inference_utils.save_prediction_gt,
+                                      *save_args)
+                    else:
+                        inference_utils.save_prediction_gt(*save_args)
+
+                if opt.show_vis or opt.save_vis:
+                    vis_save_path = ''
+                    if opt.save_vis:
+                        vis_save_path = os.path.join(opt.model_dir, 'vis')
+                        if not os.path.exists(vis_save_path):
+                            os.makedirs(vis_save_path)
+                        vis_save_path = os.path.join(vis_save_path,
+                                                     '%05d.png' % frame_index)
+
+                    # open3d renders on the main thread only
+                    opencood_dataset.visualize_result(frame_pred_box,
+                                                      frame_gt_box,
+                                                      origin_lidar,
+                                                      opt.show_vis,
+                                                      vis_save_path,
+                                                      dataset=opencood_dataset)
+
+                if opt.show_sequence:
+                    pcd, pred_o3d_box, gt_o3d_box = \
+                        vis_utils.visualize_inference_sample_dataloader(
+                            frame_pred_box,
+                            frame_gt_box,
+                            origin_lidar,
+                            vis_pcd,
+                            mode='constant'
+                            )
+                    if frame_index == 0:
+                        vis.add_geometry(pcd)
+                        vis_utils.linset_assign_list(vis,
+                                                     vis_aabbs_pred,
+                                                     pred_o3d_box,
+                                                     update_mode='add')
+
+                        vis_utils.linset_assign_list(vis,
+                                                     vis_aabbs_gt,
+                                                     gt_o3d_box,
+                                                     update_mode='add')
+
                     vis_utils.linset_assign_list(vis,
                                                  vis_aabbs_pred,
-                                                 pred_o3d_box,
-                                                 update_mode='add')
-
+                                                 pred_o3d_box)
                     vis_utils.linset_assign_list(vis,
                                                  vis_aabbs_gt,
-                                                 gt_o3d_box,
-                                                 update_mode='add')
-
-                vis_utils.linset_assign_list(vis,
-                                             vis_aabbs_pred,
-                                             pred_o3d_box)
-                vis_utils.linset_assign_list(vis,
-                                             vis_aabbs_gt,
-                                             gt_o3d_box)
-                vis.update_geometry(pcd)
-                vis.poll_events()
-                vis.update_renderer()
-                time.sleep(0.001)
+                                                 gt_o3d_box)
+                    vis.update_geometry(pcd)
+                    vis.poll_events()
+                    vis.update_renderer()
+                    time.sleep(0.001)
+
+    if eval_pool is not None:
+        writer.close()
+        result_stat = eval_pool.close()
+
+    # the communication cost is reported along with the ap
+    comm_stats = {}
+    if isinstance(getattr(model, 'naive_compressor', None), FeatureCodec):
+        comm_stats['encoded_bytes_per_agent'] = \
+            model.naive_compressor.encoded_bytes_per_agent()
+    if isinstance(getattr(model, 'fusion_net', None), Where2comm) and \
+            model.fusion_net.transmission_summary() is not None:
+        comm_stats.update(model.fusion_net.transmission_summary())
 
     eval_utils.eval_final_results(result_stat,
                                   opt.model_dir,
-                                  opt.global_sort_detections)
+                                  opt.global_sort_detections,
+                                  comm_stats)
     if opt.show_sequence:
         vis.destroy_window()
 
@@ -3,12 +3,17 @@
 # License: TDG-Attribution-NonCommercial-NoDistrib
 
 
+import multiprocessing
 import os
+import queue
+import threading
+import traceback
 from collections import OrderedDict
 
 import numpy as np
 import torch
 
+from opencood.utils import eval_utils
 from opencood.utils.common_utils import torch_tensor_to_numpy
 
 
@@ -101,3 +106,195 @@ def save_prediction_gt(pred_tensor, gt_tensor, pcd, timestamp, save_path):
     np.save(os.path.join(save_path, '%04d_pcd.npy' % timestamp), pcd_np)
     # np.save(os.path.join(save_path, '%04d_pred.npy' % timestamp), pred_np)
     np.save(os.path.join(save_path, '%04d_gt.npy_test' % timestamp), gt_np)
+
+
+def eval_worker(iou_thresholds, task_queue, result_queue):
+    """
+    Evaluation process: match the frames from the task queue until None is
+    received, then send back the statistics. An exception is sent back
+    instead of the statistics and stops the process.
+    """
+    try:
+        result_stat = eval_utils.ResultStat(iou_thresholds)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            frame_index, pred_box, pred_score, gt_box, pred_label, \
+                gt_label = task
+            result_stat.update(pred_box, pred_score, gt_box, pred_label,
+                               gt_label, frame_index=frame_index)
+    except Exception:
+        # the traceback is sent as a string, the exception itself may not
+        # be picklable
+        result_queue.put(RuntimeError('evaluation worker failed:\n%s'
+                                      % traceback.format_exc()))
+        return
+    result_queue.put(result_stat)
+
+
+class EvalWorkerPool(object):
+    """
+    Evaluate the predictions in worker processes, so the model does not
+    wait for the box matching. The task queue is bounded, thus the main
+    loop blocks instead of piling up frames if the workers fall behind.
+    A failed or killed worker is reported by `submit` and `close` instead
+    of blocking them forever.
+
+    Parameters
+    ----------
+    iou_thresholds : list
+        The iou thresholds to evaluate.
+
+    num_workers : int
+        Number of evaluation processes.
+
+    max_queue_size : int
+        Maximum number of frames waiting for evaluation.
+
+    poll_interval : float
+        Seconds between two checks of the workers while waiting.
+    """
+
+    def __init__(self, iou_thresholds, num_workers, max_queue_size=64,
+                 poll_interval=1.0):
+        self.iou_thresholds = list(iou_thresholds)
+        self.frame_num = 0
+        self.poll_interval = poll_interval
+        self.task_queue = multiprocessing.Queue(max_queue_size)
+        self.result_queue = multiprocessing.Queue()
+        self.workers = [
+            multiprocessing.Process(target=eval_worker,
+                                    args=(self.iou_thresholds,
+                                          self.task_queue,
+                                          self.result_queue),
+                                    daemon=True)
+            for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def check_workers(self):
+        """
+        Raise the error of a worker that stopped before the end of the
+        evaluation, the workers only exit by themselves when they fail.
+        """
+        for worker in self.workers:
+            if worker.exitcode is None:
+                continue
+            try:
+                result = self.result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                result = None
+            if isinstance(result, Exception):
+                raise result
+            raise RuntimeError('evaluation worker exited with code %d'
+                               % worker.exitcode)
+
+    def put(self, task):
+        while True:
+            try:
+                self.task_queue.put(task, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                self.check_workers()
+
+    def submit(self, pred_box_tensor, pred_score, gt_box_tensor,
+               pred_label=None, gt_label=None):
+        """
+        Queue the prediction and gt of a frame, and optionally their
+        classes, for evaluation.
+        """
+        self.check_workers()
+        if pred_box_tensor is not None:
+            pred_box_tensor = torch_tensor_to_numpy(pred_box_tensor)
+            pred_score = torch_tensor_to_numpy(pred_score)
+        self.put((self.frame_num, pred_box_tensor, pred_score,
+                  torch_tensor_to_numpy(gt_box_tensor), pred_label,
+                  gt_label))
+        self.frame_num += 1
+
+    def close(self):
+        """
+        Wait for all the frames to be evaluated.
+
+        Returns
+        -------
+        result_stat : opencood.utils.eval_utils.ResultStat
+            The merged statistics, the same as evaluating all frames in
+            order in a single process.
+        """
+        for _ in self.workers:
+            self.put(None)
+        # collect before joining, a process does not exit before its
+        # queued data is consumed
+        worker_stats = []
+        while len(worker_stats) < len(self.workers):
+            try:
+                result = self.result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                # a finished worker has flushed its result before exiting,
+                # so a dead worker without result was killed
+                if any(worker.exitcode not in (None, 0)
+                       for worker in self.workers):
+                    self.terminate()
+                    raise RuntimeError('evaluation worker was killed')
+                continue
+            if isinstance(result, Exception):
+                self.terminate()
+                raise result
+            worker_stats.append(result)
+        for worker in self.workers:
+            worker.join()
+
+        result_stat = eval_utils.ResultStat(self.iou_thresholds)
+        result_stat.merge(worker_stats)
+        return result_stat
+
+    def terminate(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+
+
+class BackgroundWriter(object):
+    """
+    Run the npy saving functions in a background thread, in the order they
+    are submitted. The open3d rendering stays on the main thread, as its
+    windowing backend is not thread-safe.
+
+    Parameters
+    ----------
+    max_queue_size : int
+        Maximum number of pending writes before `submit` blocks.
+    """
+
+    def __init__(self, max_queue_size=64):
+        self.task_queue = queue.Queue(max_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            function, args, kwargs = task
+            # keep draining the queue after an error so submit never blocks
+            if self.error is not None:
+                continue
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                self.error = e
+
+    def submit(self, function, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.task_queue.put((function, args, kwargs))
+
+    def close(self):
+        self.task_queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
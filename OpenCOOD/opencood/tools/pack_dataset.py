@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Convert the pcd files of every scenario into a single packed file, which
+is read with memory-mapping when `data_format: packed` is set in the
+hypes yaml.
+"""
+
+import argparse
+import os
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from opencood.utils import pcd_utils
+
+
+def pack_parser():
+    parser = argparse.ArgumentParser(description="pack dataset lidar")
+    parser.add_argument('--data_dir', type=str, required=True,
+                        help='dataset folder, e.g. the root_dir or '
+                             'validate_dir in the hypes yaml')
+    parser.add_argument('--point_format', type=str, default='float32',
+                        choices=list(pcd_utils.PACK_POINT_DTYPES.keys()),
+                        help='float32: (n, 4) float32 rows read without '
+                             'copy. float16: float16 xyz and uint8 '
+                             'intensity, 7 bytes per point.')
+    parser.add_argument('--num_workers', type=int, default=8,
+                        help='number of scenarios packed in parallel')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='repack scenarios that are already packed')
+    opt = parser.parse_args()
+    return opt
+
+
+def pack_scenario(args):
+    """
+    Pack all pcd files of all cavs in a scenario folder.
+    """
+    scenario_folder, point_format, overwrite = args
+    pack_file = os.path.join(scenario_folder, pcd_utils.PACK_FILE_NAME)
+    if os.path.exists(pack_file) and not overwrite:
+        return 0
+
+    pcd_files = {}
+    for cav_id in sorted(os.listdir(scenario_folder)):
+        cav_path = os.path.join(scenario_folder, cav_id)
+        if not os.path.isdir(cav_path) or cav_id == 'cooperative':
+            continue
+        for pcd_name in sorted(os.listdir(cav_path)):
+            if pcd_name.endswith('.pcd'):
+                pcd_files[cav_id + '/' + pcd_name] = \
+                    os.path.join(cav_path, pcd_name)
+
+    # write to a temporary file first so an interrupted run never leaves
+    # a broken pack behind
+    tmp_file = pack_file + '.tmp'
+    pcd_utils.write_packed_pcd(tmp_file, pcd_files, point_format)
+    os.replace(tmp_file, pack_file)
+    return len(pcd_files)
+
+
+def main():
+    opt = pack_parser()
+    scenario_folders = sorted([os.path.join(opt.data_dir, x)
+                               for x in os.listdir(opt.data_dir) if
+                               os.path.isdir(os.path.join(opt.data_dir, x))])
+    tasks = [(x, opt.point_format, opt.overwrite) for x in scenario_folders]
+
+    frame_num = 0
+    with Pool(opt.num_workers) as pool:
+        for num in tqdm(pool.imap_unordered(pack_scenario, tasks),
+                        total=len(tasks)):
+            frame_num += num
+    print('%d frames of %d scenarios are packed.'
+          % (frame_num, len(scenario_folders)))
+
+
+if __name__ == '__main__':
+    main()
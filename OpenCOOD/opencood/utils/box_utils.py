@@ -491,6 +491,63 @@ def project_world_objects(object_dict,
             output_dict.update({object_id: bbx_lidar})
 
 
+def unique_object_indices(object_ids):
+    """
+    Find the first occurrence of every object id, e.g. to merge the objects
+    seen by several cavs. Integer ids are deduplicated with np.unique,
+    other hashable ids with an id -> row mapping.
+
+    Parameters
+    ----------
+    object_ids : list
+        The object ids of all the rows, with repetitions.
+
+    Returns
+    -------
+    unique_indices : np.ndarray
+        The row of the first occurrence of each id, in the order the ids
+        first appear.
+    """
+    if len(object_ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    ids = np.asarray(object_ids)
+    if ids.ndim == 1 and np.issubdtype(ids.dtype, np.integer):
+        _, unique_indices = np.unique(ids, return_index=True)
+        return np.sort(unique_indices)
+
+    first_row = {}
+    for i, object_id in enumerate(object_ids):
+        first_row.setdefault(object_id, i)
+    return np.fromiter(first_row.values(), dtype=np.int64,
+                       count=len(first_row))
+
+
+def merge_object_stacks(object_stack, object_id_stack):
+    """
+    Merge the objects of several cavs into one array without repetitive
+    objects.
+
+    Parameters
+    ----------
+    object_stack : list
+        The (n_i, 7) object bbx centers of each cav.
+
+    object_id_stack : list
+        The object ids of all the cavs, concatenated in the same order.
+
+    Returns
+    -------
+    object_stack : np.ndarray
+        (n, 7) merged objects, in the order they first appear.
+
+    unique_indices : np.ndarray
+        The rows of the concatenated objects that are kept.
+    """
+    unique_indices = unique_object_indices(object_id_stack)
+    return np.vstack(object_stack)[unique_indices], unique_indices
+
+
 def get_points_in_rotated_box(p, box_corner):
     """
     Get points within a rotated bounding box (2D version).
@@ -596,7 +653,7 @@ def nms_rotated(boxes, scores, threshold):
     Parameters
     ----------
     boxes : torch.tensor
-        The location preds with shape (N, 4, 2).
+        The location preds with shape (N, 8, 3) or (N, 4, 2).
 
     scores : torch.tensor
         The predicted confidence score with shape (N,)
@@ -608,33 +665,218 @@ def nms_rotated(boxes, scores, threshold):
     -------
         An array of index
     """
-    if boxes.shape[0] == 0:
-        return np.array([], dtype=np.int32)
-    boxes = boxes.cpu().detach().numpy()
-    scores = scores.cpu().detach().numpy()
+    keep_index = nms_rotated_torch(boxes.detach(), scores.detach(), threshold)
+    return keep_index.cpu().numpy().astype(np.int32)
+
+
+def polygon_area_torch(polygons):
+    """
+    Area of simple polygons by the shoelace formula.
+
+    Parameters
+    ----------
+    polygons : torch.Tensor
+        (..., K, 2) vertices in clockwise or counterclockwise order.
+
+    Returns
+    -------
+    area : torch.Tensor
+        (...)
+    """
+    x, y = polygons[..., 0], polygons[..., 1]
+    return 0.5 * torch.abs(torch.sum(x * torch.roll(y, -1, dims=-1) -
+                                     torch.roll(x, -1, dims=-1) * y, dim=-1))
+
+
+def convex_quads_intersection_area_torch(quads_a, quads_b):
+    """
+    Intersection area of pairs of convex quadrilaterals. The vertices of
+    the intersection are the corners of each quad inside the other one and
+    the crossings of their edges, sorted by angle around their centroid.
+
+    Parameters
+    ----------
+    quads_a : torch.Tensor
+        (K, 4, 2) corners in clockwise or counterclockwise order.
 
-    polygons = common_utils.convert_format(boxes)
+    quads_b : torch.Tensor
+        (K, 4, 2)
+
+    Returns
+    -------
+    area : torch.Tensor
+        (K,)
+    """
+    eps = 1e-8
+
+    def inside(points, quads):
+        # a point is inside a convex polygon if it is on the same side of
+        # all the edges
+        edges = torch.roll(quads, -1, dims=1) - quads
+        rel = points[:, :, None, :] - quads[:, None, :, :]
+        cross = edges[:, None, :, 0] * rel[..., 1] - \
+            edges[:, None, :, 1] * rel[..., 0]
+        return torch.all(cross >= -eps, dim=2) | \
+            torch.all(cross <= eps, dim=2)
+
+    # crossings of every edge of a with every edge of b, (K, 4, 4)
+    start_a = quads_a[:, :, None, :]
+    start_b = quads_b[:, None, :, :]
+    dir_a = torch.roll(quads_a, -1, dims=1)[:, :, None, :] - start_a
+    dir_b = torch.roll(quads_b, -1, dims=1)[:, None, :, :] - start_b
+    delta = start_b - start_a
+    denom = dir_a[..., 0] * dir_b[..., 1] - dir_a[..., 1] * dir_b[..., 0]
+    parallel = torch.abs(denom) < eps
+    denom = torch.where(parallel, torch.ones_like(denom), denom)
+    t = (delta[..., 0] * dir_b[..., 1] - delta[..., 1] * dir_b[..., 0]) / \
+        denom
+    u = (delta[..., 0] * dir_a[..., 1] - delta[..., 1] * dir_a[..., 0]) / \
+        denom
+    crossing_valid = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    crossings = start_a + t[..., None] * dir_a
+
+    K = quads_a.shape[0]
+    vertices = torch.cat([quads_a, quads_b, crossings.reshape(K, 16, 2)],
+                         dim=1)
+    valid = torch.cat([inside(quads_a, quads_b),
+                       inside(quads_b, quads_a),
+                       crossing_valid.reshape(K, 16)], dim=1)
+
+    num_valid = valid.sum(dim=1)
+    centroid = torch.sum(vertices * valid[..., None], dim=1) / \
+        torch.clamp(num_valid, min=1)[:, None]
+    rel = vertices - centroid[:, None, :]
+    angle = torch.where(valid, torch.atan2(rel[..., 1], rel[..., 0]),
+                        torch.full_like(rel[..., 0], float('inf')))
+    order = torch.argsort(angle, dim=1)
+    vertices = torch.gather(vertices, 1, order[..., None].expand(-1, -1, 2))
+    valid = torch.gather(valid, 1, order)
+    # the unused slots repeat the first vertex and add no area
+    vertices = torch.where(valid[..., None], vertices, vertices[:, :1, :])
+
+    area = polygon_area_torch(vertices)
+    return torch.where(num_valid < 3, torch.zeros_like(area), area)
+
+
+def rotated_boxes_iou_torch(boxes_a, boxes_b, chunk_size=65536):
+    """
+    BEV iou between every pair of rotated boxes, without shapely. It runs
+    on the device of the boxes and computes in float64. Only the pairs
+    with overlapping standup boxes are computed exactly.
+
+    Parameters
+    ----------
+    boxes_a : torch.Tensor
+        (N, 8, 3) or (N, 4, 2) box corners. The first four corners are the
+        bottom face.
+
+    boxes_b : torch.Tensor
+        (M, 8, 3) or (M, 4, 2)
+
+    chunk_size : int
+        Number of pairs intersected at once, which bounds the memory of
+        the temporary vertices in crowded scenes.
+
+    Returns
+    -------
+    iou : torch.Tensor
+        (N, M) float32 iou.
+    """
+    quads_a = boxes_a[:, :4, :2].double()
+    quads_b = boxes_b[:, :4, :2].double()
+    iou = quads_a.new_zeros((quads_a.shape[0], quads_b.shape[0]),
+                            dtype=torch.float32)
+    if iou.numel() == 0:
+        return iou
+
+    min_a, max_a = quads_a.min(dim=1).values, quads_a.max(dim=1).values
+    min_b, max_b = quads_b.min(dim=1).values, quads_b.max(dim=1).values
+    overlap = torch.all((min_a[:, None, :] <= max_b[None, :, :]) &
+                        (min_b[None, :, :] <= max_a[:, None, :]), dim=-1)
+    index_a, index_b = torch.nonzero(overlap, as_tuple=True)
+    if len(index_a) == 0:
+        return iou
+
+    area_a = polygon_area_torch(quads_a)
+    area_b = polygon_area_torch(quads_b)
+    for start in range(0, len(index_a), chunk_size):
+        chunk_a = index_a[start:start + chunk_size]
+        chunk_b = index_b[start:start + chunk_size]
+        intersection = convex_quads_intersection_area_torch(quads_a[chunk_a],
+                                                            quads_b[chunk_b])
+        union = area_a[chunk_a] + area_b[chunk_b] - intersection
+        iou[chunk_a, chunk_b] = torch.where(
+            union > 0, intersection / torch.clamp(union, min=1e-12),
+            torch.zeros_like(union)).float()
+    return iou
+
+
+def rotated_boxes_iou(boxes_a, boxes_b):
+    """
+    Numpy interface of rotated_boxes_iou_torch.
+
+    Parameters
+    ----------
+    boxes_a : np.ndarray
+        (N, 8, 3) or (N, 4, 2) box corners. The first four corners are the
+        bottom face.
+
+    boxes_b : np.ndarray
+        (M, 8, 3) or (M, 4, 2)
+
+    Returns
+    -------
+    iou : np.ndarray
+        (N, M) float32 iou.
+    """
+    return rotated_boxes_iou_torch(
+        torch.from_numpy(np.asarray(boxes_a, dtype=np.float64)),
+        torch.from_numpy(np.asarray(boxes_b, dtype=np.float64))).numpy()
+
+
+def nms_rotated_torch(boxes, scores, threshold, top=1000):
+    """
+    Rotated non-maximum suppression with the ious computed on the device
+    of the boxes. Only the suppression matrix of the top candidates is
+    copied to the cpu for the greedy selection.
+
+    Parameters
+    ----------
+    boxes : torch.Tensor
+        The location preds with shape (N, 8, 3) or (N, 4, 2).
+
+    scores : torch.Tensor
+        The predicted confidence score with shape (N,)
+
+    threshold : float
+        IoU threshold to use for filtering.
+
+    top : int
+        Maximum number of candidates, the ones with the highest scores.
+
+    Returns
+    -------
+    keep_index : torch.Tensor
+        Long indices of the kept boxes, sorted by score.
+    """
+    if boxes.shape[0] == 0:
+        return torch.zeros(0, dtype=torch.long, device=boxes.device)
 
-    top = 1000
     # Get indicies of boxes sorted by scores (highest first)
-    ixs = scores.argsort()[::-1][:top]
+    ixs = torch.argsort(scores, descending=True)[:top]
+    overlap = rotated_boxes_iou_torch(boxes[ixs], boxes[ixs]) > threshold
+    overlap = overlap.cpu().numpy()
 
+    suppressed = np.zeros(len(overlap), dtype=bool)
     pick = []
-    while len(ixs) > 0:
-        # Pick top box and add its index to the list
-        i = ixs[0]
+    for i in range(len(overlap)):
+        if suppressed[i]:
+            continue
+        # Pick top remaining box and remove the boxes overlapping with it
         pick.append(i)
-        # Compute IoU of the picked box with the rest
-        iou = common_utils.compute_iou(polygons[i], polygons[ixs[1:]])
-        # Identify boxes with IoU over the threshold. This
-        # returns indices into ixs[1:], so add 1 to get
-        # indices into ixs.
-        remove_ixs = np.where(iou > threshold)[0] + 1
-        # Remove indices of the picked and overlapped boxes.
-        ixs = np.delete(ixs, remove_ixs)
-        ixs = np.delete(ixs, 0)
-
-    return np.array(pick, dtype=np.int32)
+        suppressed |= overlap[i]
+
+    return ixs[torch.as_tensor(pick, dtype=torch.long, device=boxes.device)]
 
 
 def nms_pytorch(boxes: torch.tensor, thresh_iou: float):
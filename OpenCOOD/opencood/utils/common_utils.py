@@ -18,6 +18,12 @@ def check_numpy_to_torch(x):
     return x, False
 
 
+def check_torch_to_numpy(x):
+    if isinstance(x, torch.Tensor):
+        return torch_tensor_to_numpy(x)
+    return x
+
+
 def check_contain_nan(x):
     if isinstance(x, dict):
         return any(check_contain_nan(v) for k, v in x.items())
@@ -138,10 +144,11 @@ def compute_iou(box, boxes):
         Array of iou between box and boxes.
 
     """
-    # Calculate intersection areas
-    if np.any(np.array([box.union(b).area for b in boxes])==0):
-        print('debug')
-    iou = [box.intersection(b).area / box.union(b).area for b in boxes]
+    iou = []
+    for b in boxes:
+        union = box.union(b).area
+        # degenerate boxes have no area
+        iou.append(box.intersection(b).area / union if union > 0 else 0)
 
     return np.array(iou, dtype=np.float32)
 
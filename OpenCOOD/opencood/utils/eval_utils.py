@@ -8,34 +8,343 @@ import os
 import numpy as np
 import torch
 
-from opencood.utils import common_utils
+from opencood.utils import box_utils, common_utils
 from opencood.hypes_yaml import yaml_utils
 
 
+# [min, max) distance to the ego of the range-binned ap, in meters, the
+# last bin is open-ended
+RANGE_BINS = [(0, 30), (30, 50), (50, float('inf'))]
+
+
 def voc_ap(rec, prec):
     """
     VOC 2010 Average Precision.
     """
-    rec.insert(0, 0.0)
-    rec.append(1.0)
-    mrec = rec[:]
+    mrec = np.concatenate([[0.0], np.asarray(rec, dtype=np.float64), [1.0]])
+    mpre = np.concatenate([[0.0], np.asarray(prec, dtype=np.float64), [0.0]])
+
+    # make the precision monotonically decreasing
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+
+    i_list = np.nonzero(mrec[1:] != mrec[:-1])[0] + 1
+    ap = float(np.sum((mrec[i_list] - mrec[i_list - 1]) * mpre[i_list]))
+    return ap, mrec.tolist(), mpre.tolist()
+
+
+def interpolated_ap(rec, prec, num_points):
+    """
+    N-point interpolated Average Precision, e.g. the 11 points of VOC 2007
+    or the 40 points of KITTI.
+
+    Parameters
+    ----------
+    rec : np.ndarray
+        Recall of the detections sorted by score.
+    prec : np.ndarray
+        Precision of the detections sorted by score.
+    num_points : int
+        11 samples the recall at 0, 0.1, ..., 1. Otherwise the recall is
+        sampled at 1 / num_points, 2 / num_points, ..., 1.
+
+    Returns
+    -------
+    ap : float
+    """
+    if num_points == 11:
+        sample_rec = np.linspace(0, 1, 11)
+    else:
+        sample_rec = np.linspace(1 / num_points, 1, num_points)
+
+    rec = np.asarray(rec, dtype=np.float64)
+    # the max precision at recall >= r
+    mpre = np.maximum.accumulate(
+        np.append(np.asarray(prec, dtype=np.float64), 0)[::-1])[::-1]
+    index = np.searchsorted(rec, sample_rec, side='left')
+    return float(np.mean(mpre[index]))
+
+
+def match_detections(det_boxes, det_score, gt_boxes, iou_thresholds,
+                     det_label=None, gt_label=None):
+    """
+    Greedily match the detections of a frame to the groundtruth for
+    several iou thresholds at once. The det x gt iou matrix is computed
+    only once.
+
+    Parameters
+    ----------
+    det_boxes : np.ndarray
+        The detection bounding box, shape (N, 8, 3) or (N, 4, 2).
+    det_score : np.ndarray
+        The confidence score for each preditect bounding box.
+    gt_boxes : np.ndarray
+        The groundtruth bounding box.
+    iou_thresholds : list
+        The iou thresholds.
+    det_label : np.ndarray
+        Optional class of the detections. Detections only match the gt
+        of the same class.
+    gt_label : np.ndarray
+        Optional class of the groundtruth.
+
+    Returns
+    -------
+    score_order_descend : np.ndarray
+        (N,) detection indices sorted by score from high to low.
+    matched_gt : np.ndarray
+        (len(iou_thresholds), N) gt index matched by each sorted detection
+        under each threshold, -1 for false positives.
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float32)
+
+    # sort the prediction bounding box by score
+    score_order_descend = np.argsort(-det_score)
+    matched_gt = np.full((len(thresholds), len(det_score)), -1,
+                         dtype=np.int64)
+    if len(gt_boxes) == 0 or len(det_score) == 0:
+        return score_order_descend, matched_gt
+
+    ious = box_utils.rotated_boxes_iou(det_boxes[score_order_descend],
+                                       gt_boxes)
+    if det_label is not None:
+        ious[det_label[score_order_descend][:, np.newaxis] !=
+             gt_label[np.newaxis, :]] = 0
+
+    # a detection can only match the gt left by the higher ones
+    matched = np.zeros((len(thresholds), len(gt_boxes)), dtype=bool)
+    threshold_index = np.arange(len(thresholds))
+    for i in range(len(det_score)):
+        remain_ious = np.where(matched, -1, ious[i])
+        gt_index = np.argmax(remain_ious, axis=1)
+        hit = remain_ious[threshold_index, gt_index] >= thresholds
+        matched_gt[hit, i] = gt_index[hit]
+        matched[threshold_index[hit], gt_index[hit]] = True
+
+    return score_order_descend, matched_gt
+
+
+def boxes_range(boxes):
+    """
+    BEV distance from the box centers to the ego.
+
+    Parameters
+    ----------
+    boxes : np.ndarray
+        (N, 8, 3) or (N, 4, 2) box corners.
+
+    Returns
+    -------
+    distance : np.ndarray
+        (N,)
+    """
+    center = np.mean(boxes[:, :4, :2], axis=1)
+    return np.linalg.norm(center, axis=1)
+
+
+def grow(array, size):
+    """
+    Return `array` with at least `size` slots on the last axis, doubling
+    its capacity if needed.
+    """
+    capacity = array.shape[-1]
+    if size <= capacity:
+        return array
+    while capacity < size:
+        capacity = max(capacity * 2, 1)
+    new_array = np.zeros(array.shape[:-1] + (capacity,), dtype=array.dtype)
+    new_array[..., :array.shape[-1]] = array
+    return new_array
+
 
-    prec.insert(0, 0.0)
-    prec.append(0.0)
-    mpre = prec[:]
+class ResultStat(object):
+    """
+    Accumulate the matching results of all frames into preallocated
+    arrays, growing them by doubling.
 
-    for i in range(len(mpre) - 2, -1, -1):
-        mpre[i] = max(mpre[i], mpre[i + 1])
+    Parameters
+    ----------
+    iou_thresholds : list
+        The iou thresholds to evaluate.
 
-    i_list = []
-    for i in range(1, len(mrec)):
-        if mrec[i] != mrec[i - 1]:
-            i_list.append(i)
+    capacity : int
+        Initial number of detections the arrays can hold.
+    """
 
-    ap = 0.0
-    for i in i_list:
-        ap += ((mrec[i] - mrec[i - 1]) * mpre[i])
-    return ap, mrec, mpre
+    def __init__(self, iou_thresholds=(0.3, 0.5, 0.7), capacity=65536):
+        self.iou_thresholds = list(iou_thresholds)
+        threshold_num = len(self.iou_thresholds)
+
+        # number of updates, used to keep the frame order when merging
+        self.frame_num = 0
+
+        self.det_num = 0
+        self.det_frame = np.zeros(capacity, dtype=np.int64)
+        self.tp = np.zeros((threshold_num, capacity), dtype=bool)
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.det_label = np.zeros(capacity, dtype=np.int64)
+        # range of the detection, or of its matched gt if it is a true
+        # positive, so a true positive is in the same bin as its gt
+        self.det_range = np.zeros((threshold_num, capacity),
+                                  dtype=np.float32)
+
+        self.gt_num = 0
+        self.gt_label = np.zeros(capacity, dtype=np.int64)
+        self.gt_range = np.zeros(capacity, dtype=np.float32)
+
+    def update(self, det_boxes, det_score, gt_boxes, det_label=None,
+               gt_label=None, frame_index=None):
+        """
+        Match the detections of a frame and save the results.
+
+        Parameters
+        ----------
+        det_boxes : torch.Tensor
+            The detection bounding box, shape (N, 8, 3) or (N, 4, 2). None
+            if nothing is detected.
+        det_score :torch.Tensor
+            The confidence score for each preditect bounding box.
+        gt_boxes : torch.Tensor
+            The groundtruth bounding box.
+        det_label : torch.Tensor
+            Optional class of the detections, 0 by default.
+        gt_label : torch.Tensor
+            Optional class of the groundtruth, 0 by default.
+        frame_index : int
+            Position of the frame in the evaluation order, by default the
+            number of previous updates. Detections of merged results are
+            ordered by it.
+        """
+        if frame_index is None:
+            frame_index = self.frame_num
+        self.frame_num += 1
+
+        gt_boxes = common_utils.check_torch_to_numpy(gt_boxes)
+        gt_num = gt_boxes.shape[0]
+        gt_range = boxes_range(gt_boxes)
+        gt_label = np.zeros(gt_num, dtype=np.int64) if gt_label is None \
+            else common_utils.check_torch_to_numpy(gt_label)
+
+        start = self.gt_num
+        self.gt_label = grow(self.gt_label, start + gt_num)
+        self.gt_range = grow(self.gt_range, start + gt_num)
+        self.gt_label[start:start + gt_num] = gt_label
+        self.gt_range[start:start + gt_num] = gt_range
+        self.gt_num += gt_num
+
+        if det_boxes is None:
+            return
+
+        det_boxes = common_utils.check_torch_to_numpy(det_boxes)
+        det_score = common_utils.check_torch_to_numpy(det_score)
+        det_num = det_boxes.shape[0]
+        det_label = np.zeros(det_num, dtype=np.int64) if det_label is None \
+            else common_utils.check_torch_to_numpy(det_label)
+
+        order, matched_gt = match_detections(det_boxes, det_score,
+                                             gt_boxes, self.iou_thresholds,
+                                             det_label, gt_label)
+        tp = matched_gt >= 0
+        det_range = np.where(tp, gt_range[np.maximum(matched_gt, 0)]
+                             if gt_num > 0 else 0,
+                             boxes_range(det_boxes)[order])
+
+        start = self.det_num
+        self.det_frame = grow(self.det_frame, start + det_num)
+        self.tp = grow(self.tp, start + det_num)
+        self.score = grow(self.score, start + det_num)
+        self.det_label = grow(self.det_label, start + det_num)
+        self.det_range = grow(self.det_range, start + det_num)
+        self.det_frame[start:start + det_num] = frame_index
+        self.tp[:, start:start + det_num] = tp
+        self.score[start:start + det_num] = det_score[order]
+        self.det_label[start:start + det_num] = det_label[order]
+        self.det_range[:, start:start + det_num] = det_range
+        self.det_num += det_num
+
+    def merge(self, others):
+        """
+        Merge the results of other ResultStat, e.g. from evaluation
+        workers, into this one. The detections are sorted by frame index,
+        thus the result does not depend on which worker evaluated a frame.
+
+        Parameters
+        ----------
+        others : list
+            List of ResultStat with the same iou thresholds.
+        """
+        stats = [self] + list(others)
+        for stat in stats:
+            assert stat.iou_thresholds == self.iou_thresholds
+
+        det_frame = np.concatenate([x.det_frame[:x.det_num] for x in stats])
+        # frames are never split across workers, so a stable sort keeps
+        # the score order inside a frame
+        order = np.argsort(det_frame, kind='stable')
+        self.det_frame = det_frame[order]
+        for name in ['tp', 'det_range']:
+            setattr(self, name, np.concatenate(
+                [getattr(x, name)[:, :x.det_num] for x in stats],
+                axis=1)[:, order])
+        for name in ['score', 'det_label']:
+            setattr(self, name, np.concatenate(
+                [getattr(x, name)[:x.det_num] for x in stats])[order])
+        self.det_num = len(order)
+
+        for name in ['gt_label', 'gt_range']:
+            setattr(self, name, np.concatenate(
+                [getattr(x, name)[:x.gt_num] for x in stats]))
+        self.gt_num = sum([x.gt_num for x in stats])
+        self.frame_num = sum([x.frame_num for x in stats])
+
+    def labels(self):
+        """
+        All the classes seen in the groundtruth and detections.
+        """
+        return np.union1d(self.gt_label[:self.gt_num],
+                          self.det_label[:self.det_num]).tolist()
+
+    def get(self, iou_thresh, label=None, range_bin=None):
+        """
+        The results of an iou threshold in the format of the legacy
+        result_stat dictionary, optionally only of a class or range bin.
+
+        Parameters
+        ----------
+        iou_thresh : float
+            The iou threshold.
+        label : int
+            Only keep this class if given.
+        range_bin : tuple
+            Only keep the [min, max) distance to the ego if given.
+
+        Returns
+        -------
+        stat : dict
+            tp, fp and score arrays of the detections, and the gt number.
+        """
+        i = self.iou_thresholds.index(iou_thresh)
+        tp = self.tp[i, :self.det_num]
+        det_mask = np.ones(self.det_num, dtype=bool)
+        gt_mask = np.ones(self.gt_num, dtype=bool)
+
+        if label is not None:
+            det_mask &= self.det_label[:self.det_num] == label
+            gt_mask &= self.gt_label[:self.gt_num] == label
+        if range_bin is not None:
+            det_range = self.det_range[i, :self.det_num]
+            gt_range = self.gt_range[:self.gt_num]
+            det_mask &= (det_range >= range_bin[0]) & \
+                (det_range < range_bin[1])
+            gt_mask &= (gt_range >= range_bin[0]) & (gt_range < range_bin[1])
+
+        tp = tp[det_mask]
+        return {'tp': tp.astype(np.int64),
+                'fp': (~tp).astype(np.int64),
+                'gt': int(np.count_nonzero(gt_mask)),
+                'score': self.score[:self.det_num][det_mask]}
+
+    def __getitem__(self, iou_thresh):
+        return self.get(iou_thresh)
 
 
 def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat, iou_thresh):
@@ -66,42 +375,26 @@ def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat, iou_thresh):
         det_score = common_utils.torch_tensor_to_numpy(det_score)
         gt_boxes = common_utils.torch_tensor_to_numpy(gt_boxes)
 
-        # sort the prediction bounding box by score
-        score_order_descend = np.argsort(-det_score)
-        det_score = det_score[score_order_descend] # from high to low
-        det_polygon_list = list(common_utils.convert_format(det_boxes))
-        gt_polygon_list = list(common_utils.convert_format(gt_boxes))
-
-        # match prediction and gt bounding box
-        for i in range(score_order_descend.shape[0]):
-            det_polygon = det_polygon_list[score_order_descend[i]]
-            ious = common_utils.compute_iou(det_polygon, gt_polygon_list)
-
-            if len(gt_polygon_list) == 0 or np.max(ious) < iou_thresh:
-                fp.append(1)
-                tp.append(0)
-                continue
+        order, matched_gt = match_detections(det_boxes, det_score,
+                                             gt_boxes, [iou_thresh])
+        tp = (matched_gt[0] >= 0).astype(int).tolist()
+        fp = (matched_gt[0] < 0).astype(int).tolist()
 
-            fp.append(0)
-            tp.append(1)
-
-            gt_index = np.argmax(ious)
-            gt_polygon_list.pop(gt_index)
-
-        result_stat[iou_thresh]['score'] += det_score.tolist()
+        result_stat[iou_thresh]['score'] += det_score[order].tolist()
 
     result_stat[iou_thresh]['fp'] += fp
     result_stat[iou_thresh]['tp'] += tp
     result_stat[iou_thresh]['gt'] += gt
 
 
-def calculate_ap(result_stat, iou, global_sort_detections):
+def calculate_ap(result_stat, iou, global_sort_detections, num_points=0,
+                 label=None, range_bin=None):
     """
     Calculate the average precision and recall, and save them into a txt.
 
     Parameters
     ----------
-    result_stat : dict
+    result_stat : ResultStat or dict
         A dictionary contains fp, tp and gt number.
         
     iou : float
@@ -109,50 +402,56 @@ def calculate_ap(result_stat, iou, global_sort_detections):
 
     global_sort_detections : bool
         Whether to sort the detection results globally.
+
+    num_points : int
+        0 for the VOC 2010 ap over all points, otherwise the number of
+        recall points of the interpolated ap, e.g. 11 or 40.
+
+    label : int
+        Only evaluate this class, requires a ResultStat.
+
+    range_bin : tuple
+        Only evaluate the [min, max) distance to the ego, requires a
+        ResultStat.
     """
-    iou_5 = result_stat[iou]
+    if label is not None or range_bin is not None:
+        iou_5 = result_stat.get(iou, label, range_bin)
+    else:
+        iou_5 = result_stat[iou]
 
-    if global_sort_detections:
-        fp = np.array(iou_5['fp'])
-        tp = np.array(iou_5['tp'])
-        score = np.array(iou_5['score'])
+    fp = np.asarray(iou_5['fp'], dtype=np.int64)
+    tp = np.asarray(iou_5['tp'], dtype=np.int64)
+    assert len(fp) == len(tp)
 
-        assert len(fp) == len(tp) and len(tp) == len(score)
+    if global_sort_detections:
+        score = np.asarray(iou_5['score'])
+        assert len(tp) == len(score)
         sorted_index = np.argsort(-score)
-        fp = fp[sorted_index].tolist()
-        tp = tp[sorted_index].tolist()
-        
-    else:
-        fp = iou_5['fp']
-        tp = iou_5['tp']
-        assert len(fp) == len(tp)
+        fp = fp[sorted_index]
+        tp = tp[sorted_index]
 
     gt_total = iou_5['gt']
+    if gt_total == 0:
+        # e.g. an empty range bin, the ap is undefined
+        return float('nan'), [], []
 
-    cumsum = 0
-    for idx, val in enumerate(fp):
-        fp[idx] += cumsum
-        cumsum += val
+    fp = np.cumsum(fp)
+    tp = np.cumsum(tp)
 
-    cumsum = 0
-    for idx, val in enumerate(tp):
-        tp[idx] += cumsum
-        cumsum += val
+    rec = tp / gt_total
+    prec = tp / (fp + tp)
 
-    rec = tp[:]
-    for idx, val in enumerate(tp):
-        rec[idx] = float(tp[idx]) / gt_total
+    if num_points:
+        return interpolated_ap(rec, prec, num_points), rec.tolist(), \
+            prec.tolist()
 
-    prec = tp[:]
-    for idx, val in enumerate(tp):
-        prec[idx] = float(tp[idx]) / (fp[idx] + tp[idx])
-
-    ap, mrec, mprec = voc_ap(rec[:], prec[:])
+    ap, mrec, mprec = voc_ap(rec, prec)
 
     return ap, mrec, mprec
 
 
-def eval_final_results(result_stat, save_path, global_sort_detections):
+def eval_final_results(result_stat, save_path, global_sort_detections,
+                       comm_stats=None):
     dump_dict = {}
 
     ap_30, mrec_30, mpre_30 = calculate_ap(result_stat, 0.30, global_sort_detections)
@@ -167,6 +466,13 @@ def eval_final_results(result_stat, save_path, global_sort_detections):
                       'mpre_70': mpre_70,
                       'mrec_70': mrec_70,
                       })
+
+    if isinstance(result_stat, ResultStat):
+        dump_dict.update(eval_detailed_results(result_stat,
+                                               global_sort_detections))
+    # communication cost of the run, e.g. the bytes sent per frame
+    if comm_stats:
+        dump_dict.update(comm_stats)
     
     output_file = 'eval.yaml' if not global_sort_detections else 'eval_global_sort.yaml'
     yaml_utils.save_yaml(dump_dict, os.path.join(save_path, output_file))
@@ -174,3 +480,53 @@ def eval_final_results(result_stat, save_path, global_sort_detections):
     print('The Average Precision at IOU 0.3 is %.2f, '
           'The Average Precision at IOU 0.5 is %.2f, '
           'The Average Precision at IOU 0.7 is %.2f' % (ap_30, ap_50, ap_70))
+    if comm_stats:
+        print(', '.join('%s: %.4g' % (name, value)
+                        for name, value in comm_stats.items()))
+
+
+def eval_detailed_results(result_stat, global_sort_detections):
+    """
+    The 11/40-point, per-class and range-binned ap of all iou thresholds,
+    from the same matching results.
+
+    Parameters
+    ----------
+    result_stat : ResultStat
+        The accumulated matching results.
+
+    global_sort_detections : bool
+        Whether to sort the detection results globally.
+
+    Returns
+    -------
+    dump_dict : dict
+        e.g. {'ap_50_r40': ..., 'ap_50_30-50m': ..., 'ap_50_50m+': ...,
+        'ap_50_class0': ...}
+    """
+    dump_dict = {}
+    labels = result_stat.labels()
+
+    for iou in result_stat.iou_thresholds:
+        name = 'ap_%d' % round(iou * 100)
+        for num_points in [11, 40]:
+            dump_dict['%s_r%d' % (name, num_points)] = calculate_ap(
+                result_stat, iou, global_sort_detections, num_points)[0]
+
+        range_aps = []
+        for range_bin in RANGE_BINS:
+            ap = calculate_ap(result_stat, iou, global_sort_detections,
+                              range_bin=range_bin)[0]
+            bin_name = '%dm+' % range_bin[0] \
+                if range_bin[1] == float('inf') \
+                else '%d-%dm' % (range_bin[0], range_bin[1])
+            dump_dict['%s_%s' % (name, bin_name)] = ap
+            range_aps.append('%s %.2f' % (bin_name, ap))
+        print('The Average Precision at IOU %.1f by range: %s'
+              % (iou, ', '.join(range_aps)))
+
+        for label in labels:
+            dump_dict['%s_class%d' % (name, label)] = calculate_ap(
+                result_stat, iou, global_sort_detections, label=label)[0]
+
+    return dump_dict
@@ -7,13 +7,57 @@
 Utility functions related to point cloud
 """
 
-import open3d as o3d
+import json
+import os
+import struct
+from functools import lru_cache
+
 import numpy as np
 
 
+# numpy dtype of the pcd TYPE/SIZE pairs
+PCD_TYPES = {('F', 4): np.float32, ('F', 8): np.float64,
+             ('I', 1): np.int8, ('I', 2): np.int16,
+             ('I', 4): np.int32, ('I', 8): np.int64,
+             ('U', 1): np.uint8, ('U', 2): np.uint16,
+             ('U', 4): np.uint32, ('U', 8): np.uint64}
+
+# packed point cloud store, one file per scenario
+PACK_FILE_NAME = 'lidar.pack'
+PACK_MAGIC = b'OCPCK\x00\x01\x00'
+# the point rows start at this byte offset
+PACK_DATA_OFFSET = 64
+PACK_POINT_DTYPES = {
+    # zero-copy (n, 4) float32 rows
+    'float32': np.dtype(('<f4', (4,))),
+    # 7 bytes per point, xyz float16 and intensity quantized to uint8
+    'float16': np.dtype([('xyz', '<f2', (3,)), ('intensity', 'u1')])}
+
+
 def pcd_to_np(pcd_file):
     """
-    Read pcd and return numpy array.
+    Read pcd and return numpy array. The native reader is used by default
+    and open3d is only used for the files it can not parse.
+
+    Parameters
+    ----------
+    pcd_file : str
+        The pcd file that contains the point cloud.
+
+    Returns
+    -------
+    pcd_np : np.ndarray
+        The lidar data in numpy format, shape:(n, 4)
+    """
+    try:
+        return read_pcd(pcd_file)
+    except (ValueError, KeyError, IndexError):
+        return pcd_to_np_open3d(pcd_file)
+
+
+def pcd_to_np_open3d(pcd_file):
+    """
+    Read pcd with open3d and return numpy array.
 
     Parameters
     ----------
@@ -26,7 +70,6 @@ def pcd_to_np(pcd_file):
         The lidar data in numpy format, shape:(n, 4)
     """
     import open3d as o3d
-    import numpy as np
 
     pcd = o3d.io.read_point_cloud(pcd_file)
 
@@ -42,6 +85,346 @@ def pcd_to_np(pcd_file):
     return np.asarray(pcd_np, dtype=np.float32)
 
 
+def read_pcd_header(f):
+    """
+    Parse the header of a pcd file.
+
+    Parameters
+    ----------
+    f : file object
+        The pcd file opened in binary mode. After parsing, the position is
+        at the beginning of the data section.
+
+    Returns
+    -------
+    header : dict
+        fields, size, type, count, points and data.
+
+    Raises
+    ------
+    ValueError
+        If the header is incomplete or malformed.
+    """
+    header = {}
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('Incomplete pcd header.')
+        line = line.decode('ascii', errors='ignore').strip()
+        if not line or line.startswith('#'):
+            continue
+        key, _, value = line.partition(' ')
+        header[key.lower()] = value.split()
+        if key.upper() == 'DATA':
+            break
+
+    try:
+        fields = header['fields']
+        header['count'] = [int(x) for x in
+                           header.get('count', ['1'] * len(fields))]
+        header['size'] = [int(x) for x in header['size']]
+        header['points'] = int(header['points'][0]) if 'points' in header \
+            else int(header['width'][0]) * int(header['height'][0])
+        header['data'] = header['data'][0].lower()
+        consistent = len(fields) == len(header['size']) == \
+            len(header['type']) == len(header['count'])
+    except (KeyError, IndexError) as e:
+        raise ValueError('Malformed pcd header: %r.' % e)
+
+    if not consistent:
+        raise ValueError('Inconsistent pcd header.')
+    return header
+
+
+def pcd_header_to_dtype(header):
+    """
+    Build the numpy structured dtype of a single point.
+    """
+    dtype = []
+    for i, (name, t, size, count) in enumerate(zip(header['fields'],
+                                                   header['type'],
+                                                   header['size'],
+                                                   header['count'])):
+        if (t, size) not in PCD_TYPES:
+            raise ValueError('Unsupported pcd field type %s%d.' % (t, size))
+        # padding fields are usually named '_' and may be repeated
+        name = name if name != '_' else '_padding_%d' % i
+        field_type = np.dtype(PCD_TYPES[(t, size)]).newbyteorder('<')
+        dtype.append((name, field_type) if count == 1
+                     else (name, field_type, (count,)))
+    return np.dtype(dtype)
+
+
+def lzf_decompress(data, output_size):
+    """
+    Decompress LZF data used by binary_compressed pcd files. The lzf module
+    is used when it is installed.
+    """
+    try:
+        import lzf
+        return lzf.decompress(data, output_size)
+    except ImportError:
+        pass
+
+    output = bytearray(output_size)
+    ip = 0
+    op = 0
+    while ip < len(data):
+        ctrl = data[ip]
+        ip += 1
+        if ctrl < 32:
+            # literal run of ctrl + 1 bytes
+            ctrl += 1
+            output[op:op + ctrl] = data[ip:ip + ctrl]
+            ip += ctrl
+            op += ctrl
+        else:
+            # back reference
+            length = ctrl >> 5
+            ref = op - ((ctrl & 0x1f) << 8) - 1
+            if length == 7:
+                length += data[ip]
+                ip += 1
+            ref -= data[ip]
+            ip += 1
+            length += 2
+            if ref < 0:
+                raise ValueError('Corrupted lzf data.')
+            if ref + length <= op:
+                output[op:op + length] = output[ref:ref + length]
+            else:
+                # overlapping copy repeats the referenced bytes
+                for i in range(length):
+                    output[op + i] = output[ref + i]
+            op += length
+
+    if op != output_size:
+        raise ValueError('Corrupted lzf data.')
+    return bytes(output)
+
+
+def read_pcd(pcd_file):
+    """
+    Read ascii, binary and binary_compressed pcd files with numpy only.
+    The output is the same as the open3d reader: the intensity column is
+    the red channel of the rgb field if there is one, otherwise ones.
+
+    Parameters
+    ----------
+    pcd_file : str
+        The pcd file that contains the point cloud.
+
+    Returns
+    -------
+    pcd_np : np.ndarray
+        The lidar data in numpy format, shape:(n, 4), float32.
+    """
+    with open(pcd_file, 'rb') as f:
+        header = read_pcd_header(f)
+        dtype = pcd_header_to_dtype(header)
+        num_points = header['points']
+
+        if header['data'] == 'binary':
+            points = np.fromfile(f, dtype=dtype, count=num_points)
+            if points.shape[0] != num_points:
+                raise ValueError('Truncated pcd file.')
+        elif header['data'] == 'ascii':
+            values = np.array(f.read().split(), dtype=np.float64)
+            columns = sum(header['count'])
+            if values.shape[0] != num_points * columns:
+                raise ValueError('Truncated pcd file.')
+            values = values.reshape(num_points, columns)
+            points = {}
+            column = 0
+            for name, count in zip(dtype.names, header['count']):
+                field_values = values[:, column] if count == 1 else \
+                    values[:, column:column + count]
+                points[name] = \
+                    field_values.astype(dtype.fields[name][0].base)
+                column += count
+        elif header['data'] == 'binary_compressed':
+            compressed_size, uncompressed_size = \
+                struct.unpack('<II', f.read(8))
+            buffer = lzf_decompress(f.read(compressed_size),
+                                    uncompressed_size)
+            # the decompressed data is stored field by field
+            points = {}
+            offset = 0
+            for name in dtype.names:
+                field_dtype = dtype.fields[name][0]
+                points[name] = np.frombuffer(
+                    buffer, dtype=field_dtype.base,
+                    count=num_points * max(1, field_dtype.itemsize //
+                                           field_dtype.base.itemsize),
+                    offset=offset).reshape((num_points,) +
+                                           field_dtype.shape)
+                offset += num_points * field_dtype.itemsize
+        else:
+            raise ValueError('Unknown pcd data type %s.' % header['data'])
+
+    names = dtype.names
+    if not all(x in names for x in ['x', 'y', 'z']):
+        raise ValueError('Missing xyz fields in pcd file.')
+
+    pcd_np = np.empty((num_points, 4), dtype=np.float32)
+    pcd_np[:, 0] = points['x']
+    pcd_np[:, 1] = points['y']
+    pcd_np[:, 2] = points['z']
+
+    rgb_name = 'rgb' if 'rgb' in names else 'rgba' if 'rgba' in names \
+        else None
+    if rgb_name is not None:
+        # rgb is packed into 4 bytes as 0x00RRGGBB
+        rgb = np.ascontiguousarray(points[rgb_name])
+        if rgb.dtype.itemsize != 4:
+            raise ValueError('Unsupported rgb field in pcd file.')
+        red = (rgb.view(np.uint32) >> 16) & 0xff
+        pcd_np[:, 3] = red / 255.0
+    else:
+        pcd_np[:, 3] = 1
+
+    return pcd_np
+
+
+def write_packed_pcd(pack_file, pcd_files, point_format='float32'):
+    """
+    Pack several pcd files into one contiguous binary file. The layout is
+    a magic header, the point rows of all frames, a json offset table and
+    the byte length of the table.
+
+    Parameters
+    ----------
+    pack_file : str
+        The output file.
+
+    pcd_files : dict
+        key: frame name (e.g. '641/000068.pcd'), value: pcd file path.
+
+    point_format : str
+        'float32' for (n, 4) float32 rows or 'float16' for float16 xyz
+        plus uint8 intensity.
+    """
+    point_dtype = PACK_POINT_DTYPES[point_format]
+    frames = {}
+    row = 0
+
+    with open(pack_file, 'wb') as f:
+        f.write(PACK_MAGIC)
+        f.seek(PACK_DATA_OFFSET)
+        for name, pcd_file in pcd_files.items():
+            pcd_np = pcd_to_np(pcd_file)
+            if point_format == 'float32':
+                points = pcd_np
+            else:
+                points = np.empty(pcd_np.shape[0], dtype=point_dtype)
+                points['xyz'] = pcd_np[:, :3]
+                points['intensity'] = \
+                    np.round(np.clip(pcd_np[:, 3], 0, 1) * 255)
+            f.write(np.ascontiguousarray(points).tobytes())
+            frames[name] = [row, pcd_np.shape[0]]
+            row += pcd_np.shape[0]
+
+        table = json.dumps({'point_format': point_format,
+                            'num_points': row,
+                            'frames': frames}).encode('utf-8')
+        f.write(table)
+        f.write(struct.pack('<Q', len(table)))
+
+
+@lru_cache(maxsize=16)
+def load_packed_pcd(pack_file):
+    """
+    Memory-map a packed point cloud file. The result is cached so that
+    each process only maps every scenario once.
+
+    Parameters
+    ----------
+    pack_file : str
+        The packed file.
+
+    Returns
+    -------
+    points : np.memmap
+        All point rows of the file, mapped copy-on-write.
+
+    table : dict
+        point_format, num_points and frames, key: frame name, value:
+        [first row, number of rows]. file_stat is the modification time
+        and size of the file when it was mapped.
+    """
+    with open(pack_file, 'rb') as f:
+        if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+            raise ValueError('%s is not a packed point cloud.' % pack_file)
+        f.seek(-8, os.SEEK_END)
+        table_len, = struct.unpack('<Q', f.read(8))
+        f.seek(-8 - table_len, os.SEEK_END)
+        table = json.loads(f.read(table_len).decode('utf-8'))
+        stat = os.fstat(f.fileno())
+        table['file_stat'] = [stat.st_mtime_ns, stat.st_size]
+
+    point_dtype = PACK_POINT_DTYPES[table['point_format']]
+    # writes from the downstream in-place ops never reach the file
+    points = np.memmap(pack_file, dtype=point_dtype, mode='c',
+                       offset=PACK_DATA_OFFSET,
+                       shape=(table['num_points'],))
+    return points, table
+
+
+def packed_frame(pcd_file):
+    """
+    Locate a frame of the dataset tree in the packed file of its scenario.
+
+    Parameters
+    ----------
+    pcd_file : str
+        The pcd file path of the frame, e.g. '.../scenario/641/000068.pcd'.
+        It does not need to exist.
+
+    Returns
+    -------
+    pack_file : str
+        The packed file of the scenario.
+
+    frame_name : str
+        The frame name used when packing, e.g. '641/000068.pcd'.
+    """
+    cav_path, pcd_name = os.path.split(pcd_file)
+    scenario_folder, cav_id = os.path.split(cav_path)
+    return os.path.join(scenario_folder, PACK_FILE_NAME), \
+        cav_id + '/' + pcd_name
+
+
+def packed_pcd_to_np(pack_file, frame_name):
+    """
+    Read a single frame from a packed point cloud file.
+
+    Parameters
+    ----------
+    pack_file : str
+        The packed file of the scenario.
+
+    frame_name : str
+        The frame name used when packing, e.g. '641/000068.pcd'.
+
+    Returns
+    -------
+    pcd_np : np.ndarray
+        The lidar data in numpy format, shape:(n, 4). For float32 packs it
+        is a view of the memory map without any copy.
+    """
+    points, table = load_packed_pcd(pack_file)
+    start, num = table['frames'][frame_name]
+    points = np.asarray(points[start:start + num])
+
+    if table['point_format'] == 'float32':
+        return points
+
+    pcd_np = np.empty((num, 4), dtype=np.float32)
+    pcd_np[:, :3] = points['xyz']
+    pcd_np[:, 3] = points['intensity'] / 255.0
+    return pcd_np
+
+
 def mask_points_by_range(points, limit_range):
     """
     Remove the lidar points out of the boundary.
@@ -56,9 +56,8 @@ def bbx2linset(bbx_corner, order='hwl', color=(0, 1, 0)):
     bbx_linset = []
 
     for i in range(bbx_corner.shape[0]):
-        bbx = bbx_corner[i]
-        # o3d use right-hand coordinate
-        bbx[:, :1] = - bbx[:, :1]
+        # o3d use right-hand coordinate, flip a copy of the caller's box
+        bbx = bbx_corner[i] * np.array([-1, 1, 1])
 
         line_set = o3d.geometry.LineSet()
         line_set.points = o3d.utility.Vector3dVector(bbx)
@@ -98,9 +97,8 @@ def bbx2oabb(bbx_corner, order='hwl', color=(0, 0, 1)):
     oabbs = []
 
     for i in range(bbx_corner.shape[0]):
-        bbx = bbx_corner[i]
-        # o3d use right-hand coordinate
-        bbx[:, :1] = - bbx[:, :1]
+        # o3d use right-hand coordinate, flip a copy of the caller's box
+        bbx = bbx_corner[i] * np.array([-1, 1, 1])
 
         tmp_pcd = o3d.geometry.PointCloud()
         tmp_pcd.points = o3d.utility.Vector3dVector(bbx)
@@ -302,8 +300,8 @@ def visualize_single_sample_output_gt(pred_tensor,
     origin_lidar_intcolor = \
         color_encoding(origin_lidar[:, -1] if mode == 'intensity'
                        else origin_lidar[:, 2], mode=mode)
-    # left -> right hand
-    origin_lidar[:, :1] = -origin_lidar[:, :1]
+    # left -> right hand, on a copy to keep the caller's lidar untouched
+    origin_lidar = origin_lidar[:, :3] * np.array([-1, 1, 1])
 
     o3d_pcd = o3d.geometry.PointCloud()
     o3d_pcd.points = o3d.utility.Vector3dVector(origin_lidar[:, :3])
@@ -432,8 +430,8 @@ def visualize_single_sample_dataloader(batch_data,
         color_encoding(origin_lidar[:, -1] if mode == 'intensity'
                        else origin_lidar[:, 2], mode=mode)
 
-    # left -> right hand
-    origin_lidar[:, :1] = -origin_lidar[:, :1]
+    # left -> right hand, on a copy to keep the caller's lidar untouched
+    origin_lidar = origin_lidar[:, :3] * np.array([-1, 1, 1])
 
     o3d_pcd.points = o3d.utility.Vector3dVector(origin_lidar[:, :3])
     o3d_pcd.colors = o3d.utility.Vector3dVector(origin_lidar_intcolor)
@@ -498,8 +496,8 @@ def visualize_inference_sample_dataloader(pred_box_tensor,
     if not isinstance(gt_box_tensor, np.ndarray):
         gt_box_tensor = common_utils.torch_tensor_to_numpy(gt_box_tensor)
 
-    # left -> right hand
-    origin_lidar[:, :1] = -origin_lidar[:, :1]
+    # left -> right hand, on a copy to keep the caller's lidar untouched
+    origin_lidar = origin_lidar[:, :3] * np.array([-1, 1, 1])
 
     o3d_pcd.points = o3d.utility.Vector3dVector(origin_lidar[:, :3])
     o3d_pcd.colors = o3d.utility.Vector3dVector(origin_lidar_intcolor)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import torch
+
+from opencood.utils import box_utils
+
+
+def rectangles(boxes):
+    """
+    (N, 4, 2) corners of the [x, y, l, w, yaw] rectangles.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    template = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]]) / 2
+    corners = template[None] * boxes[:, None, 2:4]
+    cos, sin = np.cos(boxes[:, 4]), np.sin(boxes[:, 4])
+    rotation = np.stack([np.stack([cos, -sin], -1),
+                         np.stack([sin, cos], -1)], 1)
+    return np.einsum('nij,nkj->nki', rotation, corners) + boxes[:, None, :2]
+
+
+def test_rotated_boxes_iou():
+    boxes_a = rectangles([[0, 0, 1, 1, 0]])
+    boxes_b = rectangles([[0, 0, 1, 1, 0],
+                          [0.5, 0, 1, 1, 0],
+                          [0, 0, 1, 1, np.pi / 4],
+                          [0, 0, 2, 0.5, np.pi / 2],
+                          [3, 3, 1, 1, 0.3]])
+    octagon = 2 * (np.sqrt(2) - 1)
+    expected = [1, 1 / 3, octagon / (2 - octagon), 0.5 / 1.5, 0]
+
+    iou = box_utils.rotated_boxes_iou(boxes_a, boxes_b)
+    assert iou.shape == (1, 5) and iou.dtype == np.float32
+    assert np.allclose(iou[0], expected, atol=1e-6)
+
+    # the 3d corners only use their bottom face
+    boxes_3d = np.concatenate([boxes_b, boxes_b], axis=1)
+    boxes_3d = np.concatenate([boxes_3d, np.zeros((5, 8, 1))], axis=2)
+    assert np.allclose(box_utils.rotated_boxes_iou(boxes_3d, boxes_3d),
+                       box_utils.rotated_boxes_iou(boxes_b, boxes_b))
+
+
+def test_rotated_boxes_iou_chunks():
+    np.random.seed(0)
+    boxes = np.concatenate([np.random.uniform(-5, 5, (60, 2)),
+                            np.random.uniform(1, 4, (60, 2)),
+                            np.random.uniform(-np.pi, np.pi, (60, 1))], 1)
+    boxes = torch.from_numpy(rectangles(boxes))
+
+    iou = box_utils.rotated_boxes_iou_torch(boxes, boxes)
+    assert torch.allclose(iou, iou.t(), atol=1e-6)
+    assert torch.allclose(torch.diagonal(iou), torch.ones(60))
+    assert torch.equal(
+        box_utils.rotated_boxes_iou_torch(boxes, boxes, chunk_size=7), iou)
+    assert box_utils.rotated_boxes_iou_torch(boxes[:0], boxes).shape == \
+        (0, 60)
+
+
+def test_nms_rotated():
+    boxes = torch.from_numpy(rectangles([[0, 0, 4, 2, 0],
+                                         [0.2, 0, 4, 2, 0.05],
+                                         [10, 0, 4, 2, 0],
+                                         [0, 0, 2, 4, 0]]))
+    scores = torch.tensor([0.5, 0.9, 0.3, 0.6])
+
+    # the second box suppresses the first one, the others barely overlap
+    keep = box_utils.nms_rotated(boxes, scores, 0.5)
+    assert keep.tolist() == [1, 3, 2]
+    assert keep.dtype == np.int32
+    assert box_utils.nms_rotated(boxes, scores, 0.01).tolist() == [1, 2]
+    assert len(box_utils.nms_rotated(boxes[:0], scores[:0], 0.5)) == 0
+
+
+def test_merge_object_stacks():
+    object_stack = [np.arange(14).reshape(2, 7),
+                    np.arange(14, 35).reshape(3, 7)]
+    object_id_stack = [5, 3, 5, 7, 3]
+
+    merged, unique_indices = \
+        box_utils.merge_object_stacks(object_stack, object_id_stack)
+    # the first occurrence of every id, in the order they appear
+    assert unique_indices.tolist() == [0, 1, 3]
+    assert np.array_equal(merged, np.vstack(object_stack)[[0, 1, 3]])
+
+    assert box_utils.unique_object_indices(
+        ['5', '3', '5', '7', '3']).tolist() == [0, 1, 3]
+    assert len(box_utils.unique_object_indices([])) == 0
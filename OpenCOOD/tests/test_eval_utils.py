@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import pytest
+
+from opencood.utils import box_utils, eval_utils
+
+
+def corners(boxes):
+    """
+    (N, 8, 3) corners of the [x, y, l, w, yaw] boxes.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 5)
+    boxes3d = np.zeros((len(boxes), 7), dtype=np.float32)
+    boxes3d[:, [0, 1, 3, 4, 6]] = boxes
+    boxes3d[:, 5] = 1.5
+    return box_utils.boxes_to_corners_3d(boxes3d, 'lwh')
+
+
+def random_frame(seed):
+    """
+    Groundtruth boxes and noisy detections with some misses and false
+    positives.
+    """
+    rng = np.random.RandomState(seed)
+    gt = np.concatenate([rng.uniform(-80, 80, (8, 2)),
+                         rng.uniform(3, 5, (8, 1)),
+                         rng.uniform(1.5, 2, (8, 1)),
+                         rng.uniform(-np.pi, np.pi, (8, 1))], axis=1)
+    det = gt[rng.rand(8) > 0.2].copy()
+    det[:, :2] += rng.normal(0, 0.5, (len(det), 2))
+    det = np.concatenate([det, gt[:2] + [[40, 40, 0, 0, 0]]])
+    return corners(det), rng.rand(len(det)).astype(np.float32), corners(gt)
+
+
+def test_perfect_detections():
+    gt_boxes = corners([[5, 0, 4, 2, 0], [40, 0, 4, 2, 1], [120, 0, 4, 2, 2]])
+    result_stat = eval_utils.ResultStat()
+    result_stat.update(gt_boxes, np.array([0.9, 0.8, 0.7]), gt_boxes)
+
+    for iou in result_stat.iou_thresholds:
+        assert eval_utils.calculate_ap(result_stat, iou, False)[0] == 1
+    detailed = eval_utils.eval_detailed_results(result_stat, False)
+    # the last range bin is open-ended
+    for name in ['ap_70_r11', 'ap_70_r40', 'ap_70_0-30m', 'ap_70_30-50m',
+                 'ap_70_50m+', 'ap_70_class0']:
+        assert detailed[name] == 1
+
+
+def test_false_positive_first():
+    gt_boxes = corners([[0, 0, 4, 2, 0], [10, 0, 4, 2, 0]])
+    det_boxes = corners([[0, 20, 4, 2, 0], [0, 0, 4, 2, 0],
+                         [10, 0, 4, 2, 0]])
+    result_stat = eval_utils.ResultStat(capacity=1)
+    result_stat.update(det_boxes, np.array([0.9, 0.8, 0.7]), gt_boxes)
+
+    assert result_stat[0.5]['tp'].tolist() == [0, 1, 1]
+    assert result_stat[0.5]['gt'] == 2
+    # precision 1/2 at recall 1/2 and 2/3 at recall 1
+    ap, _, _ = eval_utils.calculate_ap(result_stat, 0.5, False)
+    assert ap == pytest.approx(2 / 3)
+    assert eval_utils.calculate_ap(result_stat, 0.5, False, 11)[0] == \
+        pytest.approx(2 / 3)
+
+
+def test_merge():
+    frames = [random_frame(seed) for seed in range(10)]
+    expected = eval_utils.ResultStat(capacity=4)
+    for frame in frames:
+        expected.update(*frame)
+
+    # the frames are spread over the workers out of order
+    worker_stats = [eval_utils.ResultStat(capacity=4) for _ in range(3)]
+    for frame_index in np.random.RandomState(0).permutation(10):
+        worker_stats[frame_index % 3].update(*frames[frame_index],
+                                             frame_index=frame_index)
+    result_stat = eval_utils.ResultStat()
+    result_stat.merge(worker_stats)
+
+    assert result_stat.frame_num == 10
+    for iou in result_stat.iou_thresholds:
+        for name in ['tp', 'fp', 'score']:
+            assert np.array_equal(result_stat[iou][name],
+                                  expected[iou][name])
+        assert result_stat[iou]['gt'] == expected[iou]['gt']
+    assert eval_utils.eval_detailed_results(result_stat, False) == \
+        eval_utils.eval_detailed_results(expected, False)
+
+
+def test_labels():
+    gt_boxes = corners([[0, 0, 4, 2, 0], [10, 0, 4, 2, 0]])
+    result_stat = eval_utils.ResultStat()
+    # the box of class 1 sits on the gt of class 0
+    result_stat.update(gt_boxes, np.array([0.9, 0.8]), gt_boxes,
+                       det_label=np.array([1, 1]),
+                       gt_label=np.array([0, 1]))
+
+    assert result_stat.labels() == [0, 1]
+    assert result_stat[0.5]['tp'].tolist() == [0, 1]
+    # class 1: a false positive, then its only gt
+    assert eval_utils.calculate_ap(result_stat, 0.5, False, label=1)[0] == \
+        0.5
+    assert eval_utils.calculate_ap(result_stat, 0.5, False, label=0)[0] == 0
+
+    detailed = eval_utils.eval_detailed_results(result_stat, False)
+    assert detailed['ap_50_class0'] == 0 and detailed['ap_50_class1'] == 0.5
+    # no gt between 30 and 50 m
+    assert np.isnan(detailed['ap_50_30-50m'])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import os
+
+import numpy as np
+
+from opencood.data_utils.datasets.feature_cache import FeatureCache
+from opencood.utils import pcd_utils
+
+from test_pcd_utils import write_pcd
+
+
+def create_scenario(scenario_folder):
+    """
+    Two frames of a cav, returns their pcd files.
+    """
+    os.makedirs(os.path.join(scenario_folder, '641'))
+    lidar_files = [os.path.join(scenario_folder, '641', name)
+                   for name in ['000068.pcd', '000070.pcd']]
+    for lidar_file in lidar_files:
+        write_pcd(lidar_file, 'binary')
+    return lidar_files
+
+
+def test_feature_cache(tmp_path):
+    lidar_files = create_scenario(str(tmp_path / 'scenario'))
+    feature_cache = FeatureCache(str(tmp_path / 'cache'), {'vw': 0.4})
+    features = {'voxel_features': np.random.rand(5, 32, 4)}
+
+    key = feature_cache.key(lidar_files[0])
+    assert feature_cache.load(key) is None
+    feature_cache.save(key, features)
+    assert np.array_equal(feature_cache.load(key)['voxel_features'],
+                          features['voxel_features'])
+
+    assert feature_cache.key(lidar_files[0]) == key
+    assert feature_cache.key(lidar_files[1]) != key
+    assert feature_cache.key(lidar_files[0], np.eye(4)) != key
+    assert FeatureCache(str(tmp_path / 'cache'),
+                        {'vw': 0.2}).key(lidar_files[0]) != key
+
+    # a rewritten frame is preprocessed again
+    stat = os.stat(lidar_files[0])
+    os.utime(lidar_files[0],
+             ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert feature_cache.key(lidar_files[0]) != key
+
+
+def test_packed_feature_cache(tmp_path):
+    scenario_folder = str(tmp_path / 'scenario')
+    lidar_files = create_scenario(scenario_folder)
+    pack_file = os.path.join(scenario_folder, pcd_utils.PACK_FILE_NAME)
+    pcd_utils.write_packed_pcd(
+        pack_file, {'641/' + os.path.basename(x): x for x in lidar_files})
+    # packing makes the pcd files unnecessary
+    for lidar_file in lidar_files:
+        os.remove(lidar_file)
+
+    feature_cache = FeatureCache(str(tmp_path / 'cache'), {'vw': 0.4},
+                                 'packed')
+    key = feature_cache.key(lidar_files[0])
+    assert feature_cache.key(lidar_files[0]) == key
+    assert feature_cache.key(lidar_files[1]) != key
+
+    # the pack file of a new process is stat again
+    stat = os.stat(pack_file)
+    os.utime(pack_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    pcd_utils.load_packed_pcd.cache_clear()
+    assert feature_cache.key(lidar_files[0]) != key
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import importlib.util
+
+import pytest
+import torch
+
+from opencood.models.sub_modules.feature_codec import FeatureCodec, \
+    build_compressor
+from opencood.models.sub_modules.naive_compress import NaiveCompressor
+
+
+def build_codec(dtype, entropy_coder='none'):
+    torch.manual_seed(0)
+    return build_compressor(16, {'compression': 4,
+                                 'codec': {'dtype': dtype,
+                                           'entropy_coder': entropy_coder}})
+
+
+@pytest.mark.parametrize('entropy_coder', ['none', 'zlib'])
+def test_fp32_codec(entropy_coder):
+    codec = build_codec('fp32', entropy_coder)
+    torch.manual_seed(0)
+    compressor = NaiveCompressor(16, 4)
+    codec.eval()
+    compressor.eval()
+    x = torch.randn(3, 16, 10, 12)
+
+    with torch.no_grad():
+        assert torch.allclose(codec(x), compressor(x), atol=1e-6)
+    # header and fp32 values of the 4 compressed channels
+    assert entropy_coder != 'none' or \
+        codec.encoded_bytes_per_agent() == 20 + 4 * 10 * 12 * 4
+    assert codec.encoded_agents == 3
+
+    codec.reset_statistics()
+    assert codec.encoded_bytes_per_agent() == 0
+
+
+@pytest.mark.parametrize('dtype,atol', [('fp16', 1e-3), ('int8', 1e-2)])
+def test_quantized_codec(dtype, atol):
+    codec = build_codec(dtype, 'zlib')
+    x = torch.randn(2, 16, 10, 12)
+    codec.eval()
+
+    with torch.no_grad():
+        compressed = codec.encoder(x)
+        decoded = codec.decode(codec.encode(x))
+        expected = codec.decoder(compressed)
+        # the training simulates the quantization of the buffers
+        fake_quantized = codec.decoder(codec.fake_quantize(compressed))
+    assert torch.allclose(decoded, expected, atol=atol)
+    assert torch.allclose(decoded, fake_quantized, atol=1e-5)
+
+    # the straight-through estimator keeps the gradient of the identity
+    compressed.requires_grad_(True)
+    codec.fake_quantize(compressed).sum().backward()
+    assert torch.equal(compressed.grad, torch.ones_like(compressed))
+
+
+def test_build_compressor():
+    assert type(build_compressor(16, {'compression': 4})) is NaiveCompressor
+    assert isinstance(build_codec('fp16'), FeatureCodec)
+
+    with pytest.raises(AssertionError):
+        build_codec('int4')
+    if importlib.util.find_spec('lz4') is None:
+        with pytest.raises(AssertionError, match='lz4'):
+            build_codec('fp16', 'lz4')
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import pytest
+import torch
+
+from opencood.models.fuse_modules.coalign_fuse import Att_w_Warp
+from opencood.models.fuse_modules.fuse_utils import regroup
+from opencood.models.fuse_modules.v2v_fuse import V2VNetFusion
+from opencood.models.fuse_modules.where2comm_fuse import AttentionFusion, \
+    Communication, Where2comm, decode_sparse_feature, encode_sparse_feature
+
+RECORD_LEN = [3, 1, 4]
+C, H, W = 8, 12, 20
+
+
+def random_batch(seed=0):
+    torch.manual_seed(seed)
+    record_len = torch.tensor(RECORD_LEN)
+    x = torch.randn(int(record_len.sum()), C, H, W)
+    return x, record_len
+
+
+def random_pairwise_t_matrix(B, L, translation):
+    """
+    Random rotations around z and translations, identities on the
+    diagonal.
+    """
+    yaw = torch.rand(B, L, L) * 2 * np.pi
+    t_matrix = torch.eye(4).repeat(B, L, L, 1, 1)
+    t_matrix[..., 0, 0] = torch.cos(yaw)
+    t_matrix[..., 0, 1] = -torch.sin(yaw)
+    t_matrix[..., 1, 0] = torch.sin(yaw)
+    t_matrix[..., 1, 1] = torch.cos(yaw)
+    t_matrix[..., :2, 3] = (torch.rand(B, L, L, 2) - 0.5) * translation
+    t_matrix[:, torch.arange(L), torch.arange(L)] = torch.eye(4)
+    return t_matrix
+
+
+def split_samples(x, record_len):
+    start = torch.cumsum(record_len, dim=0) - record_len
+    return [x[s:s + n] for s, n in zip(start.tolist(), record_len.tolist())]
+
+
+def test_regroup():
+    x, record_len = random_batch()
+    regroup_feature, mask = regroup(x, record_len, 5)
+
+    assert regroup_feature.shape == (3, 5, C, H, W)
+    for b, sample in enumerate(split_samples(x, record_len)):
+        n = len(sample)
+        assert torch.equal(regroup_feature[b, :n], sample)
+        assert not regroup_feature[b, n:].any()
+        assert mask[b].tolist() == [1] * n + [0] * (5 - n)
+
+
+def build_v2vnet(gru_flag, agg_operator, max_message_memory=None):
+    torch.manual_seed(0)
+    args = {'in_channels': C,
+            'conv_gru': {'H': H, 'W': W, 'kernel_size': [[3, 3]],
+                         'num_layers': 1},
+            'voxel_size': [0.4, 0.4, 4],
+            'downsample_rate': 2,
+            'num_iteration': 2,
+            'gru_flag': gru_flag,
+            'agg_operator': agg_operator}
+    if max_message_memory is not None:
+        args['max_message_memory'] = max_message_memory
+    return V2VNetFusion(args)
+
+
+@pytest.mark.parametrize('gru_flag', [True, False])
+@pytest.mark.parametrize('agg_operator', ['avg', 'max'])
+def test_v2vnet_fusion(gru_flag, agg_operator):
+    x, record_len = random_batch()
+    pairwise_t_matrix = random_pairwise_t_matrix(3, 5, 8)
+
+    fusion = build_v2vnet(gru_flag, agg_operator)
+    x.requires_grad_(True)
+    output = fusion(x, record_len, pairwise_t_matrix)
+    output.sum().backward()
+    grad = x.grad.clone()
+
+    # the memory bound only splits the pairs into chunks, here of 3 pairs
+    x.grad = None
+    fusion.max_message_memory = 3.5 * 3 * C * H * W * 4 / 2 ** 20
+    expected = fusion(x, record_len, pairwise_t_matrix)
+    expected.sum().backward()
+    assert torch.allclose(output, expected, atol=1e-5)
+    assert torch.allclose(grad, x.grad, atol=1e-5)
+
+    # the samples of a batch do not interact
+    with torch.no_grad():
+        for b, sample in enumerate(split_samples(x, record_len)):
+            single = fusion(sample, record_len[b:b + 1],
+                            pairwise_t_matrix[b:b + 1])
+            assert torch.allclose(output[b:b + 1], single, atol=1e-5)
+
+
+def test_where2comm_communication():
+    torch.manual_seed(0)
+    _, record_len = random_batch()
+    psm_single = torch.randn(int(record_len.sum()), 2, H, W)
+    communication = Communication({'threshold': 0.5,
+                                   'gaussian_smooth': {'k_size': 5,
+                                                       'c_sigma': 1.0}})
+    communication.eval()
+
+    with torch.no_grad():
+        masks, rates = communication(psm_single, record_len)
+        single_rates = []
+        for b, sample in enumerate(split_samples(psm_single, record_len)):
+            single_masks, single_rate = \
+                communication(sample, record_len[b:b + 1])
+            assert torch.equal(split_samples(masks, record_len)[b],
+                               single_masks)
+            assert single_masks[0].all()
+            single_rates.append(single_rate)
+    assert torch.allclose(rates, torch.stack(single_rates).mean())
+
+
+def test_where2comm_fusion():
+    x, record_len = random_batch()
+    batch_node_features, mask = regroup(x, record_len, 4)
+    fusion = AttentionFusion(C)
+
+    output = fusion(batch_node_features, mask)
+    for b, sample in enumerate(split_samples(x, record_len)):
+        single = fusion(*regroup(sample, record_len[b:b + 1], len(sample)))
+        assert torch.allclose(output[b:b + 1], single, atol=1e-5)
+
+    # the collaborators only send the active cells, the attention at the
+    # other cells is computed in closed form
+    active_cells = torch.rand(3, H, W) > 0.7
+    sparse_features = batch_node_features.clone()
+    sparse_features[:, 1:] *= active_cells[:, None, None]
+    assert torch.allclose(fusion(sparse_features, mask, active_cells),
+                          fusion(sparse_features, mask), atol=1e-5)
+
+
+def test_coalign_att_w_warp():
+    x, record_len = random_batch()
+    affine_matrix = random_pairwise_t_matrix(3, 5, 0.5)[..., :2, [0, 1, 3]]
+    fusion = Att_w_Warp(C)
+
+    with torch.no_grad():
+        output = fusion(x, record_len, affine_matrix)
+        for b, sample in enumerate(split_samples(x, record_len)):
+            single = fusion(sample, record_len[b:b + 1],
+                            affine_matrix[b:b + 1])
+            assert torch.allclose(output[b:b + 1], single, atol=1e-5)
+
+
+@pytest.mark.parametrize('dtype,atol', [('fp32', 0), ('fp16', 1e-2),
+                                        ('int8', 5e-2)])
+def test_sparse_feature_roundtrip(dtype, atol):
+    torch.manual_seed(0)
+    feature = torch.randn(C, H, W)
+    cell_mask = torch.rand(H, W) > 0.6
+
+    buffer = encode_sparse_feature(feature, cell_mask, dtype)
+    decoded, decoded_mask = decode_sparse_feature(buffer)
+
+    assert torch.equal(decoded_mask, cell_mask)
+    assert not decoded[:, ~cell_mask].any()
+    assert torch.allclose(decoded[:, cell_mask], feature[:, cell_mask],
+                          atol=atol, rtol=0)
+    # header, indices, int8 scales and values
+    value_size = {'fp32': 4, 'fp16': 2, 'int8': 1}[dtype]
+    cell_num = int(cell_mask.sum())
+    assert len(buffer) == 20 + cell_num * (4 + C * value_size) + \
+        (cell_num * 4 if dtype == 'int8' else 0)
+
+
+def test_where2comm_sparse_transmission():
+    x, record_len = random_batch()
+    psm_single = torch.randn(int(record_len.sum()), 2, H, W)
+    fusion = Where2comm({'voxel_size': [0.4, 0.4, 4], 'downsample_rate': 2,
+                         'fully': False, 'multi_scale': False,
+                         'in_channels': C,
+                         'communication': {'threshold': 0.5,
+                                           'transmission': {
+                                               'dtype': 'fp32'}}})
+    fusion.eval()
+    pairwise_t_matrix = torch.eye(4).repeat(3, 5, 5, 1, 1)
+
+    with torch.no_grad():
+        output, rates = fusion(x, psm_single, record_len, pairwise_t_matrix)
+        summary = fusion.transmission_summary()
+        fusion.transmission_dtype = None
+        expected, expected_rates = fusion(x, psm_single, record_len,
+                                          pairwise_t_matrix)
+
+    assert torch.allclose(output, expected, atol=1e-5)
+    assert torch.equal(rates, expected_rates)
+    # the dense fp32 feature maps of the 5 collaborators
+    assert summary['dense_comm_bytes_per_frame'] == 5 * C * H * W * 4 / 3
+    assert summary['comm_bytes_per_frame'] < \
+        summary['dense_comm_bytes_per_frame']
+    assert 0 < summary['fusion_flops_saved'] < 1
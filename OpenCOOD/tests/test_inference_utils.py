@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import pytest
+import torch
+
+from opencood.tools.inference_utils import EvalWorkerPool
+from opencood.utils import eval_utils
+
+from test_eval_utils import random_frame
+
+
+def test_eval_worker_pool():
+    frames = [random_frame(seed) for seed in range(12)]
+    expected = eval_utils.ResultStat()
+    for frame in frames:
+        expected.update(*frame)
+
+    pool = EvalWorkerPool(expected.iou_thresholds, 3, max_queue_size=2,
+                          poll_interval=0.1)
+    for det_boxes, det_score, gt_boxes in frames:
+        pool.submit(torch.from_numpy(det_boxes),
+                    torch.from_numpy(det_score), torch.from_numpy(gt_boxes))
+    # a frame without detections
+    pool.submit(None, None, torch.from_numpy(frames[0][2]))
+    expected.update(None, None, frames[0][2])
+    result_stat = pool.close()
+
+    for iou in expected.iou_thresholds:
+        for name in ['tp', 'fp', 'score']:
+            assert np.array_equal(result_stat[iou][name],
+                                  expected[iou][name])
+        assert result_stat[iou]['gt'] == expected[iou]['gt']
+
+
+def test_eval_worker_failure():
+    pool = EvalWorkerPool([0.5], 2, poll_interval=0.1)
+    # a gt without corners
+    pool.submit(None, None, torch.zeros(3))
+
+    with pytest.raises(RuntimeError, match='evaluation worker failed'):
+        pool.close()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import os
+import sqlite3
+
+from opencood.data_utils.datasets.metadata_cache import MetadataCache
+
+
+class CountingParser(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return {'content': f.read()}
+
+
+def write(path, content, mtime_ns):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_lru(tmp_path):
+    paths = [str(tmp_path / ('%d.yaml' % i)) for i in range(3)]
+    for i, path in enumerate(paths):
+        write(path, str(i), 10 ** 18)
+
+    parser = CountingParser()
+    cache = MetadataCache(lru_size=2)
+    assert cache.load(paths[0], 'yaml', parser) == {'content': '0'}
+    assert cache.load(paths[0], 'yaml', parser) == {'content': '0'}
+    assert parser.calls == 1
+
+    # the same file with another parser is another record
+    cache.load(paths[0], 'json', parser)
+    assert parser.calls == 2
+
+    # the least recently used record is evicted
+    cache.load(paths[1], 'yaml', parser)
+    cache.load(paths[0], 'yaml', parser)
+    assert parser.calls == 4
+
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'frame.yaml')
+    db_path = str(tmp_path / 'metadata.sqlite')
+    write(path, 'a', 10 ** 18)
+
+    parser = CountingParser()
+    cache = MetadataCache(db_path, flush_size=2)
+    cache.load(path, 'yaml', parser)
+    # the record waits for a full batch
+    assert len(cache.pending) == 1
+    cache.flush()
+    assert not cache.pending
+
+    cache = MetadataCache(db_path)
+    assert cache.load(path, 'yaml', parser) == {'content': 'a'}
+    assert parser.calls == 1
+
+    # a rewritten file is parsed again
+    write(path, 'bb', 2 * 10 ** 18)
+    cache = MetadataCache(db_path)
+    assert cache.load(path, 'yaml', parser) == {'content': 'bb'}
+    assert parser.calls == 2
+
+
+def test_batched_writes(tmp_path):
+    db_path = str(tmp_path / 'metadata.sqlite')
+    paths = [str(tmp_path / ('%d.yaml' % i)) for i in range(5)]
+    for i, path in enumerate(paths):
+        write(path, str(i), 10 ** 18)
+
+    cache = MetadataCache(db_path, flush_size=2, flush_interval=3600)
+    for path in paths:
+        cache.load(path, 'yaml', CountingParser())
+
+    connection = sqlite3.connect(db_path)
+    count, = connection.execute('SELECT COUNT(*) FROM records').fetchone()
+    assert count == 4
+    del cache
+    count, = connection.execute('SELECT COUNT(*) FROM records').fetchone()
+    assert count == 5
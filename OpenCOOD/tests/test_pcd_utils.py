@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import struct
+
+import numpy as np
+import pytest
+
+from opencood.utils import pcd_utils
+
+
+def random_points(num):
+    np.random.seed(0)
+    xyz = np.random.uniform(-50, 50, (num, 3)).astype(np.float32)
+    red = np.random.randint(0, 256, num).astype(np.uint32)
+    rgb = (red << 16 | 7 << 8 | 9).view(np.float32)
+    return xyz, red, rgb
+
+
+def pcd_header(num, data):
+    return ('# .PCD v0.7 - Point Cloud Data file format\n'
+            'VERSION 0.7\nFIELDS x y z rgb\nSIZE 4 4 4 4\nTYPE F F F F\n'
+            'COUNT 1 1 1 1\nWIDTH %d\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\n'
+            'POINTS %d\nDATA %s\n' % (num, num, data)).encode('ascii')
+
+
+def lzf_literals(data):
+    """
+    LZF stream made of literal runs only, at most 32 bytes each.
+    """
+    output = bytearray()
+    for start in range(0, len(data), 32):
+        chunk = data[start:start + 32]
+        output.append(len(chunk) - 1)
+        output += chunk
+    return bytes(output)
+
+
+def write_pcd(path, data):
+    xyz, _, rgb = random_points(100)
+    with open(path, 'wb') as f:
+        f.write(pcd_header(len(xyz), data))
+        if data == 'binary':
+            points = np.empty((len(xyz), 4), dtype=np.float32)
+            points[:, :3] = xyz
+            points[:, 3] = rgb
+            f.write(points.tobytes())
+        else:
+            # field by field
+            buffer = xyz[:, 0].tobytes() + xyz[:, 1].tobytes() + \
+                xyz[:, 2].tobytes() + rgb.tobytes()
+            compressed = lzf_literals(buffer)
+            f.write(struct.pack('<II', len(compressed), len(buffer)))
+            f.write(compressed)
+
+
+@pytest.mark.parametrize('data', ['binary', 'binary_compressed'])
+def test_read_pcd(tmp_path, data):
+    path = str(tmp_path / 'frame.pcd')
+    write_pcd(path, data)
+    xyz, red, _ = random_points(100)
+
+    pcd_np = pcd_utils.read_pcd(path)
+    assert pcd_np.dtype == np.float32
+    assert np.array_equal(pcd_np[:, :3], xyz)
+    assert np.array_equal(pcd_np[:, 3], (red / 255.0).astype(np.float32))
+
+
+def test_read_ascii_pcd(tmp_path):
+    path = str(tmp_path / 'frame.pcd')
+    xyz, _, _ = random_points(100)
+    with open(path, 'wb') as f:
+        f.write(pcd_header(len(xyz), 'ascii').replace(b'rgb', b'intensity'))
+        for point in xyz:
+            f.write(('%r %r %r 0.5\n' % tuple(map(float, point))).encode())
+
+    pcd_np = pcd_utils.read_pcd(path)
+    assert np.array_equal(pcd_np[:, :3], xyz)
+    # no rgb field, the intensity is ones like the open3d reader
+    assert np.all(pcd_np[:, 3] == 1)
+
+
+@pytest.mark.parametrize('header', [
+    b'FIELDS x y z\nSIZE 4 4 4\nDATA binary\n',
+    b'FIELDS x y z\nSIZE 4 4 4\nTYPE F F F\nPOINTS\nDATA binary\n',
+    b'FIELDS x y z\nSIZE 4 4\nTYPE F F F\nPOINTS 1\nDATA binary\n',
+    b'FIELDS x y z\nSIZE 4 4 4\nTYPE F F F\nPOINTS 1\n'])
+def test_malformed_header_falls_back(tmp_path, monkeypatch, header):
+    path = str(tmp_path / 'frame.pcd')
+    with open(path, 'wb') as f:
+        f.write(header)
+
+    with pytest.raises(ValueError):
+        pcd_utils.read_pcd(path)
+    monkeypatch.setattr(pcd_utils, 'pcd_to_np_open3d',
+                        lambda pcd_file: 'open3d')
+    assert pcd_utils.pcd_to_np(path) == 'open3d'
+
+
+@pytest.mark.parametrize('data', ['binary', 'binary_compressed'])
+def test_open3d_reader_agrees(tmp_path, data):
+    pytest.importorskip('open3d')
+    path = str(tmp_path / 'frame.pcd')
+    write_pcd(path, data)
+
+    assert np.array_equal(pcd_utils.read_pcd(path),
+                          pcd_utils.pcd_to_np_open3d(path))
+
+
+@pytest.mark.parametrize('point_format', ['float32', 'float16'])
+def test_packed_pcd(tmp_path, point_format):
+    pcd_files = {}
+    for data in ['binary', 'binary_compressed']:
+        pcd_files['0/%s.pcd' % data] = str(tmp_path / ('%s.pcd' % data))
+        write_pcd(pcd_files['0/%s.pcd' % data], data)
+    pack_file = str(tmp_path / ('%s.pack' % point_format))
+    pcd_utils.write_packed_pcd(pack_file, pcd_files, point_format)
+
+    for name, pcd_file in pcd_files.items():
+        expected = pcd_utils.read_pcd(pcd_file)
+        output = pcd_utils.packed_pcd_to_np(pack_file, name)
+        assert output.shape == expected.shape
+        if point_format == 'float32':
+            assert np.array_equal(output, expected)
+        else:
+            assert np.allclose(output[:, :3], expected[:, :3], rtol=1e-3,
+                               atol=0.05)
+            assert np.allclose(output[:, 3], expected[:, 3], atol=1 / 255)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import torch
+
+from opencood.models.sub_modules.point_pillar_scatter import \
+    PointPillarScatter
+
+
+def test_point_pillar_scatter():
+    torch.manual_seed(0)
+    nx, ny, C = 20, 12, 6
+    scatter = PointPillarScatter({'num_features': C,
+                                  'grid_size': [nx, ny, 1]})
+
+    coords = []
+    for b, pillar_num in enumerate([30, 1, 50]):
+        cells = torch.randperm(nx * ny)[:pillar_num]
+        coords.append(torch.stack([torch.full_like(cells, b),
+                                   torch.zeros_like(cells),
+                                   cells // nx, cells % nx], dim=1))
+    coords = torch.cat(coords).int()
+    pillar_features = torch.randn(len(coords), C)
+
+    output = scatter({'pillar_features': pillar_features,
+                      'voxel_coords': coords})['spatial_features']
+
+    expected = torch.zeros(3, C, ny, nx)
+    for feature, (b, _, y, x) in zip(pillar_features, coords.long()):
+        expected[b, :, y, x] = feature
+    assert torch.equal(output, expected)
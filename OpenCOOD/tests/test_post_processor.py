@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import copy
+
+import numpy as np
+import torch
+
+from opencood.data_utils.post_processor.bev_postprocessor import \
+    BevPostprocessor
+from opencood.data_utils.post_processor.voxel_postprocessor import \
+    VoxelPostprocessor
+from opencood.utils import box_utils
+from opencood.utils.box_overlaps import bbox_overlaps
+
+VOXEL_PARAMS = {'core_method': 'VoxelPostprocessor',
+                'anchor_args': {'cav_lidar_range': [-20, -10, -3, 20, 10, 1],
+                                'l': 3.9, 'w': 1.6, 'h': 1.56, 'r': [0, 90],
+                                'feature_stride': 2, 'num': 2,
+                                'vw': 0.4, 'vh': 0.4, 'vd': 4,
+                                'W': 100, 'H': 50, 'D': 1},
+                'target_args': {'pos_threshold': 0.6, 'neg_threshold': 0.45,
+                                'score_threshold': 0.2},
+                'order': 'hwl', 'max_num': 20, 'nms_thresh': 0.15}
+
+
+def random_objects(lidar_range, object_num, max_num, seed):
+    """
+    Random hwl boxes inside the lidar range, padded to max_num.
+    """
+    rng = np.random.RandomState(seed)
+    object_bbx_center = np.zeros((max_num, 7))
+    object_bbx_center[:object_num] = np.column_stack([
+        rng.uniform(lidar_range[0], lidar_range[3], object_num),
+        rng.uniform(lidar_range[1], lidar_range[4], object_num),
+        rng.uniform(-2, 0, object_num),
+        rng.uniform(1.4, 2, object_num),
+        rng.uniform(1.5, 2.5, object_num),
+        rng.uniform(3.5, 6, object_num),
+        rng.uniform(-np.pi, np.pi, object_num)])
+    mask = np.zeros(max_num)
+    mask[:object_num] = 1
+    return object_bbx_center, mask
+
+
+def test_voxel_label():
+    post_processor = VoxelPostprocessor(VOXEL_PARAMS, train=True)
+    anchors = post_processor.generate_anchor_box()
+    assert post_processor.generate_anchor_box() is anchors
+    assert np.array_equal(anchors, post_processor.compute_anchor_box())
+
+    # the iou of the standup boxes of every anchor and gt
+    anchors_standup = box_utils.corner2d_to_standup_box(
+        box_utils.boxes_to_corners_3d(anchors.reshape(-1, 7), 'hwl'))
+    for object_num in [0, 1, 20]:
+        object_bbx_center, mask = random_objects(
+            VOXEL_PARAMS['anchor_args']['cav_lidar_range'], object_num, 20,
+            object_num)
+        label_dict = post_processor.generate_label(
+            gt_box_center=object_bbx_center, anchors=anchors, mask=mask)
+
+        gt_standup = box_utils.corner2d_to_standup_box(
+            box_utils.boxes_to_corners_3d(object_bbx_center[:object_num],
+                                          'hwl'))
+        iou = bbox_overlaps(anchors_standup.astype(np.float32),
+                            gt_standup.astype(np.float32))
+        # every gt keeps its best anchor
+        highest = iou.argmax(axis=0)[iou.max(axis=0, initial=0) > 0]
+        pos = (iou > 0.6).any(axis=1)
+        pos[highest] = True
+        neg = (iou < 0.45).all(axis=1)
+        neg[highest] = False
+
+        assert np.array_equal(label_dict['pos_equal_one'].reshape(-1), pos)
+        assert np.array_equal(label_dict['neg_equal_one'].reshape(-1), neg)
+        assert not label_dict['targets'].reshape(-1, 7)[~pos].any()
+
+
+def test_sparse_voxel_label():
+    post_processor = VoxelPostprocessor(VOXEL_PARAMS, train=True)
+    sparse_params = copy.deepcopy(VOXEL_PARAMS)
+    sparse_params['label_format'] = 'sparse'
+    sparse_post_processor = VoxelPostprocessor(sparse_params, train=True)
+
+    dense_batch = []
+    sparse_batch = []
+    for seed, object_num in enumerate([5, 0, 20]):
+        object_bbx_center, mask = random_objects(
+            VOXEL_PARAMS['anchor_args']['cav_lidar_range'], object_num, 20,
+            seed)
+        for processor, batch in [(post_processor, dense_batch),
+                                 (sparse_post_processor, sparse_batch)]:
+            batch.append(processor.generate_label(
+                gt_box_center=object_bbx_center,
+                anchors=processor.generate_anchor_box(), mask=mask))
+
+    dense_dict = post_processor.collate_batch(dense_batch)
+    sparse_dict = VoxelPostprocessor.expand_label(
+        sparse_post_processor.collate_batch(sparse_batch))
+    assert VoxelPostprocessor.expand_label(dense_dict) is dense_dict
+    for key in dense_dict:
+        assert torch.equal(dense_dict[key], sparse_dict[key])
+
+
+def test_bev_label_map():
+    geometry_param = {'L1': -10, 'W1': -8, 'H1': -3, 'L2': 10, 'W2': 8,
+                      'H2': 1, 'res': 0.5, 'downsample_rate': 2,
+                      'label_shape': [10, 8, 7]}
+    post_processor = BevPostprocessor({'core_method': 'BevPostprocessor',
+                                       'geometry_param': geometry_param,
+                                       'order': 'lwh'}, train=True)
+
+    # overlapping boxes, some of them across the borders
+    rng = np.random.RandomState(0)
+    object_bbx_center = np.column_stack([
+        rng.uniform(-11, 11, 12), rng.uniform(-9, 9, 12), np.zeros(12),
+        rng.uniform(3.5, 6, 12), rng.uniform(1.5, 2.5, 12), np.ones(12),
+        rng.uniform(-np.pi, np.pi, 12)])
+    bev_corners = box_utils.boxes_to_corners2d(object_bbx_center,
+                                               'lwh')[:, :, :2]
+    reg_targets = np.column_stack([np.cos(object_bbx_center[:, 6]),
+                                   np.sin(object_bbx_center[:, 6]),
+                                   object_bbx_center[:, [0, 1, 3, 4]]])
+    label_map = np.zeros(geometry_param['label_shape'])
+    post_processor.update_label_map(label_map, bev_corners, reg_targets)
+
+    # test every cell against every box, the later boxes overwrite
+    expected = np.zeros(geometry_param['label_shape'])
+    bev_corners_dist = (bev_corners - [[-10, -8]]) / 0.5 / 2
+    points = post_processor.get_label_points().reshape(-1, 2)
+    for corners_dist, reg_target in zip(bev_corners_dist, reg_targets):
+        points_in_box = box_utils.get_points_in_rotated_box(points,
+                                                            corners_dist)
+        center = points_in_box * 1.0 + [[-10, -8]]
+        expected[points_in_box[:, 0], points_in_box[:, 1], 0] = 1
+        expected[points_in_box[:, 0], points_in_box[:, 1], 1:] = \
+            np.concatenate([np.repeat([reg_target[:2]], len(center), 0),
+                            reg_target[2:4] - center,
+                            np.repeat([np.log(reg_target[4:])],
+                                      len(center), 0)], axis=1)
+
+    assert label_map[..., 0].sum() > 0
+    assert np.allclose(label_map, expected)
+
+
+def test_post_process_batch():
+    params = copy.deepcopy(VOXEL_PARAMS)
+    params['pre_nms_topk'] = 300
+    post_processor = VoxelPostprocessor(params, train=False)
+    anchor_box = torch.from_numpy(post_processor.generate_anchor_box())
+
+    torch.manual_seed(0)
+    psm = torch.randn(3, 2, 25, 50)
+    # nothing above the score threshold in the second frame
+    psm[1] = -10
+    rm = torch.randn(3, 14, 25, 50) * 0.1
+    transformation_matrix = torch.eye(4).repeat(3, 1, 1)
+    transformation_matrix[2, :2, 3] = torch.tensor([5., -3.])
+
+    pred_box3d_list, scores_list = post_processor.post_process_batch(
+        {'ego': {'anchor_box': anchor_box,
+                 'transformation_matrix': transformation_matrix}},
+        {'ego': {'psm': psm, 'rm': rm}})
+
+    # the same boxes as the frames processed one by one
+    assert pred_box3d_list[1] is None and scores_list[1] is None
+    for i in [0, 2]:
+        pred_box3d_tensor, scores = post_processor.post_process(
+            {'ego': {'anchor_box': anchor_box,
+                     'transformation_matrix': transformation_matrix[i]}},
+            {'ego': {'psm': psm[i:i + 1], 'rm': rm[i:i + 1]}})
+        assert len(scores) > 0
+        assert torch.equal(pred_box3d_list[i], pred_box3d_tensor)
+        assert torch.equal(scores_list[i], scores)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import torch
+
+from opencood.data_utils.pre_processor.bev_preprocessor import \
+    BevPreprocessor
+from opencood.data_utils.pre_processor.sp_voxel_preprocessor import \
+    SpVoxelPreprocessor
+from opencood.data_utils.pre_processor.voxel_generator import \
+    VoxelGenerator
+from opencood.data_utils.pre_processor.voxel_preprocessor import \
+    VoxelPreprocessor
+
+
+def random_points(num, seed=0):
+    np.random.seed(seed)
+    points = np.random.uniform(-10, 10, (num, 4)).astype(np.float32)
+    points[:, 2] = np.random.uniform(-3, 1, num)
+    points[:, 3] = np.random.uniform(0, 1, num)
+    return points
+
+
+def test_voxel_generator():
+    generator = VoxelGenerator(voxel_size=[1, 1, 4],
+                               lidar_range=[0, 0, -3, 4, 4, 1],
+                               max_points_per_voxel=2, max_voxels=3)
+    pcd_np = np.array([[2.5, 0.5, 0, 1],
+                       [0.5, 0.5, 0, 2],
+                       [2.2, 0.1, 0, 3],
+                       # outside the range
+                       [4.5, 0.5, 0, 4],
+                       [0.1, 0.9, 0, 5],
+                       [0.2, 0.2, 0, 6],
+                       [1.5, 3.5, 0, 7],
+                       # the fourth voxel is dropped
+                       [3.5, 3.5, 0, 8]], dtype=np.float32)
+    voxels, coordinates, num_points = generator.generate(pcd_np)
+
+    # ordered by the first point, at most 2 points per voxel
+    assert coordinates.tolist() == [[0, 0, 2], [0, 0, 0], [0, 3, 1]]
+    assert num_points.tolist() == [2, 2, 1]
+    assert voxels[..., 3].tolist() == [[1, 3], [2, 5], [7, 0]]
+
+
+def test_voxel_generator_batch():
+    generator = VoxelGenerator(voxel_size=[0.4, 0.4, 4],
+                               lidar_range=[-8, -8, -3, 8, 8, 1],
+                               max_points_per_voxel=4, max_voxels=500)
+    pcd_list = [random_points(num, seed) for seed, num in
+                enumerate([2000, 10, 1500])]
+    voxels, coordinates, num_points = generator.generate_batch(
+        [torch.from_numpy(x) for x in pcd_list])
+
+    for i, pcd_np in enumerate(pcd_list):
+        mask = coordinates[:, 0] == i
+        expected = generator.generate(pcd_np)
+        assert np.array_equal(voxels[mask].numpy(), expected[0])
+        assert np.array_equal(coordinates[mask, 1:].numpy(), expected[1])
+        assert np.array_equal(num_points[mask].numpy(), expected[2])
+    assert torch.all(coordinates[1:, 0] >= coordinates[:-1, 0])
+
+
+def test_voxel_preprocessor():
+    pre_processor = VoxelPreprocessor(
+        {'cav_lidar_range': [-10, -10, -3, 10, 10, 1],
+         'args': {'vw': 1, 'vh': 1, 'vd': 1, 'T': 3}}, False)
+    pcd_np = random_points(3000)
+    data_dict = pre_processor.preprocess(pcd_np)
+    voxel_features = data_dict['voxel_features']
+    voxel_coords = data_dict['voxel_coords']
+
+    unique_coords = np.unique(voxel_coords, axis=0)
+    assert np.array_equal(unique_coords, voxel_coords)
+
+    coords = (pcd_np[:, :3] - np.array([-10, -10, -3])).astype(
+        np.int32)[:, [2, 1, 0]]
+    for voxel, coord in zip(voxel_features, voxel_coords):
+        # the first T points of the voxel in their original order
+        points = pcd_np[np.all(coords == coord, axis=1)][:3]
+        assert np.array_equal(voxel[:len(points), :4], points)
+        assert np.allclose(voxel[:len(points), 4:],
+                           points[:, :3] - points[:, :3].mean(0), atol=1e-5)
+        assert not voxel[len(points):].any()
+
+
+def test_bev_preprocessor():
+    pre_processor = BevPreprocessor(
+        {'cav_lidar_range': [0, 0, 0, 4, 2, 2],
+         'geometry_param': {'L1': 0, 'W1': 0, 'H1': 0, 'res': 1,
+                            'input_shape': [4, 2, 3]},
+         'args': {'res': 1, 'downsample_rate': 1}}, False)
+    pcd_np = np.array([[0.5, 0.5, 0.5, 0.2],
+                       [0.5, 0.6, 1.5, 0.4],
+                       [3.5, 1.5, 0.5, 0.6],
+                       # top height bin, only counts for the intensity
+                       [2.5, 0.5, 2.5, 0.8],
+                       # outside the grid
+                       [4.5, 0.5, 0.5, 1.0],
+                       [0.5, 0.5, 3.5, 1.0]], dtype=np.float32)
+    bev = pre_processor.preprocess(pcd_np)['bev_input']
+
+    assert bev.shape == (3, 4, 2)
+    occupancy = np.zeros((2, 4, 2), dtype=np.float32)
+    occupancy[0, 0, 0] = occupancy[1, 0, 0] = occupancy[0, 3, 1] = 1
+    assert np.array_equal(bev[:2], occupancy)
+
+    intensity = np.zeros((4, 2), dtype=np.float32)
+    intensity[0, 0] = 0.3
+    intensity[3, 1] = 0.6
+    intensity[2, 0] = 0.8
+    assert np.allclose(bev[2], intensity)
+
+
+def test_bev_rasterize_torch():
+    geometry_param = {'L1': -10, 'W1': -10, 'H1': -3, 'L2': 10, 'W2': 10,
+                      'H2': 1, 'res': 0.4, 'downsample_rate': 4,
+                      'input_shape': [50, 50, 11]}
+    params = {'cav_lidar_range': [-10, -10, -3, 10, 10, 1],
+              'geometry_param': geometry_param,
+              'args': {'res': 0.4, 'downsample_rate': 4}}
+    pre_processor = BevPreprocessor(params, False)
+    params['args']['rasterize_on_device'] = True
+    device_pre_processor = BevPreprocessor(params, False)
+
+    # some points fall outside the grid or in the top height bin
+    pcd_list = [random_points(num, seed) * [1.1, 1.1, 1.2, 1]
+                for seed, num in enumerate([3000, 0, 500])]
+    expected = pre_processor.collate_batch(
+        [pre_processor.preprocess(x) for x in pcd_list])['bev_input']
+
+    batch = [device_pre_processor.preprocess(x) for x in pcd_list]
+    # early fusion collates a list of frames, intermediate fusion a dict
+    # of the merged cav features
+    for processed_lidar in [
+            device_pre_processor.collate_batch(batch),
+            device_pre_processor.collate_batch(
+                {'points': [x['points'] for x in batch]})]:
+        output = BevPreprocessor.rasterize_torch(processed_lidar,
+                                                 geometry_param)
+        assert output['bev_input'].dtype == torch.float32
+        assert torch.equal(output['bev_input'], expected)
+        assert output['bev_input'].stride() == expected.stride()
+
+
+def test_sp_voxelize_torch():
+    voxel_args = {'voxel_size': [0.4, 0.4, 4],
+                  'lidar_range': [-8, -8, -3, 8, 8, 1],
+                  'max_points_per_voxel': 4,
+                  'max_voxel_train': 300,
+                  'max_voxel_test': 500}
+    params = {'cav_lidar_range': voxel_args['lidar_range'],
+              'args': dict(voxel_args)}
+
+    pcd_list = [random_points(num, seed) for seed, num in
+                enumerate([2000, 0, 1500])]
+    for train in [True, False]:
+        pre_processor = SpVoxelPreprocessor(params, train)
+        expected = pre_processor.collate_batch(
+            [pre_processor.preprocess(x) for x in pcd_list])
+
+        device_pre_processor = SpVoxelPreprocessor(
+            dict(params, args=dict(params['args'], voxelize_on_device=True)),
+            train)
+        batch = [device_pre_processor.preprocess(x) for x in pcd_list]
+        for processed_lidar in [
+                device_pre_processor.collate_batch(batch),
+                device_pre_processor.collate_batch(
+                    {'points': [x['points'] for x in batch]})]:
+            output = SpVoxelPreprocessor.voxelize_torch(processed_lidar,
+                                                        voxel_args, train)
+            for key in expected:
+                assert torch.equal(output[key], expected[key])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import os
+
+import pytest
+
+from opencood.data_utils.datasets import scenario_index
+from opencood.data_utils.datasets.scenario_index import ScenarioIndex, \
+    cache_file_prefix
+
+
+def create_tree(root_dir, timestamp_nums, cav_num=2):
+    """
+    Create the folder layout of the dataset with empty frame files.
+    """
+    for i, timestamp_num in enumerate(timestamp_nums):
+        scenario_folder = os.path.join(root_dir, '%04d' % i)
+        os.makedirs(os.path.join(scenario_folder, 'cooperative'))
+        for cav_id in range(cav_num):
+            os.makedirs(os.path.join(scenario_folder, str(cav_id)))
+        for j in range(timestamp_num):
+            open(os.path.join(scenario_folder, 'cooperative',
+                              '%06d.json' % (2 * j)), 'w').close()
+
+
+@pytest.fixture
+def root_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    root_dir = str(tmp_path / 'train')
+    create_tree(root_dir, [3, 1, 4])
+    return root_dir
+
+
+def test_locate(root_dir):
+    index = ScenarioIndex(root_dir, max_cav=7)
+    assert len(index) == 3
+    assert index.len_record.tolist() == [3, 4, 8]
+
+    expected = [(s, t) for s, num in enumerate([3, 1, 4])
+                for t in range(num)]
+    for idx, (s, t) in enumerate(expected):
+        assert index.locate(idx) == (s, t)
+        assert index.timestamp_key(s, t) == '%06d' % (2 * t)
+        assert index.timestamp_index(s, '%06d' % (2 * t)) == t
+    assert index.timestamp_index(0, '000001') == -1
+
+    scenario = index[2]
+    assert list(scenario.keys()) == ['0', '1']
+    assert scenario['0']['ego'] and not scenario['1']['ego']
+    assert scenario['1']['000004']['lidar'] == \
+        os.path.join(root_dir, '0002', '1', '000004.pcd')
+
+
+def test_reload_and_rebuild(root_dir):
+    ScenarioIndex(root_dir, max_cav=7)
+    index_path = os.path.join(root_dir, scenario_index.INDEX_FILE_NAME)
+    assert os.path.isfile(index_path)
+
+    index = ScenarioIndex(root_dir, max_cav=7)
+    assert index.len_record.tolist() == [3, 4, 8]
+
+    # a new timestamp changes the mtime of its cooperative folder
+    new_file = os.path.join(root_dir, '0001', 'cooperative', '000002.json')
+    open(new_file, 'w').close()
+    stat = os.stat(os.path.dirname(new_file))
+    os.utime(os.path.dirname(new_file),
+             ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    index = ScenarioIndex(root_dir, max_cav=7)
+    assert index.len_record.tolist() == [3, 5, 9]
+
+
+def test_read_only_root(root_dir, monkeypatch):
+    access = os.access
+    monkeypatch.setattr(os, 'access',
+                        lambda path, mode: path != root_dir and
+                        access(path, mode))
+    index = ScenarioIndex(root_dir, max_cav=7)
+
+    assert not os.path.exists(
+        os.path.join(root_dir, scenario_index.INDEX_FILE_NAME))
+    assert index.index_path == cache_file_prefix(
+        scenario_index.user_cache_dir(), root_dir) + '.index'
+    assert os.path.isfile(index.index_path)
+    assert ScenarioIndex(root_dir, max_cav=7).len_record.tolist() == \
+        [3, 4, 8]
+
+
+def test_cache_file_prefix(tmp_path):
+    prefix = cache_file_prefix('cache', str(tmp_path / 'a' / 'train'))
+    assert os.path.basename(prefix).startswith('train_')
+    assert prefix != cache_file_prefix('cache',
+                                       str(tmp_path / 'b' / 'train'))
+    assert prefix == cache_file_prefix('cache',
+                                       str(tmp_path / 'a' / 'train') + '/')
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+import numpy as np
+import pytest
+import torch
+
+
+def test_inference_sample_keeps_inputs():
+    o3d = pytest.importorskip('open3d')
+    from opencood.visualization import vis_utils
+
+    torch.manual_seed(0)
+    origin_lidar = torch.rand(1, 100, 4)
+    pred_box = torch.rand(2, 8, 3)
+    gt_box = torch.rand(3, 8, 3)
+    inputs = [x.clone() for x in [origin_lidar, pred_box, gt_box]]
+
+    o3d_pcd, pred_o3d_box, gt_o3d_box = \
+        vis_utils.visualize_inference_sample_dataloader(
+            pred_box, gt_box, origin_lidar, o3d.geometry.PointCloud())
+
+    # the rendered geometry is flipped to the right-hand frame, the
+    # caller's tensors, which the evaluation may still read, are not
+    assert np.allclose(np.asarray(o3d_pcd.points),
+                       origin_lidar[0, :, :3].numpy() * [-1, 1, 1])
+    assert np.allclose(np.asarray(pred_o3d_box[0].points),
+                       pred_box[0].numpy() * [-1, 1, 1])
+    assert len(gt_o3d_box) == 3
+    for x, expected in zip([origin_lidar, pred_box, gt_box], inputs):
+        assert torch.equal(x, expected)